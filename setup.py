@@ -26,6 +26,12 @@ REQUIRED = [
     'todoist-python', 'pytz', 'jsonschema', 'python-dateutil', 'click', 'tqdm', 'virtualenv', 'urllib3<1.23'
 ]
 
+# What packages are optional?
+EXTRAS = {
+    # Parquet format of the 'export' command
+    'parquet': ['pyarrow'],
+}
+
 # The rest you shouldn't have to touch too much :)
 # ------------------------------------------------
 # Except, perhaps the License and Trove Classifiers!
@@ -104,6 +110,7 @@ setup(
         'console_scripts': ['todoist-gcal-sync=todoist_gcal_sync.utils.cli:cli'],
     },
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     include_package_data=True,
     license='MIT',
     keywords='todoist, google, calendar, sync, integration, daemon, visualization, productivity',
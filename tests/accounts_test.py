@@ -0,0 +1,129 @@
+import time
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+from todoist_gcal_sync import accounts, context, todo
+from todoist_gcal_sync.utils.auth import gcal_OAuth
+from todoist_gcal_sync.utils import cli, sql_ops
+from todoist_gcal_sync.utils.setup import helper
+
+
+def test_accounts_have_their_own_database(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_DIR_PATH', str(tmpdir) + '/')
+
+    for account in accounts.load_accounts(['alice', 'bob']):
+        context.activate_thread(account.context)
+        try:
+            sql_ops.init_db()
+            sql_ops.insert_many("todoist_sync", [account.name, 1])
+        finally:
+            context.activate_thread(None)
+
+    for name in ['alice', 'bob']:
+        context.activate_thread(context.AppContext(name))
+        try:
+            assert sql_ops.select_from_where("api_dot_sync", "todoist_sync", None, None, True) == [(name,)]
+        finally:
+            context.activate_thread(None)
+
+
+def test_accounts_are_served_in_round_robin(monkeypatch):
+    order = []
+    lock = threading.Lock()
+
+    def run_cycle(account):
+        with lock:
+            order.append(account.name)
+        time.sleep(0.01)
+
+    monkeypatch.setattr(accounts, 'run_cycle', run_cycle)
+    monkeypatch.setattr(accounts, 'USER_PREFS', {'daemon.refreshRateSec': 0, 'daemon.connErrDelaySec': 0})
+    account_list = accounts.load_accounts(['a', 'b', 'c', 'd'])
+    scheduler = accounts.Scheduler(account_list, workers=2, outbox_workers=1)
+
+    scheduler.run(stop=lambda: len(order) >= 20)
+    scheduler.shutdown()
+
+    # no account gets a second cycle before every other account had one
+    for start in range(0, 16, 4):
+        assert sorted(order[start:start + 4]) == ['a', 'b', 'c', 'd']
+
+
+def test_failing_account_does_not_stop_the_others(monkeypatch):
+    def run_cycle(account):
+        if account.name == 'broken':
+            raise SystemExit()
+        if account.name == 'offline':
+            raise ConnectionResetError()
+
+    monkeypatch.setattr(accounts, 'run_cycle', run_cycle)
+    monkeypatch.setattr(accounts, 'USER_PREFS', {'daemon.refreshRateSec': 0, 'daemon.connErrDelaySec': 0})
+    broken, offline, healthy = accounts.load_accounts(['broken', 'offline', 'healthy'])
+    scheduler = accounts.Scheduler([broken, offline, healthy], workers=1, outbox_workers=1)
+
+    scheduler.run(stop=lambda: healthy.cycles >= 3)
+    scheduler.shutdown()
+
+    assert broken.disabled and broken.cycles == 0
+    assert offline.failures >= 2 and not offline.disabled
+
+
+def test_timezone_of_a_fresh_install_comes_from_the_first_sync():
+    class FreshApi(object):
+        state = {'user': {}}
+
+        def sync(self):
+            self.state['user']['tz_info'] = {'timezone': 'Europe/Athens'}
+            return {}
+
+    app_context = context.AppContext()
+    app_context._todoist_api = FreshApi()
+    context.activate(app_context)
+    try:
+        assert todo.timezone() == 'Europe/Athens'
+    finally:
+        context.activate(None)
+
+
+def test_notes_of_a_fresh_install_are_indexed_once_synced(tmpdir, monkeypatch):
+    class FreshApi(object):
+        state = {'notes': []}
+
+        def sync(self):
+            self.state['notes'] = [{'id': 10, 'item_id': 1, 'content': 'draft', 'is_deleted': 0}]
+            return {}
+
+    monkeypatch.setattr(sql_ops, 'db_path', lambda: str(tmpdir) + '/fresh.db')
+    monkeypatch.setattr(sql_ops, 'init_db', lambda: None)
+    monkeypatch.setattr(todo, 'exclude_projects', lambda: None)
+    monkeypatch.setattr(todo, 'data_init', lambda: None)
+    app_context = context.AppContext()
+    app_context._todoist_api = FreshApi()
+    context.activate(app_context)
+    try:
+        todo.module_init()
+        assert todo.task_notes(1) == ['draft']
+    finally:
+        context.activate(None)
+
+
+def test_missing_google_credentials_are_reported(monkeypatch):
+    monkeypatch.setattr(gcal_OAuth, 'get_credentials', lambda file_name: None)
+
+    with pytest.raises(RuntimeError, match='credentials are missing'):
+        context.AppContext('work').gcal_build()
+
+
+def test_cleanup_works_on_the_database_of_the_account(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_DIR_PATH', str(tmpdir) + '/')
+    cleaned = []
+    monkeypatch.setattr(cli, 'self_cleanup', lambda workers, progress: cleaned.append(sql_ops.db_path()))
+    try:
+        result = CliRunner().invoke(cli.cli, ['cleanup', '--account', 'work'])
+    finally:
+        context.activate(None)
+
+    assert result.exit_code == 0
+    assert cleaned == [str(tmpdir) + '/work.db']
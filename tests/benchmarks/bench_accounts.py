@@ -0,0 +1,195 @@
+"""
+Offline benchmark of the multi-account mode (see todoist_gcal_sync/accounts.py):
+memory per account and accounts per core.
+
+The fake Todoist and Calendar servers of the accounts (fakes.py) run in a child
+process, so that the memory and the CPU time measured are the daemon's only.
+
+    import    every account is initialized (first cycle), its events pushed to Gcal;
+              reported: resident memory added per account
+    steady    the scheduler runs for --seconds, while --changes-per-sec task changes
+              are spread over the accounts; reported: cycles, CPU time per cycle, the
+              accounts a core can serve at "daemon.refreshRateSec", and fairness
+              (fewest and most cycles of an account)
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_accounts.py [--accounts N] [--tasks M] [--workers W]
+        [--seconds S] [--changes-per-sec C] [--latency-ms MS] [--json] [--verbose]
+"""
+
+import io
+import os
+import sys
+import gc
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from fakes import FakeTodoist, FakeCalendar
+from bench_sync import BenchContext, generate_account, skipped_pauses
+from todoist_gcal_sync import context
+from todoist_gcal_sync.utils.setup import helper
+
+
+def serve(conn, args):
+    """ Child process: runs the fake servers of the accounts and applies the task changes. """
+    servers = []
+    for n in range(args.accounts):
+        options = {'latency': args.latency_ms / 1000, 'seed': args.seed + n}
+        todoist_server = FakeTodoist(**options).start()
+        calendar_server = FakeCalendar(**options).start()
+        generate_account(todoist_server, args.projects, args.tasks, args.recurring, args.seed + n)
+        servers.append((todoist_server, calendar_server))
+    conn.send([(todoist_server.url, calendar_server.url) for todoist_server, calendar_server in servers])
+
+    rnd = random.Random(args.seed)
+    changes = 0
+    while True:
+        if conn.poll(1 / args.changes_per_sec if args.changes_per_sec else None):
+            command = conn.recv()
+            if command == 'stop':
+                break
+            if command == 'changes':
+                conn.send(changes)
+                changes = 0
+            elif command == 'start_changes':
+                changes = 0
+            continue
+        todoist_server = rnd.choice(servers)[0]
+        item_id = rnd.choice(sorted(todoist_server.items))
+        due = datetime.utcnow().replace(hour=21, minute=59, second=59, microsecond=0) + \
+            timedelta(days=rnd.randint(1, 9))
+        todoist_server.update_item(item_id, content='Renamed ' + str(changes), due=due)
+        changes += 1
+    conn.send(sum(sum(server.total_requests() for server in pair) for pair in servers))
+
+
+def rss_mb():
+    """ Resident memory of the process, in MB. """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(args):
+    from todoist_gcal_sync import accounts
+    from todoist_gcal_sync import outbox
+    from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+
+    workdir = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-')
+    helper.DB_DIR_PATH = workdir + '/'
+    helper.CACHE_DIR_PATH = workdir + '/'
+    USER_PREFS.data['daemon.refreshRateSec'] = args.refresh_rate
+
+    conn, child_conn = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=serve, args=(child_conn, args), daemon=True)
+    child.start()
+    urls = conn.recv()
+
+    # the modules and the discovery document are loaded once per process, not per account
+    gc.collect()
+    baseline_mb = rss_mb()
+
+    account_list = [accounts.Account(BenchContext(SimpleNamespace(url=todoist_url),
+                                                  SimpleNamespace(url=calendar_url),
+                                                  workdir + '/', 'account' + str(n)))
+                    for n, (todoist_url, calendar_url) in enumerate(urls)]
+    scheduler = accounts.Scheduler(account_list, args.workers, args.outbox_workers)
+    results = {'accounts': args.accounts, 'tasks_per_account': args.tasks,
+               'workers': args.workers, 'outbox_workers': args.outbox_workers}
+
+    pauses = [0.0]
+    with skipped_pauses(pauses):
+        start = time.perf_counter()
+        scheduler.run(stop=lambda: all(account.cycles or account.disabled for account in account_list))
+        for account in account_list:
+            context.activate(account.context)
+            outbox.wait()
+        context.activate(None)
+        results['import_seconds'] = round(time.perf_counter() - start, 2)
+
+        gc.collect()
+        results['baseline_mb'] = round(baseline_mb, 1)
+        results['rss_mb'] = round(rss_mb(), 1)
+        results['mb_per_account'] = round((rss_mb() - baseline_mb) / args.accounts, 2)
+
+        conn.send('start_changes')
+        cycles_before = [account.cycles for account in account_list]
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        scheduler.run(stop=lambda: time.perf_counter() >= deadline)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+        conn.send('changes')
+        changes = conn.recv()
+        cycles = [account.cycles - before for account, before in zip(account_list, cycles_before)]
+
+    scheduler.shutdown()
+    conn.send('stop')
+    results['server_requests'] = conn.recv()
+    child.join()
+
+    total_cycles = sum(cycles)
+    cpu_per_cycle = cpu / total_cycles if total_cycles else None
+    results.update({
+        'steady_seconds': round(elapsed, 1), 'task_changes': changes, 'cycles': total_cycles,
+        'cycles_per_account_min': min(cycles), 'cycles_per_account_max': max(cycles),
+        'cpu_seconds': round(cpu, 2),
+        'cpu_ms_per_cycle': round(cpu_per_cycle * 1000, 2) if cpu_per_cycle else None,
+        # an account needs one cycle per refresh interval
+        'accounts_per_core': int(args.refresh_rate / cpu_per_cycle) if cpu_per_cycle else None,
+        'refresh_rate_sec': args.refresh_rate,
+        'disabled_accounts': sum(account.disabled for account in account_list),
+        'skipped_pauses_sec': round(pauses[0], 1)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--projects', type=int, default=4)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--recurring', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4, help='threads running the sync cycles')
+    parser.add_argument('--outbox-workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of the steady phase')
+    parser.add_argument('--refresh-rate', type=float, default=1.3,
+                        help='daemon.refreshRateSec of the steady phase')
+    parser.add_argument('--changes-per-sec', type=float, default=5.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the daemon's logs and output")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+        results = run(args)
+    else:
+        logging.disable(logging.CRITICAL)
+        with redirect_stdout(io.StringIO()):
+            results = run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    for name, value in results.items():
+        print('{:>24}  {}'.format(name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Offline benchmark of the daemon's start after a long downtime, against the fake servers
+of fakes.py: an account of --tasks tasks, synced, then stopped while --changed of its tasks
+are renamed and --touched more get a change that leaves their event as it is (their order).
+
+Scenarios, each one run on a fresh copy of the same account:
+    downtime      the start syncs the changes made during the downtime
+    lost_cache    the Todoist cache is gone as well: the start is a full sync of every task
+    legacy_rows   lost_cache, the rows having been written by a version without the content
+                  hashes of the events (or flagged overdue since, see bench_sync.py)
+
+Starts, for each scenario:
+    replay        todo.sync_todoist(): every changed task goes through the outbox
+    catch_up      catch_up.run(): the changes are diffed against snapshots of the database
+                  and the calendars first
+
+Reported: duration of the start (until the outbox is drained), the task operations queued,
+the requests of both servers and the renamed events found on Gcal afterwards.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_catchup.py [--tasks N] [--changed C] [--touched T]
+        [--latency-ms MS] [--json]
+"""
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+from fakes import FakeTodoist, FakeCalendar
+from bench_sync import BenchContext, generate_account, skipped_pauses
+from todoist_gcal_sync import context
+from todoist_gcal_sync.utils.setup import helper
+
+SCENARIOS = ('downtime', 'lost_cache', 'legacy_rows')
+
+
+def run_start(args, scenario, start):
+    from todoist_gcal_sync import todo as todoist
+    from todoist_gcal_sync import catch_up
+    from todoist_gcal_sync import planner
+    from todoist_gcal_sync import outbox
+
+    workdir = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-')
+    helper.DB_PATH = workdir + '/data.db'
+    helper.CACHE_DIR_PATH = workdir + '/'
+
+    todoist_server = FakeTodoist(latency=args.latency_ms / 1000).start()
+    calendar_server = FakeCalendar(latency=args.latency_ms / 1000).start()
+    context.activate(BenchContext(todoist_server, calendar_server, workdir + '/'))
+    generate_account(todoist_server, 4, args.tasks, 0)
+
+    enqueue = outbox.enqueue
+    queued = [0]
+
+    def counted(operations):
+        queued[0] += sum(1 for operation in operations if operation['op'] != planner.PROJECT)
+        return enqueue(operations)
+
+    with skipped_pauses([0.0]):
+        todoist.module_init()
+        outbox.wait()
+
+        # the downtime
+        item_ids = sorted(todoist_server.items)
+        for item_id in item_ids[:args.changed]:
+            todoist_server.update_item(item_id, content='Renamed ' + str(item_id))
+        for item_id in item_ids[args.changed:args.changed + args.touched]:
+            todoist_server.update_item(item_id, item_order=todoist_server.items[item_id]['item_order'] + 1)
+        if scenario != 'downtime':
+            for path in glob.glob(os.path.join(workdir, 'bench*')):
+                os.remove(path)
+        if scenario == 'legacy_rows':
+            with sqlite3.connect(helper.DB_PATH) as conn:
+                conn.execute('UPDATE todoist SET event_hash = NULL')
+
+        # the start, with the Todoist API of a new process
+        context.activate(BenchContext(todoist_server, calendar_server, workdir + '/'))
+        needed = catch_up.needed
+        catch_up.needed = lambda sync_response: start == 'catch_up'
+        outbox.enqueue = counted
+        todoist_requests = todoist_server.total_requests()
+        gcal_requests = calendar_server.total_requests()
+        began = time.perf_counter()
+        try:
+            todoist.module_init()
+            outbox.wait()
+        finally:
+            catch_up.needed, outbox.enqueue = needed, enqueue
+        seconds = time.perf_counter() - began
+
+    with calendar_server.lock:
+        renamed = sum(1 for events in calendar_server.events.values() for event in events.values()
+                      if event['status'] != 'cancelled' and 'Renamed' in event['summary'])
+
+    todoist_server.stop()
+    calendar_server.stop()
+    return {'scenario': scenario, 'start': start, 'seconds': round(seconds, 3), 'queued': queued[0],
+            'gcal_requests': calendar_server.total_requests() - gcal_requests,
+            'todoist_requests': todoist_server.total_requests() - todoist_requests,
+            'renamed_on_gcal': renamed}
+
+
+def run(args):
+    return [run_start(args, scenario, start)
+            for scenario in SCENARIOS for start in ('replay', 'catch_up')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--changed', type=int, default=50, help='tasks renamed during the downtime')
+    parser.add_argument('--touched', type=int, default=500,
+                        help='tasks changed during the downtime, their event left as it is')
+    parser.add_argument('--latency-ms', type=float, default=10.0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with redirect_stdout(io.StringIO()):
+        results = run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    columns = ['scenario', 'start', 'seconds', 'queued', 'gcal_requests', 'todoist_requests',
+               'renamed_on_gcal']
+    print(' '.join('{:>16}'.format(column) for column in columns))
+    for result in results:
+        print(' '.join('{:>16}'.format(str(result[column])) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
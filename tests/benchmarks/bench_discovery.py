@@ -0,0 +1,56 @@
+"""
+Measures the time it takes to build the Calendar service on a cold start, with
+and without the discovery document cache. The uncached build needs access to
+www.googleapis.com and is skipped without it.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_discovery.py [runs]
+"""
+
+import sys
+import json
+import time
+import tempfile
+import httplib2
+from googleapiclient import discovery
+from todoist_gcal_sync.utils import discovery_doc
+from todoist_gcal_sync.utils.setup import helper
+
+
+def timed(func, runs):
+    """ Returns the median duration of func() in ms. """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return sorted(durations)[len(durations) // 2]
+
+
+def main(runs=5):
+    helper.CACHE_DIR_PATH = tempfile.mkdtemp() + '/'
+
+    def uncached():
+        discovery.build('calendar', 'v3', http=httplib2.Http(), cache_discovery=False,
+                        static_discovery=False)
+
+    def cached():
+        http = httplib2.Http()
+        discovery.build_from_document(discovery_doc.load(http, ttl_hours=1), http=http)
+
+    try:
+        print('discovery.build() without cache  {:8.1f} ms'.format(timed(uncached, runs)))
+    except (httplib2.HttpLib2Error, OSError) as err:
+        print('discovery.build() without cache  skipped: ' + str(err))
+
+    # fills the cache, from Google or from the bundled document
+    if discovery_doc.read_document(helper.CACHE_DIR_PATH + discovery_doc.DISCOVERY_FILE_NAME) is None:
+        document = discovery_doc.load(httplib2.Http(), ttl_hours=1)
+        discovery_doc.write_document(helper.CACHE_DIR_PATH + discovery_doc.DISCOVERY_FILE_NAME,
+                                     json.dumps(document))
+
+    print('discovery document from cache    {:8.1f} ms'.format(timed(cached, runs)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
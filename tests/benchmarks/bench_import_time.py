@@ -0,0 +1,43 @@
+"""
+Guards the import time of the daemon's modules, using 'python -X importtime'.
+
+Importing the package must neither touch the network nor the credentials; the
+API clients are built on first use by the application context.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_import_time.py [budget_ms]
+"""
+
+import subprocess
+import sys
+
+MODULES = ['todoist_gcal_sync.gcal_sync', 'todoist_gcal_sync.utils.cli']
+BUDGET_MS = 200
+
+
+def import_time_ms(module):
+    """ Returns the cumulative import time of a module in a fresh interpreter. """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError('No import time reported for ' + module)
+
+
+def main(budget_ms=BUDGET_MS):
+    over_budget = False
+    for module in MODULES:
+        # best of 3, to leave out a cold file system cache
+        elapsed = min(import_time_ms(module) for _ in range(3))
+        print('{:<40} {:8.1f} ms'.format(module, elapsed))
+        if elapsed > budget_ms:
+            over_budget = True
+            print('  exceeds the budget of ' + str(budget_ms) + ' ms')
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[float(arg) for arg in sys.argv[1:2]]))
@@ -0,0 +1,145 @@
+"""
+Offline benchmark of the Gcal ingest path of gcal_sync.cal_id(): resolving the task of
+each event of a page and parsing its summary.
+
+    per_event            the former path: a query per event (get_task_id), a linear
+                         api.items.get_by_id() and the former parse_out_icons() +
+                         split_priority() of gcal_sync.py
+    per_event_indexed    the same, with the event_id index of sql_ops.INDEXES
+    batch                gcal_sync.resolve_events(): one IN query per page against the
+                         index, the items of the page and a single pass per summary
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_ingest.py [--events N] [--tasks M] [--repeat R] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import tempfile
+
+import todoist
+from todoist.models import Item
+
+from todoist_gcal_sync import context
+from todoist_gcal_sync import gcal_sync
+from todoist_gcal_sync import todo
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils.setup import helper
+
+
+def split_priority(event_name):
+    """ Former gcal_sync.split_priority(), replaced by gcal_sync.parse_summary(). """
+    priorities = ['p1', 'p2', 'p3', 'p4']
+    sentence = ''
+    parsed_priority = None
+    if any(priority == event_name.split()[-1] for priority in priorities):
+        parsed_priority = int(event_name.split()[-1][1])
+        word_list = event_name.split()
+        del word_list[-1]
+        for word in word_list:
+            sentence += word + ' '
+    else:
+        sentence = event_name
+    return (sentence, parsed_priority)
+
+
+def parse_out_icons(event_name):
+    """ Former gcal_sync.parse_out_icons(), replaced by gcal_sync.parse_summary(). """
+    last_icon = None
+    for char in event_name.split():
+        if any(icon == char for icon in helper.ICONS['icons.eventSet']):
+            last_icon = char
+    return event_name.split(last_icon, 1)[1].strip()
+
+
+def per_event(events):
+    """ The ingest path before the batch stage. """
+    resolved = []
+    for event in events:
+        task_id = todo.get_task_id(event['id'])
+        item = todo.get_task(task_id)
+        event_name = parse_out_icons(event['summary'])
+        resolved.append((event, task_id, item, split_priority(event_name)))
+    return resolved
+
+
+def measure(func, events, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(events)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {'ms_per_page': round(best * 1000, 2),
+            'us_per_event': round(best / len(events) * 1e6, 1)}
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-')
+    helper.DB_PATH = os.path.join(workdir, 'data.db')
+    app_context = context.AppContext()
+    app_context._todoist_api = api = todoist.TodoistAPI('bench', cache=workdir + '/')
+    context.activate(app_context)
+    sql_ops.init_db()
+
+    icons = helper.ICONS['icons.eventSet']
+    rows = []
+    for task_id in range(args.tasks):
+        api.state['items'].append(Item({'id': task_id, 'content': 'Task ' + str(task_id),
+                                        'project_id': 1}, api))
+        rows.append([1, None, task_id, None, 'event' + str(task_id), None, 0, 0, None])
+    sql_ops.insert_rows('todoist', rows)
+
+    # the changed events of a page, each one linked to a task
+    step = max(args.tasks // args.events, 1)
+    events = [{'id': 'event' + str(task_id), 'status': 'confirmed',
+               'summary': icons[task_id % 4] + ' ' + icons[4 + task_id % 10] + ' Task ' +
+               str(task_id) + (' p' + str(1 + task_id % 4) if task_id % 3 == 0 else '')}
+              for task_id in range(0, args.tasks, step)][:args.events]
+
+    results = {'events': len(events), 'tasks': args.tasks}
+    for index_name, table_name, column_name in sql_ops.INDEXES:
+        with sqlite3.connect(helper.DB_PATH) as conn:
+            conn.execute('DROP INDEX ' + index_name)
+    results['per_event'] = measure(per_event, events, args.repeat)
+    sql_ops.init_db()
+    results['per_event_indexed'] = measure(per_event, events, args.repeat)
+    results['batch'] = measure(gcal_sync.resolve_events, events, args.repeat)
+
+    # both paths find the same tasks and names
+    assert [(task_id, summary[0] if summary else None)
+            for event, task_id, item, summary in gcal_sync.resolve_events(events)] == \
+        [(task_id, parse_out_icons(event['summary']))
+         for event, task_id, item, split in per_event(events)]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=2500, help='events per page')
+    parser.add_argument('--tasks', type=int, default=5000, help='tasks of the account')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    print('{} events per page, {} tasks'.format(results['events'], results['tasks']))
+    for name in ['per_event', 'per_event_indexed', 'batch']:
+        print('{:>20}  {:>10} ms/page  {:>8} us/event'.format(
+            name, results[name]['ms_per_page'], results[name]['us_per_event']))
+
+
+if __name__ == '__main__':
+    main()
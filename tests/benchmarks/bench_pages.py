@@ -0,0 +1,137 @@
+"""
+Offline benchmark of the Gcal incremental sync of a large calendar (gcal_sync.sync_gcal()),
+against the fake servers of fakes.py: --events events created in Gcal directly (not linked
+to a task) and --changed events of tasks change on the Gcal side, then one Gcal sync pass
+picks the changes up.
+
+Configurations, each one run on the same changes:
+    default_page     pages of the API's default size (250), every field, no prefetch
+    projected        'gcal.pageSize' events per page, gcal_sync.EVENT_FIELDS only, no prefetch
+    streamed         projected, with the next page prefetched (gcal_sync.event_pages())
+
+Reported: duration of the pass, events.list requests and the bytes of their responses.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_pages.py [--events N] [--changed C] [--page-size P]
+        [--latency-ms MS] [--json]
+"""
+
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+from fakes import FakeTodoist, FakeCalendar
+from bench_sync import BenchContext, generate_account, skipped_pauses
+from todoist_gcal_sync import context
+from todoist_gcal_sync.utils.setup import helper
+
+
+def sequential_pages(calendar_id, sync_token):
+    """ gcal_sync.event_pages() without the prefetch. """
+    from todoist_gcal_sync import gcal_sync
+
+    page = gcal_sync.fetch_events(calendar_id, sync_token)
+    while page is not None:
+        yield page
+        page = gcal_sync.fetch_events(calendar_id, sync_token, page['nextPageToken']) \
+            if page.get('nextPageToken') else None
+
+
+def run(args):
+    from todoist_gcal_sync import todo as todoist
+    from todoist_gcal_sync import gcal_sync
+    from todoist_gcal_sync import outbox
+    from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+
+    workdir = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-')
+    helper.DB_PATH = workdir + '/data.db'
+    helper.CACHE_DIR_PATH = workdir + '/'
+
+    todoist_server = FakeTodoist(latency=args.latency_ms / 1000).start()
+    calendar_server = FakeCalendar(latency=args.latency_ms / 1000).start()
+    context.activate(BenchContext(todoist_server, calendar_server, workdir + '/'))
+    generate_account(todoist_server, 1, args.tasks, 0)
+
+    fields, event_pages = gcal_sync.EVENT_FIELDS, gcal_sync.event_pages
+    configurations = [
+        ('default_page', FakeCalendar.PAGE_SIZE, None, sequential_pages),
+        ('projected', args.page_size, fields, sequential_pages),
+        ('streamed', args.page_size, fields, event_pages)]
+
+    results = []
+    with skipped_pauses([0.0]):
+        todoist.module_init()
+        outbox.wait()
+
+        # events of the user, in the calendar of the project
+        with calendar_server.lock:
+            calendar_id, task_events = max(calendar_server.events.items(), key=lambda pair: len(pair[1]))
+            task_events = list(task_events.values())[:args.changed]
+            foreign_events = []
+            for n in range(args.events):
+                event = {'id': 'own' + str(n), 'kind': 'calendar#event', 'status': 'confirmed',
+                         'summary': 'Meeting ' + str(n), 'description': 'Agenda ' * 40,
+                         'location': 'Room ' + str(n % 20), 'start': {'date': '2030-01-01'},
+                         'end': {'date': '2030-01-02'}, 'htmlLink': 'https://calendar/event?eid=' + str(n),
+                         'creator': {'email': 'user@example.com'}, 'organizer': {'email': 'user@example.com'},
+                         'reminders': {'useDefault': True}, 'etag': '"' + str(n) + '"'}
+                calendar_server.events[calendar_id][event['id']] = calendar_server._touch(event)
+                foreign_events.append(event)
+        gcal_sync.sync_gcal()
+
+        for name, page_size, event_fields, pages in configurations:
+            with calendar_server.lock:
+                for event in foreign_events + task_events:
+                    event['description'] = name
+                    calendar_server._touch(event)
+
+            USER_PREFS.data['gcal.pageSize'] = page_size
+            gcal_sync.EVENT_FIELDS, gcal_sync.event_pages = event_fields, pages
+            requests = calendar_server.requests.get('events.list', 0)
+            list_bytes = calendar_server.response_bytes_by_method.get('events.list', 0)
+            start = time.perf_counter()
+            gcal_sync.sync_gcal()
+            results.append({'configuration': name, 'page_size': page_size,
+                            'seconds': round(time.perf_counter() - start, 3),
+                            'list_requests': calendar_server.requests['events.list'] - requests,
+                            'list_kb': round((calendar_server.response_bytes_by_method['events.list']
+                                              - list_bytes) / 1024)})
+
+    gcal_sync.EVENT_FIELDS, gcal_sync.event_pages = fields, event_pages
+    todoist_server.stop()
+    calendar_server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=5000, help='changed events without a task')
+    parser.add_argument('--changed', type=int, default=20, help='changed events of tasks')
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with redirect_stdout(io.StringIO()):
+        results = run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    columns = ['configuration', 'page_size', 'seconds', 'list_requests', 'list_kb']
+    print(' '.join('{:>14}'.format(column) for column in columns))
+    for result in results:
+        print(' '.join('{:>14}'.format(str(result[column])) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
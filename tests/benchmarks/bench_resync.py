@@ -0,0 +1,149 @@
+"""
+Offline benchmark of the recovery of a calendar whose sync token has expired (410 GONE),
+against the fake servers of fakes.py: a calendar of --events events, --tasks of them
+synced from Todoist, where --changed task events are renamed, --changed moved to another
+day and --changed deleted while the sync token is no longer valid.
+
+Recoveries, each one run on a fresh copy of the same account:
+    replay        every event of the calendar is listed and goes through the handlers of
+                  an incremental sync (cal_id() without a sync token)
+    diff          gcal_sync.full_resync(): every event is listed and diffed with the
+                  "todoist" table, only the events gone or changed go through the handlers
+
+Reported: duration of the recovery, events handled and the requests of both servers.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_resync.py [--events N] [--tasks T] [--changed C]
+        [--latency-ms MS] [--json]
+"""
+
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+from fakes import FakeTodoist, FakeCalendar
+from bench_sync import BenchContext, generate_account, skipped_pauses
+from todoist_gcal_sync import context
+from todoist_gcal_sync.utils.setup import helper
+
+
+def replay(calendar_id):
+    """ The recovery without a diff: the handlers of an incremental sync on every event. """
+    from todoist_gcal_sync import gcal_sync
+
+    return gcal_sync.cal_id(calendar_id, None)
+
+
+def run_recovery(args, name, recovery):
+    from todoist_gcal_sync import todo as todoist
+    from todoist_gcal_sync import gcal_sync
+    from todoist_gcal_sync import outbox
+    from todoist_gcal_sync.utils import sql_ops
+
+    workdir = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-')
+    helper.DB_PATH = workdir + '/data.db'
+    helper.CACHE_DIR_PATH = workdir + '/'
+
+    todoist_server = FakeTodoist(latency=args.latency_ms / 1000).start()
+    calendar_server = FakeCalendar(latency=args.latency_ms / 1000).start()
+    context.activate(BenchContext(todoist_server, calendar_server, workdir + '/'))
+    generate_account(todoist_server, 1, args.tasks, 0)
+
+    full_resync, handle_event = gcal_sync.full_resync, gcal_sync.handle_event
+    handled = [0]
+
+    def counted(*event_args):
+        handled[0] += 1
+        return handle_event(*event_args)
+
+    with skipped_pauses([0.0]):
+        todoist.module_init()
+        outbox.wait()
+
+        with calendar_server.lock:
+            calendar_id, events = max(calendar_server.events.items(), key=lambda pair: len(pair[1]))
+            for n in range(args.events - len(events)):
+                event = {'id': 'own' + str(n), 'kind': 'calendar#event', 'status': 'confirmed',
+                         'summary': 'Meeting ' + str(n), 'description': 'Agenda ' * 40,
+                         'start': {'date': '2030-01-01'}, 'end': {'date': '2030-01-02'}}
+                events[event['id']] = calendar_server._touch(event)
+        gcal_sync.sync_gcal()
+
+        # the changes made while the sync token is no longer valid
+        with calendar_server.lock:
+            task_events = sorted((event for event in events.values() if not event['id'].startswith('own')),
+                                 key=lambda event: event['id'])
+            for event in task_events[:args.changed]:
+                event['summary'] += ' renamed'
+                calendar_server._touch(event)
+            for event in task_events[args.changed:2 * args.changed]:
+                event['start'] = event['end'] = {'date': '2030-06-01'}
+                calendar_server._touch(event)
+            for event in task_events[2 * args.changed:3 * args.changed]:
+                event['status'] = 'cancelled'
+                calendar_server._touch(event)
+        sql_ops.update_set_where("gcal_ids", "calendar_sync_token = ?", "calendar_id = ?",
+                                 'expired', calendar_id)
+
+        gcal_sync.full_resync, gcal_sync.handle_event = recovery, counted
+        todoist_requests = todoist_server.total_requests()
+        gcal_requests = calendar_server.total_requests()
+        start = time.perf_counter()
+        try:
+            gcal_sync.sync_gcal()
+        finally:
+            gcal_sync.full_resync, gcal_sync.handle_event = full_resync, handle_event
+        seconds = time.perf_counter() - start
+        outbox.wait()
+
+        sync_token = sql_ops.select_from_where(
+            "calendar_sync_token", "gcal_ids", "calendar_id", calendar_id)[0]
+        remaining = sum(1 for item in todoist_server.items.values() if not item['is_deleted'])
+
+    todoist_server.stop()
+    calendar_server.stop()
+    return {'recovery': name, 'events': len(events), 'seconds': round(seconds, 3),
+            'handled': handled[0], 'gcal_requests': calendar_server.total_requests() - gcal_requests,
+            'todoist_requests': todoist_server.total_requests() - todoist_requests,
+            'resynced': sync_token != 'expired', 'tasks_left': remaining}
+
+
+def run(args):
+    from todoist_gcal_sync import gcal_sync
+
+    return [run_recovery(args, 'replay', replay),
+            run_recovery(args, 'diff', gcal_sync.full_resync)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=10000, help='events of the calendar')
+    parser.add_argument('--tasks', type=int, default=500, help='events of the calendar linked to a task')
+    parser.add_argument('--changed', type=int, default=10, help='events renamed, moved and deleted each')
+    parser.add_argument('--latency-ms', type=float, default=10.0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with redirect_stdout(io.StringIO()):
+        results = run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    columns = ['recovery', 'events', 'seconds', 'handled', 'gcal_requests', 'todoist_requests',
+               'resynced', 'tasks_left']
+    print(' '.join('{:>16}'.format(column) for column in columns))
+    for result in results:
+        print(' '.join('{:>16}'.format(str(result[column])) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
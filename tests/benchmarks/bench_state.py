@@ -0,0 +1,208 @@
+"""
+Offline benchmark of the memory held by the Todoist state of the daemon, against the fake
+Todoist of fakes.py: an account of --tasks tasks (with --notes notes and --history tasks
+completed in the past), synced by each state in a process of its own.
+
+States:
+    stock      todoist.TodoistAPI (every object, as dicts of every field)
+    compact    todoist_state.CompactTodoistAPI (see todoist_state.py)
+
+Steps, for each state:
+    full_sync  first sync of the account
+    history    --cycles syncs each completing --completed tasks, then what
+               todo.init_completed_tasks() used to do: completed/get_all and an items/get
+               of each of the 200 tasks, and the sync of the next cycle
+    reload     a new process loading the cache file written by the syncs
+
+Reported: resident memory (VmRSS over the one of the process once the modules are imported,
+Linux only, which keeps the peak of parsing the responses), the memory held by the state
+itself, its objects, the duration of each step and the size of the cache file.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_state.py [--tasks N] [--notes K] [--history H]
+        [--cycles C] [--completed M] [--json]
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+from fakes import FakeTodoist
+
+STATES = ('stock', 'compact')
+
+
+def rss_kb():
+    """ Resident memory of the process, in kB. """
+    gc.collect()
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def generate_account(todoist_server, tasks, notes, history, seed=0):
+    """ Fills the fake Todoist; returns the ids of the tasks still to do. """
+    rnd = random.Random(seed)
+    today = datetime.utcnow().replace(hour=21, minute=59, second=59, microsecond=0)
+    project_ids = [todoist_server.add_project('Project ' + str(n))['id'] for n in range(60)]
+
+    item_ids = []
+    for n in range(tasks + history):
+        due = today + timedelta(days=rnd.randint(-30, 60))
+        item = todoist_server.add_item(rnd.choice(project_ids), 'Task ' + str(n) + ' of the account',
+                                       due=due, priority=rnd.randint(1, 4), labels=[rnd.randint(1, 9)])
+        if n >= tasks:
+            todoist_server.update_item(item['id'], checked=1, in_history=1)
+        else:
+            item_ids.append(item['id'])
+    for note_id in range(notes):
+        todoist_server.add_note(rnd.choice(item_ids), 'Note ' + str(note_id) + ' ' + 'x' * 80)
+    return item_ids
+
+
+def state_class(state):
+    if state == 'compact':
+        from todoist_gcal_sync import todoist_state
+        return todoist_state.CompactTodoistAPI
+    import todoist
+    return todoist.TodoistAPI
+
+
+def state_size(api):
+    return sum(len(api.state[datatype]) for datatype in ('items', 'projects', 'notes'))
+
+
+def state_mb(api):
+    """ Memory held by the objects of the state (shared objects counted once), in MB. """
+    seen = set()
+    size = 0
+    pending = [api.state]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or obj is api:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            pending.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            pending.append(obj.__dict__)
+        for key in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, key):
+                pending.append(getattr(obj, key))
+    return round(size / 1024 / 1024, 1)
+
+
+def run_sync(args):
+    """ full_sync and history steps, in the process of one state. """
+    api_class = state_class(args.state)
+    base = rss_kb()
+    api = api_class('bench', api_endpoint=args.url, cache=args.cache)
+
+    results = []
+    start = time.perf_counter()
+    api.sync()
+    results.append({'step': 'full_sync', 'seconds': round(time.perf_counter() - start, 2),
+                    'rss_mb': round((rss_kb() - base) / 1024, 1), 'objects': state_size(api),
+                    'state_mb': state_mb(api)})
+
+    item_ids = json.loads(args.item_ids)
+    start = time.perf_counter()
+    for cycle in range(args.cycles):
+        api.items.complete(item_ids[cycle * args.completed:(cycle + 1) * args.completed])
+        api.commit()
+    for completed in api.completed.get_all(limit=200)['items'][:200]:
+        api.items.get(completed['task_id'])
+    # the sync of the next cycle, as todo.todoist_sync() runs it
+    if hasattr(api, 'evict'):
+        api.evict()
+    api.sync()
+    results.append({'step': 'history', 'seconds': round(time.perf_counter() - start, 2),
+                    'rss_mb': round((rss_kb() - base) / 1024, 1), 'objects': state_size(api),
+                    'state_mb': state_mb(api),
+                    'cache_mb': round(os.path.getsize(args.cache + 'bench.json') / 1024 / 1024, 1)})
+    return results
+
+
+def run_reload(args):
+    """ reload step, in the process of one state. """
+    api_class = state_class(args.state)
+    base = rss_kb()
+    start = time.perf_counter()
+    api = api_class('bench', api_endpoint=args.url, cache=args.cache)
+    return [{'step': 'reload', 'seconds': round(time.perf_counter() - start, 2),
+             'rss_mb': round((rss_kb() - base) / 1024, 1), 'objects': state_size(api),
+             'state_mb': state_mb(api)}]
+
+
+def child(args, state, step, url, cache, item_ids=None):
+    command = [sys.executable, __file__, '--child', step, '--state', state, '--url', url,
+               '--cache', cache, '--cycles', str(args.cycles), '--completed', str(args.completed)]
+    if item_ids is not None:
+        command += ['--item-ids', json.dumps(item_ids)]
+    output = subprocess.check_output(command, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    return json.loads(output)
+
+
+def run(args):
+    results = []
+    for state in STATES:
+        # a fresh account for each state, the syncs complete tasks
+        todoist_server = FakeTodoist().start()
+        item_ids = generate_account(todoist_server, args.tasks, args.notes, args.history)
+        cache = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-') + '/'
+        try:
+            steps = child(args, state, 'sync', todoist_server.url, cache,
+                          item_ids[:args.cycles * args.completed]) + \
+                child(args, state, 'reload', todoist_server.url, cache)
+        finally:
+            todoist_server.stop()
+        for step in steps:
+            step['state'] = state
+        results += steps
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=30000)
+    parser.add_argument('--notes', type=int, default=3000)
+    parser.add_argument('--history', type=int, default=500)
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--completed', type=int, default=100)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--child', choices=('sync', 'reload'), help=argparse.SUPPRESS)
+    parser.add_argument('--state', choices=STATES, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--cache', help=argparse.SUPPRESS)
+    parser.add_argument('--item-ids', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_sync(args) if args.child == 'sync' else run_reload(args)))
+        return
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = ('state', 'step', 'seconds', 'rss_mb', 'state_mb', 'objects', 'cache_mb')
+    print(' '.join(column.rjust(10) for column in columns))
+    for result in results:
+        print(' '.join(str(result.get(column, '')).rjust(10) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""
+Offline benchmark of the sync daemon, against the local fake Todoist and Calendar
+servers of fakes.py (no credentials, no network).
+
+Scenarios, run in order on one synthetic account:
+    initial_import   first run of the daemon (module_init() without a database)
+    steady_state     sync cycles (sync_todoist + sync_gcal), a few task changes each
+    idle             sync cycles without any change
+    midnight         overdue() once the past due tasks have to be flagged as overdue
+    project_move     one cycle after moving a share of the tasks to another project
+
+Reported: duration (until the outbox is drained), throughput, cycle latency
+percentiles, API requests and the bytes of the Calendar responses (as sent, compressed
+or not). The daemon's own pauses (time.sleep) are skipped and reported separately.
+--full-responses drops the field masks of gcal_http.FIELDS, --no-gzip the compression
+of the fake Calendar's responses.
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_sync.py [--projects N] [--tasks M] [--recurring K]
+        [--cycles C] [--latency-ms MS] [--error-rate R] [--quota QPS] [--premium]
+        [--full-responses] [--no-gzip] [--json] [--verbose]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+
+from googleapiclient import discovery
+from googleapiclient.discovery_cache import get_static_doc
+
+from fakes import FakeTodoist, FakeCalendar
+from todoist_gcal_sync import context
+from todoist_gcal_sync.utils.setup import helper
+from todoist_gcal_sync.utils.gcal_transport import PooledHttp
+
+
+class RoutedHttp(PooledHttp):
+    """ The daemon's transport, sending the requests for FAKE_ROOT_URL to a fake server. """
+
+    def __init__(self, url):
+        self.url = url
+
+    def request(self, uri, *args, **kwargs):
+        return PooledHttp.request(self, uri.replace(FAKE_ROOT_URL, self.url + '/', 1),
+                                  *args, **kwargs)
+
+
+FAKE_ROOT_URL = 'http://fake-calendar/'
+
+
+class BenchContext(context.AppContext):
+    """ Application context wired to the fake servers. """
+
+    # shared by every account, as the discovery document of the daemon (see context.py)
+    _bench_document = None
+
+    def __init__(self, todoist_server, calendar_server, cache_dir, account=None):
+        context.AppContext.__init__(self, account)
+        self.todoist_server = todoist_server
+        self.calendar_server = calendar_server
+        self.cache_dir = cache_dir
+
+    @property
+    def todoist_api(self):
+        with self._lock:
+            if self._todoist_api is None:
+                import todoist
+                from todoist_gcal_sync import todoist_state
+
+                api_class = todoist_state.CompactTodoistAPI if helper.USER_PREFS['todoist.compactState'] \
+                    else todoist.TodoistAPI
+                # the token names the cache file of the account
+                self._todoist_api = api_class(self.account or 'bench',
+                                              api_endpoint=self.todoist_server.url,
+                                              cache=self.cache_dir)
+        return self._todoist_api
+
+    def gcal_build(self):
+        from todoist_gcal_sync.utils.gcal_http import InstrumentedHttpRequest
+
+        with context.AppContext._gcal_discovery_lock:
+            if BenchContext._bench_document is None:
+                document = json.loads(get_static_doc('calendar', 'v3'))
+                document['rootUrl'] = FAKE_ROOT_URL
+                document['baseUrl'] = document['rootUrl'] + document['servicePath']
+                BenchContext._bench_document = document
+        return discovery.build_from_document(BenchContext._bench_document,
+                                             http=RoutedHttp(self.calendar_server.url),
+                                             requestBuilder=InstrumentedHttpRequest)
+
+
+def generate_account(todoist_server, projects, tasks, recurring, seed=0):
+    """
+        Fills the fake Todoist with 'projects' projects (a sub project for every fourth one)
+        and 'tasks' tasks due from two days ago to two weeks ahead, 'recurring' of them daily.
+    """
+    rnd = random.Random(seed)
+    today = datetime.utcnow().replace(hour=21, minute=59, second=59, microsecond=0)
+
+    project_ids = []
+    for n in range(projects):
+        project = todoist_server.add_project('Project ' + str(n))
+        project_ids.append(project['id'])
+        if n % 4 == 3:
+            project_ids.append(todoist_server.add_project('Project ' + str(n) + ' / Sub', indent=2,
+                                                          parent_id=project['id'])['id'])
+
+    for n in range(tasks):
+        due = today + timedelta(days=rnd.randint(-2, 14))
+        todoist_server.add_item(rnd.choice(project_ids), 'Task ' + str(n), due=due,
+                                date_string='every day' if n < recurring else None,
+                                priority=rnd.randint(1, 4))
+    return project_ids
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+@contextmanager
+def skipped_pauses(pauses):
+    """ Skips the daemon's time.sleep() calls, adding up their duration to pauses[0]. """
+    sleep = time.sleep
+
+    def skip(seconds):
+        pauses[0] += seconds
+
+    time.sleep = skip
+    try:
+        yield
+    finally:
+        time.sleep = sleep
+
+
+class Scenario(object):
+    """ Measures one scenario: wall time, cycle latencies and the requests of the fake servers. """
+
+    def __init__(self, name, todoist_server, calendar_server, settle=None):
+        self.name = name
+        self.settle = settle
+        self.servers = (todoist_server, calendar_server)
+        self.latencies = []
+        self.operations = 0
+        self.pauses = [0.0]
+
+    def __enter__(self):
+        self.requests = [server.total_requests() for server in self.servers]
+        self.gcal_bytes = self.servers[1].response_bytes
+        self.start = time.perf_counter()
+        self._pauses = skipped_pauses(self.pauses)
+        self._pauses.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.settle and exc_info[0] is None:
+            # the Gcal writes queued by the scenario are part of it
+            self.settle()
+        self._pauses.__exit__(*exc_info)
+        self.duration = time.perf_counter() - self.start
+        self.requests = [server.total_requests() - before
+                         for server, before in zip(self.servers, self.requests)]
+        self.gcal_bytes = self.servers[1].response_bytes - self.gcal_bytes
+
+    @contextmanager
+    def cycle(self):
+        start = time.perf_counter()
+        yield
+        self.latencies.append(time.perf_counter() - start)
+
+    def result(self):
+        result = {'scenario': self.name, 'seconds': round(self.duration, 3),
+                  'operations': self.operations,
+                  'ops_per_sec': round(self.operations / self.duration, 1) if self.duration else None,
+                  'todoist_requests': self.requests[0], 'gcal_requests': self.requests[1],
+                  'gcal_kb': round(self.gcal_bytes / 1024),
+                  'skipped_pauses_sec': round(self.pauses[0], 1)}
+        if self.latencies:
+            for share in (0.5, 0.95, 0.99):
+                result['p' + str(int(share * 100)) + '_ms'] = \
+                    round(percentile(self.latencies, share) * 1000, 1)
+        return result
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='todoist-gcal-sync-bench-')
+    helper.DB_PATH = os.path.join(workdir, 'data.db')
+    helper.CACHE_DIR_PATH = workdir + '/'
+
+    server_options = {'latency': args.latency_ms / 1000, 'error_rate': args.error_rate,
+                      'quota_per_sec': args.quota, 'seed': args.seed}
+    todoist_server = FakeTodoist(premium=args.premium, **server_options).start()
+    calendar_server = FakeCalendar(**server_options).start()
+    calendar_server.gzip = not args.no_gzip
+    if args.full_responses:
+        from todoist_gcal_sync.utils import gcal_http
+        gcal_http.FIELDS.clear()
+    context.activate(BenchContext(todoist_server, calendar_server, workdir + '/'))
+
+    from todoist_gcal_sync import todo as todoist
+    from todoist_gcal_sync import gcal_sync
+    from todoist_gcal_sync import outbox
+
+    project_ids = generate_account(todoist_server, args.projects, args.tasks, args.recurring, args.seed)
+    item_ids = sorted(todoist_server.items)
+    rnd = random.Random(args.seed)
+    results = []
+
+    with Scenario('initial_import', todoist_server, calendar_server, outbox.wait) as scenario:
+        todoist.module_init()
+        scenario.operations = args.tasks
+    results.append(scenario.result())
+
+    with Scenario('steady_state', todoist_server, calendar_server, outbox.wait) as scenario:
+        for _ in range(args.cycles):
+            for item_id in rnd.sample(item_ids, min(args.changes, len(item_ids))):
+                change = rnd.randrange(4)
+                if change == 0:
+                    todoist_server.update_item(item_id, content='Renamed ' + str(item_id))
+                elif change == 1:
+                    todoist_server.update_item(item_id, due=datetime.utcnow().replace(
+                        hour=21, minute=59, second=59, microsecond=0) + timedelta(days=rnd.randint(1, 9)))
+                elif change == 2:
+                    todoist_server.add_note(item_id, 'Note of ' + str(item_id))
+                else:
+                    todoist_server.update_item(item_id, priority=rnd.randint(1, 4))
+                scenario.operations += 1
+            with scenario.cycle():
+                todoist.sync_todoist()
+                gcal_sync.sync_gcal()
+    results.append(scenario.result())
+
+    with Scenario('idle', todoist_server, calendar_server, outbox.wait) as scenario:
+        for _ in range(args.cycles):
+            with scenario.cycle():
+                todoist.sync_todoist()
+                gcal_sync.sync_gcal()
+            scenario.operations += 1
+    results.append(scenario.result())
+
+    # a day has passed: the events of the past due tasks were written before they became overdue
+    with sqlite3.connect(helper.DB_PATH) as conn:
+        flagged = conn.execute('UPDATE todoist SET overdue = NULL, event_hash = NULL '
+                               'WHERE overdue').rowcount
+    with Scenario('midnight', todoist_server, calendar_server, outbox.wait) as scenario:
+        with scenario.cycle():
+            todoist.overdue()
+        scenario.operations = flagged
+    results.append(scenario.result())
+
+    source, destination = project_ids[0], project_ids[-1]
+    with Scenario('project_move', todoist_server, calendar_server, outbox.wait) as scenario:
+        for item in list(todoist_server.items.values()):
+            if item['project_id'] == source and rnd.random() < args.move_share:
+                todoist_server.update_item(item['id'], project_id=destination)
+                scenario.operations += 1
+        with scenario.cycle():
+            todoist.sync_todoist()
+            gcal_sync.sync_gcal()
+    results.append(scenario.result())
+
+    todoist_server.stop()
+    calendar_server.stop()
+    return results, {'todoist': todoist_server.requests, 'gcal': calendar_server.requests,
+                     'injected_errors': todoist_server.errors + calendar_server.errors,
+                     'throttled': todoist_server.throttled + calendar_server.throttled}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--projects', type=int, default=8)
+    parser.add_argument('--tasks', type=int, default=300)
+    parser.add_argument('--recurring', type=int, default=30)
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--changes', type=int, default=5, help='task changes per steady state cycle')
+    parser.add_argument('--move-share', type=float, default=0.5)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--quota', type=int, default=None, help='requests per second per API')
+    parser.add_argument('--premium', action='store_true')
+    parser.add_argument('--full-responses', action='store_true', help='request full Calendar resources')
+    parser.add_argument('--no-gzip', action='store_true', help='uncompressed Calendar responses')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the daemon's logs and output")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+        results, requests = run(args)
+    else:
+        logging.disable(logging.CRITICAL)
+        with redirect_stdout(io.StringIO()):
+            results, requests = run(args)
+
+    if args.json:
+        json.dump({'results': results, 'requests': requests}, sys.stdout, indent=2)
+        print()
+        return
+
+    columns = ['scenario', 'seconds', 'operations', 'ops_per_sec', 'p50_ms', 'p95_ms', 'p99_ms',
+               'todoist_requests', 'gcal_requests', 'gcal_kb', 'skipped_pauses_sec']
+    print(' '.join('{:>16}'.format(column) for column in columns))
+    for result in results:
+        print(' '.join('{:>16}'.format(str(result.get(column, '-'))) for column in columns))
+    print()
+    print('Requests by method: ' + json.dumps(requests, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Offline benchmark of the transport of the Google clients: requests per second against
+the fake Calendar of fakes.py, for --requests calendarList.list requests.
+
+Transports:
+    httplib2_shared      one httplib2.Http() for every thread, used under a lock (the
+                         former single Calendar service)
+    httplib2_per_thread  one httplib2.Http() per thread (the former per thread services)
+    httplib2_no_reuse    a new httplib2.Http(), and connection, per request
+    pooled               gcal_transport.PooledHttp(), shared by every thread
+
+Usage (package installed, e.g. pip install -e .):
+    python tests/benchmarks/bench_transport.py [--requests N] [--threads T]
+        [--latency-ms MS] [--json]
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+
+from fakes import FakeCalendar
+from todoist_gcal_sync.utils.gcal_transport import PooledHttp
+
+
+class SharedHttp(object):
+    """ httplib2.Http() serialized by a lock, as a thread-safe stand-in. """
+
+    def __init__(self):
+        self.http = httplib2.Http()
+        self.lock = threading.Lock()
+
+    def request(self, uri):
+        with self.lock:
+            return self.http.request(uri)
+
+
+class PerThreadHttp(object):
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, uri):
+        if not hasattr(self.local, 'http'):
+            self.local.http = httplib2.Http()
+        return self.local.http.request(uri)
+
+
+class NoReuseHttp(object):
+    def request(self, uri):
+        return httplib2.Http().request(uri, headers={'connection': 'close'})
+
+
+def measure(http, uri, requests, threads):
+    def call(_):
+        resp, content = http.request(uri)
+        assert resp.status == 200, resp.status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(call, range(requests)))
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 3), 'requests_per_sec': round(requests / seconds, 1)}
+
+
+def run(args):
+    server = FakeCalendar(latency=args.latency_ms / 1000).start()
+    uri = server.url + '/calendar/v3/users/me/calendarList'
+    transports = [('httplib2_shared', SharedHttp()), ('httplib2_per_thread', PerThreadHttp()),
+                  ('httplib2_no_reuse', NoReuseHttp()), ('pooled', PooledHttp())]
+
+    results = []
+    for name, http in transports:
+        for threads in sorted({1, args.threads}):
+            result = measure(http, uri, args.requests, threads)
+            result.update(transport=name, threads=threads)
+            results.append(result)
+    server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=2.0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    columns = ['transport', 'threads', 'seconds', 'requests_per_sec']
+    print(' '.join('{:>20}'.format(column) for column in columns))
+    for result in results:
+        print(' '.join('{:>20}'.format(str(result[column])) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,486 @@
+"""
+Local stand-ins for the Todoist Sync API (v7) and the Google Calendar API (v3), for
+the offline benchmarks. Both keep their state in memory and serve it over HTTP from
+a daemon thread, with configurable latency, error rate and quota.
+
+Only the parts of both APIs used by the daemon are implemented.
+"""
+
+import gzip
+import json
+import time
+import random
+import threading
+import itertools
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """
+        HTTP server answering through the 'handle(method, path, query, body)' method
+        of its subclasses, which returns (status, json_body).
+
+        latency: seconds added to each request
+        error_rate: share of the requests answered with a server error
+        quota_per_sec: requests allowed per second, the others are answered with the
+            quota error of the API (None for no quota)
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, error_rate=0.0, quota_per_sec=None, seed=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeRequestHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_sec = quota_per_sec
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.requests = {}
+        self.gzip = True
+        self.errors = 0
+        self.throttled = 0
+        self.response_bytes = 0
+        self.response_bytes_by_method = {}
+        self._local = threading.local()
+        self._window = (0, 0)
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def over_quota(self):
+        if self.quota_per_sec is None:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window_second, count = self._window
+            count = count + 1 if window_second == second else 1
+            self._window = (second, count)
+        return count > self.quota_per_sec
+
+    def dispatch(self, method, raw_path, body):
+        if self.latency:
+            # not time.sleep(), which the benchmarks may stub out for the daemon's pauses
+            threading.Event().wait(self.latency)
+
+        parsed = urlparse(raw_path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+        if self.over_quota():
+            with self.lock:
+                self.throttled += 1
+            return self.quota_error()
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return self.server_error()
+
+        with self.lock:
+            status, payload = self.handle(method, parsed.path, query, body)
+        if 'fields' in query and status == 200 and payload is not None:
+            payload = partial_response(payload, query['fields'])
+        return status, payload
+
+    def count(self, name):
+        self.requests[name] = self.requests.get(name, 0) + 1
+        self._local.method = name
+
+    def add_response_bytes(self, size):
+        method = getattr(self._local, 'method', None)
+        self._local.method = None
+        with self.lock:
+            self.response_bytes += size
+            self.response_bytes_by_method[method] = self.response_bytes_by_method.get(method, 0) + size
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes; Nagle + delayed ACKs would add 40ms to each
+    disable_nagle_algorithm = True
+
+    def _serve(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, payload = self.server.dispatch(self.command, self.path, body)
+
+        data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        # like both APIs, bodies are compressed for the clients accepting it
+        compressed = data and self.server.gzip and 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        if compressed:
+            data = gzip.compress(data, compresslevel=6)
+        self.server.add_response_bytes(len(data))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_fields(fields):
+    """ Parses a 'fields' selector, e.g. 'items(id,start/date),nextPageToken', into a tree. """
+    tree = {}
+    stack = [tree]
+    name = ''
+    for char in fields + ',':
+        if char in ',()':
+            if name:
+                node = stack[-1]
+                for part in name.strip().split('/')[:-1]:
+                    node = node.setdefault(part, {})
+                node = node.setdefault(name.strip().split('/')[-1], {})
+            if char == '(':
+                stack.append(node)
+            elif char == ')':
+                stack.pop()
+            name = ''
+        else:
+            name += char
+    return tree
+
+
+def partial_response(payload, fields):
+    """ Keeps the fields of the payload selected by 'fields', like the partial responses of Google APIs. """
+    def select(value, tree):
+        if not tree:
+            return value
+        if isinstance(value, list):
+            return [select(element, tree) for element in value]
+        if isinstance(value, dict):
+            return {key: select(value[key], subtree) for key, subtree in tree.items() if key in value}
+        return value
+
+    return select(payload, parse_fields(fields))
+
+
+def todoist_date(date):
+    return date.strftime('%a %d %b %Y %H:%M:%S +0000')
+
+
+class FakeTodoist(FakeServer):
+    """
+        Todoist Sync API v7: '/API/v7/sync' (incremental through sync tokens, with a subset
+        of the item commands), '/API/v7/activity/get', '/API/v7/completed/get_all' and
+        '/API/v7/items/get'. Like Todoist, full syncs leave out the tasks in history.
+    """
+
+    def __init__(self, premium=False, timezone='UTC', **kwargs):
+        FakeServer.__init__(self, **kwargs)
+        self.version = 0
+        self.ids = itertools.count(1000)
+        self.projects = {}
+        self.items = {}
+        self.notes = {}
+        self.activity = []
+        self.user = {'id': 1, 'full_name': 'Bench', 'email': 'bench@example.com',
+                     'is_premium': premium, 'inbox_project': None,
+                     'tz_info': {'timezone': timezone, 'gmt_string': '+00:00',
+                                 'hours': 0, 'minutes': 0, 'is_dst': 0}}
+        self.user['inbox_project'] = self.add_project('Inbox', inbox_project=True)['id']
+
+    def _touch(self, obj):
+        self.version += 1
+        obj['_version'] = self.version
+        return obj
+
+    def add_project(self, name, indent=1, parent_id=None, **fields):
+        with self.lock:
+            project = {'id': next(self.ids), 'name': name, 'color': 7, 'indent': indent,
+                       'parent_id': parent_id, 'item_order': len(self.projects), 'collapsed': 0,
+                       'shared': False, 'is_deleted': 0, 'is_archived': 0, 'is_favorite': 0}
+            project.update(fields)
+            self.projects[project['id']] = self._touch(project)
+            return project
+
+    def add_item(self, project_id, content, due=None, date_string=None, priority=1, **fields):
+        with self.lock:
+            item = {'id': next(self.ids), 'user_id': 1, 'project_id': project_id,
+                    'content': content, 'date_string': date_string or (due and due.strftime('%d %b')),
+                    'date_lang': 'en', 'due_date_utc': due and todoist_date(due), 'indent': 1,
+                    'priority': priority, 'item_order': len(self.items), 'day_order': -1,
+                    'collapsed': 0, 'labels': [], 'assigned_by_uid': 1, 'responsible_uid': None,
+                    'checked': 0, 'in_history': 0, 'is_deleted': 0, 'is_archived': 0,
+                    'sync_id': None, 'parent_id': None, 'all_day': False,
+                    'date_added': todoist_date(datetime.utcnow())}
+            item.update(fields)
+            self.items[item['id']] = self._touch(item)
+            return item
+
+    def update_item(self, item_id, **fields):
+        with self.lock:
+            item = self.items[item_id]
+            if 'due' in fields:
+                due = fields.pop('due')
+                fields['due_date_utc'] = due and todoist_date(due)
+            item.update(fields)
+            if fields.get('checked'):
+                self.activity.insert(0, {'object_id': item_id, 'event_type': 'completed',
+                                         'event_date': todoist_date(datetime.utcnow())})
+            return self._touch(item)
+
+    def add_note(self, item_id, content):
+        with self.lock:
+            note = {'id': next(self.ids), 'item_id': item_id, 'project_id': self.items[item_id]['project_id'],
+                    'content': content, 'posted': todoist_date(datetime.utcnow()), 'is_deleted': 0,
+                    'file_attachment': None, 'posted_uid': 1}
+            self.notes[note['id']] = self._touch(note)
+            return note
+
+    @staticmethod
+    def _public(objects, since):
+        return [{key: value for key, value in obj.items() if key != '_version'}
+                for obj in objects.values() if obj['_version'] > since
+                and (since or not (obj.get('is_deleted') or obj.get('in_history')))]
+
+    def quota_error(self):
+        return 429, {'error': 'Too many requests', 'error_code': 35, 'error_extra': {},
+                     'error_tag': 'LIMITS_REACHED', 'http_code': 429}
+
+    def server_error(self):
+        return 503, {'error': 'Service unavailable', 'error_code': 0, 'error_extra': {},
+                     'error_tag': 'SERVICE_UNAVAILABLE', 'http_code': 503}
+
+    def handle(self, method, path, query, body):
+        form = {key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()}
+        call = path.rsplit('/API/v7/', 1)[-1]
+        self.count(call)
+
+        if call == 'sync':
+            return 200, self.sync(form)
+        if call == 'activity/get':
+            return 200, self.activity[:int(form.get('limit', 30))]
+        if call == 'completed/get_all':
+            completed = [{'task_id': item['id'], 'id': item['id'], 'user_id': 1,
+                          'content': item['content'], 'project_id': item['project_id'],
+                          'completed_date': item['due_date_utc'], 'note_count': 0}
+                         for item in sorted(self.items.values(), key=lambda item: -item['_version'])
+                         if item['checked']]
+            return 200, {'items': completed, 'projects': {}}
+        if call == 'items/get':
+            item = self.items.get(int(query.get('item_id', 0)))
+            if item is None:
+                return 404, {'error': 'Item not found', 'error_tag': 'ITEM_NOT_FOUND', 'http_code': 404}
+            def public(obj):
+                return {key: value for key, value in obj.items() if key != '_version'}
+
+            return 200, {'item': public(item), 'project': public(self.projects[item['project_id']]),
+                         'notes': [public(note) for note in self.notes.values()
+                                   if note['item_id'] == item['id']]}
+        return 404, {'error': 'Not found', 'error_tag': 'NOT_FOUND', 'http_code': 404}
+
+    def sync(self, form):
+        statuses = {}
+        temp_ids = {}
+        for command in json.loads(form.get('commands') or '[]'):
+            statuses[command['uuid']] = self.command(command, temp_ids)
+
+        token = form.get('sync_token', '*')
+        since = 0 if token == '*' else int(token)
+        response = {'sync_token': str(self.version), 'full_sync': since == 0,
+                    'items': self._public(self.items, since),
+                    'projects': self._public(self.projects, since),
+                    'notes': self._public(self.notes, since),
+                    'labels': [], 'filters': [], 'reminders': [], 'collaborators': [],
+                    'collaborator_states': [], 'live_notifications': [], 'project_notes': [],
+                    'day_orders': {}, 'day_orders_timestamp': '1', 'temp_id_mapping': temp_ids}
+        if since == 0:
+            response['user'] = self.user
+        if statuses:
+            response['sync_status'] = statuses
+        return response
+
+    def command(self, command, temp_ids):
+        args = command.get('args', {})
+        kind = command['type']
+        if kind == 'item_add':
+            item = self.add_item(args.pop('project_id', self.user['inbox_project']),
+                                 args.pop('content', ''), **args)
+            temp_ids[command.get('temp_id')] = item['id']
+            return 'ok'
+
+        # item_delete, item_complete, ... take a list of ids
+        item_ids = args.get('ids') or [args.get('id')]
+        if any(item_id not in self.items for item_id in item_ids):
+            return {'error_tag': 'ITEM_NOT_FOUND', 'error_code': 22, 'http_code': 404,
+                    'error_extra': {}, 'error': 'Item not found'}
+
+        for item_id in item_ids:
+            if kind == 'item_update':
+                fields = {key: value for key, value in args.items() if key != 'id'}
+                if fields.get('due_date_utc') and 'T' in fields['due_date_utc']:
+                    # Todoist takes ISO dates and answers in its own format
+                    fields['due_date_utc'] = todoist_date(datetime.strptime(
+                        fields['due_date_utc'][:19], '%Y-%m-%dT%H:%M:%S'))
+                self.update_item(item_id, **fields)
+            elif kind in ('item_close', 'item_complete'):
+                self.update_item(item_id, checked=1)
+            elif kind == 'item_uncomplete':
+                self.update_item(item_id, checked=0)
+            elif kind == 'item_delete':
+                self.update_item(item_id, is_deleted=1)
+            elif kind == 'item_move':
+                self.update_item(item_id, project_id=args['project_id'])
+        return 'ok'
+
+
+class FakeCalendar(FakeServer):
+    """
+        Google Calendar API v3 under '/calendar/v3/': calendar list, calendars and events,
+        with paging and sync tokens.
+    """
+    PAGE_SIZE = 250
+
+    def __init__(self, **kwargs):
+        FakeServer.__init__(self, **kwargs)
+        self.version = 0
+        self.ids = itertools.count(1)
+        self.calendars = {}
+        self.events = {}
+
+    def _touch(self, obj):
+        self.version += 1
+        obj['_version'] = self.version
+        obj['updated'] = datetime.utcnow().isoformat() + 'Z'
+        return obj
+
+    @staticmethod
+    def _public(obj):
+        return {key: value for key, value in obj.items() if key != '_version'}
+
+    @staticmethod
+    def error(code, reason, message):
+        return code, {'error': {'code': code, 'message': message,
+                                'errors': [{'domain': 'global', 'reason': reason, 'message': message}]}}
+
+    def quota_error(self):
+        return self.error(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+
+    def server_error(self):
+        return self.error(503, 'backendError', 'Backend Error')
+
+    def page(self, objects, query, deleted_key):
+        """ Lists objects by pages of 'maxResults', incrementally from 'syncToken'. """
+        sync_token = query.get('syncToken')
+        if sync_token is not None:
+            if not sync_token.isdigit() or int(sync_token) > self.version:
+                return self.error(410, 'fullSyncRequired', 'Sync token is no longer valid')
+            since = int(sync_token)
+            selected = [obj for obj in objects if obj['_version'] > since]
+        else:
+            selected = [obj for obj in objects
+                        if query.get('showDeleted') == 'true' or not obj.get(deleted_key)]
+
+        selected.sort(key=lambda obj: obj['_version'])
+        start = int(query.get('pageToken') or 0)
+        size = int(query.get('maxResults') or self.PAGE_SIZE)
+        response = {'items': [self._public(obj) for obj in selected[start:start + size]]}
+        if start + size < len(selected):
+            response['nextPageToken'] = str(start + size)
+        else:
+            response['nextSyncToken'] = str(self.version)
+        return 200, response
+
+    def handle(self, method, path, query, body):
+        parts = [unquote(part) for part in path.split('/calendar/v3/', 1)[-1].split('/')]
+        data = json.loads(body.decode('utf-8')) if body else {}
+
+        if parts[:3] == ['users', 'me', 'calendarList']:
+            self.count('calendarList.list')
+            entries = [dict(calendar, deleted=calendar.get('deleted', False))
+                       for calendar in self.calendars.values()]
+            return self.page(entries, query, 'deleted')
+
+        if parts[0] != 'calendars':
+            return self.error(404, 'notFound', 'Not Found')
+
+        if len(parts) == 1 and method == 'POST':
+            self.count('calendars.insert')
+            calendar = dict(data, id='cal' + str(next(self.ids)) + '@group.calendar.google.com',
+                            kind='calendar#calendar')
+            self.calendars[calendar['id']] = self._touch(calendar)
+            self.events[calendar['id']] = {}
+            return 200, self._public(calendar)
+
+        calendar = self.calendars.get(parts[1])
+        if calendar is None or calendar.get('deleted'):
+            return self.error(404, 'notFound', 'Not Found')
+
+        if len(parts) == 2:
+            self.count('calendars.' + {'GET': 'get', 'DELETE': 'delete', 'PUT': 'update',
+                                       'PATCH': 'patch'}[method])
+            if method == 'DELETE':
+                calendar['deleted'] = True
+                self._touch(calendar)
+                return 204, None
+            if method in ('PUT', 'PATCH'):
+                calendar.update(data)
+                self._touch(calendar)
+            return 200, self._public(calendar)
+
+        events = self.events[calendar['id']]
+        if len(parts) == 3:
+            if method == 'POST':
+                self.count('events.insert')
+                event = dict(data, id='evt' + str(next(self.ids)), status='confirmed',
+                             kind='calendar#event')
+                events[event['id']] = self._touch(event)
+                return 200, self._public(event)
+            self.count('events.list')
+            return self.page(list(events.values()), query, 'cancelled')
+
+        event = events.get(parts[3])
+        if event is None:
+            return self.error(404, 'notFound', 'Not Found')
+
+        if len(parts) == 5 and parts[4] == 'move':
+            self.count('events.move')
+            destination = self.events.get(query.get('destination'))
+            if destination is None:
+                return self.error(404, 'notFound', 'Not Found')
+            moved = dict(event)
+            event.update(status='cancelled')
+            self._touch(event)
+            destination[moved['id']] = self._touch(moved)
+            return 200, self._public(moved)
+
+        self.count('events.' + {'GET': 'get', 'DELETE': 'delete', 'PUT': 'update',
+                                'PATCH': 'patch'}[method])
+        if method == 'DELETE':
+            if event.get('status') == 'cancelled':
+                return self.error(410, 'deleted', 'Resource has been deleted')
+            event['status'] = 'cancelled'
+            self._touch(event)
+            return 204, None
+        before = dict(event)
+        if method == 'PUT':
+            event.clear()
+            event.update(data, id=parts[3], status=data.get('status', 'confirmed'))
+        elif method == 'PATCH':
+            event.update(data)
+        for key in ('_version', 'updated'):
+            event[key] = before[key]
+        if event != before:
+            # like Calendar, writes that change nothing do not show up in incremental syncs
+            self._touch(event)
+        return 200, self._public(event)
@@ -0,0 +1,122 @@
+import pytest
+
+from todoist_gcal_sync import catch_up, context, planner
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils.setup import helper
+from todoist_gcal_sync import todo as todoist
+
+
+@pytest.fixture(autouse=True)
+def todoist_state(monkeypatch):
+    monkeypatch.setattr(todoist, 'timezone', lambda: 'UTC')
+    monkeypatch.setattr(todoist, 'desired_event', lambda item: todoist.event_body(
+        item['content'], '2030-01-0' + item['due_date_utc'][5], location='Work', desc=''))
+
+
+def item(task_id, content, day=1):
+    return {'id': task_id, 'content': content, 'due_date_utc': 'Tue 0%d Jan 2030 12:00:00 +0000' % day}
+
+
+def update(task_id, content, event_hash, fields=(planner.SUMMARY,), calendar='cal', op=planner.UPDATE):
+    row = {'project_id': calendar, 'parent_project_id': None, 'event_id': 'e' + str(task_id),
+           'due_date': item(task_id, content)['due_date_utc'], 'event_hash': event_hash}
+    return {'op': op, 'task_id': task_id, 'item': item(task_id, content), 'row': row,
+            'fields': set(fields)}
+
+
+def live(content, day=1):
+    event = {'summary': content, 'location': 'Work', 'start': {'date': '2030-01-0' + str(day)},
+             'end': {'date': '2030-01-0' + str(day)}, 'reminders': {'useDefault': False}}
+    return catch_up.live_hash(event)
+
+
+def test_live_events_hash_like_the_desired_ones():
+    assert live('Task') == todoist.event_hash(todoist.desired_event(item(1, 'Task')))
+    assert live('Task') != live('Task', day=2)
+
+
+def test_only_the_events_that_differ_are_queued():
+    operations = [update(1, 'renamed', live('old')),            # Todoist edit --> queued
+                  update(2, 'synced', live('stale')),           # Gcal is up to date, row lags
+                  update(3, 'same', live('same')),              # unchanged since last write
+                  update(4, 'noted', live('noted'), fields=(planner.SUMMARY, planner.LOCATION)),
+                  update(5, 'gone', live('gone'), op=planner.DELETE),
+                  update(6, 'deleted on Gcal', live('old')),
+                  update(7, 'elsewhere', live('old'), calendar='other')]
+    events = {'e1': live('old'), 'e2': live('synced'), 'e3': live('edited on Gcal'),
+              'e4': live('noted'), 'e7': live('elsewhere')}
+    calendars = {'cal': 'cal@google', 'other': 'other@google'}
+
+    kept, fixed, dropped = catch_up.diff(operations, events, {'cal@google'},
+                                         lambda row: calendars[row['project_id']])
+
+    assert [operation['task_id'] for operation in kept] == [1, 4, 7]
+    assert fixed == [(item(2, 'synced')['due_date_utc'], None, live('synced'), 2)]
+    assert dropped == [5]
+
+
+def test_reconciliation_pushes_only_the_events_that_changed(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_PATH', str(tmpdir.join('data.db')))
+    context.activate(context.AppContext())
+    sql_ops.init_db()
+    items = {1: item(1, 'same'), 2: item(2, 'renamed'), 3: item(3, 'not synced yet', day=2)}
+    for task_id, content in [(1, 'same'), (2, 'old'), (3, 'old')]:
+        sql_ops.insert_many("todoist", [10, None, task_id, item(task_id, content)['due_date_utc'],
+                                        'e' + str(task_id), None, 0, 0, live(content)])
+
+    class StubItems(object):
+        def get_by_id(self, task_id):
+            return dict(items[task_id], checked=0)
+
+    class StubApi(object):
+        items = StubItems()
+
+    monkeypatch.setattr(todoist, 'api', StubApi())
+    monkeypatch.setattr(todoist, 'find_task_calId', lambda project_id, parent_project_id: 'cal')
+    patched = []
+    monkeypatch.setattr(todoist.gcal, 'patch_event', lambda calendar_id, event_id, event:
+                        patched.append((calendar_id, event_id, event['summary'])) or True)
+    try:
+        todoist.reconcile()
+        todoist.reconcile()
+
+        assert patched == [('cal', 'e2', 'renamed')]
+        assert todoist.task_row(2)['event_hash'] == live('renamed')
+    finally:
+        context.activate(None)
+
+
+def test_undone_tasks_get_one_write_per_event(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_PATH', str(tmpdir.join('data.db')))
+    context.activate(context.AppContext())
+    sql_ops.init_db()
+    sql_ops.insert_rows('gcal_ids', [['Work', 'cal', 10, None]])
+    sql_ops.insert_many("todoist_completed", [10, None, 1, item(1, 'done')['due_date_utc'],
+                                              'e1', None, 0, 0, live('done')])
+    sql_ops.insert_many("todoist", [10, None, 2, item(2, 'open')['due_date_utc'],
+                                    'e2', None, 0, 0, live('open')])
+
+    class StubItems(object):
+        def get_by_id(self, task_id):
+            return dict(item(task_id, 'noted'), project_id=10)
+
+    class StubApi(object):
+        items = StubItems()
+
+    monkeypatch.setattr(todoist, 'api', StubApi())
+    monkeypatch.setattr(todoist, '__parent_project_id__', lambda project_id: None)
+    monkeypatch.setattr(todoist, 'find_cal_id', lambda project_id, parent_project_id: 'cal')
+    monkeypatch.setattr(todoist, 'task_path', lambda task_id: '✉ Work')
+    monkeypatch.setattr(todoist, 'event_desc', lambda item: 'a note')
+    patched = []
+    monkeypatch.setattr(todoist.gcal, 'patch_event', lambda calendar_id, event_id, event:
+                        patched.append((event_id, sorted(event))) or True)
+    try:
+        for task_id in (1, 2):
+            assert todoist.apply_operation({'op': planner.UNDO, 'task_id': task_id,
+                                            'item': item(task_id, 'noted'), 'fields': {planner.DESC}})
+
+        assert patched == [('e1', sorted(todoist.desired_event(item(1, 'noted')))),
+                           ('e2', ['description', 'location'])]
+    finally:
+        context.activate(None)
@@ -0,0 +1,107 @@
+import pytest
+from todoist.api import SyncError
+
+from todoist_gcal_sync import context, todo
+
+
+class StubApi(object):
+    """ api.sync() of todoist-python, rejecting the commands of the ids in 'failing'. """
+
+    def __init__(self, failing=()):
+        self.queue = []
+        self.requests = []
+        self.failing = set(failing)
+        # changes made in Todoist, merged by the next sync
+        self.changes = {}
+
+    def update(self, item_id, **kwargs):
+        self.queue.append({'type': 'item_update', 'uuid': 'uuid-' + str(item_id) + '-' + str(len(self.requests)),
+                           'args': dict(kwargs, id=item_id)})
+
+    def sync(self, commands=None):
+        self.requests.append([command['args']['id'] for command in commands])
+        changes, self.changes = self.changes, {}
+        return dict(changes, sync_status={command['uuid']: {'error_code': 22, 'error': 'Item not found'}
+                                          if command['args']['id'] in self.failing else 'ok'
+                                          for command in commands})
+
+    def commit(self):
+        commands, self.queue = self.queue, []
+        return self.sync(commands)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    context.activate(context.AppContext())
+    stub = StubApi(failing=[7])
+    monkeypatch.setattr(todo, 'api', stub)
+    yield stub
+    context.activate(None)
+
+
+def test_commands_of_a_batch_are_sent_in_chunks(api):
+    with todo.batched_commands():
+        for item_id in range(250):
+            api.update(item_id, content='task')
+            todo.commit()
+        assert api.requests == []
+
+    assert [len(request) for request in api.requests] == [100, 100, 50]
+
+
+def test_rejected_commands_are_retried_with_the_next_batch(api):
+    with todo.batched_commands():
+        api.update(7, content='task')
+        todo.commit()
+        api.update(8, content='task')
+        todo.commit()
+
+    assert [command['args']['id'] for command, attempts in context.current().retry_commands] == [7]
+
+    for _ in range(todo.COMMAND_MAX_ATTEMPTS - 1):
+        with todo.batched_commands():
+            pass
+
+    assert api.requests == [[7, 8], [7], [7]]
+    assert context.current().retry_commands == []
+
+
+def test_commit_outside_of_a_batch_is_immediate(api):
+    api.update(1, content='task')
+    todo.commit()
+
+    assert api.requests == [[1]]
+
+
+def test_callbacks_wait_for_the_confirmation_of_their_command(api):
+    confirmed = []
+    with todo.batched_commands():
+        for item_id in (7, 8):
+            api.update(item_id, is_deleted=1)
+            todo.commit(on_committed=lambda item_id=item_id: confirmed.append(item_id))
+        assert confirmed == []
+
+    assert confirmed == [8]
+    for _ in range(todo.COMMAND_MAX_ATTEMPTS - 1):
+        with todo.batched_commands():
+            pass
+
+    # dropped after its last attempt, its callback with it
+    assert confirmed == [8]
+    assert context.current().command_callbacks == {}
+
+
+def test_changes_merged_by_the_commits_are_kept_for_the_next_cycle(api):
+    api.changes = {'items': [{'id': 3, 'content': 'edited in Todoist'}]}
+    with todo.batched_commands():
+        api.update(1, content='task')
+        todo.commit()
+    api.changes = {'notes': [{'id': 10, 'item_id': 3}]}
+    api.update(7, content='task')
+    with pytest.raises(SyncError):
+        todo.commit()
+
+    assert todo.take_commit_deltas() == [
+        {'items': [{'id': 3, 'content': 'edited in Todoist'}], 'notes': [], 'projects': []},
+        {'items': [], 'notes': [{'id': 10, 'item_id': 3}], 'projects': []}]
+    assert todo.take_commit_deltas() == []
@@ -0,0 +1,66 @@
+import os
+import stat
+import threading
+from datetime import datetime, timedelta
+
+from oauth2client.client import OAuth2Credentials
+
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync.utils.auth import credential_manager, gcal_OAuth
+
+
+class StubCredentials(object):
+    """ OAuth2Credentials whose refresh() takes 'delay' seconds and fails with 'error'. """
+
+    def __init__(self, expires_in, delay=0, error=None):
+        self.access_token = 'token'
+        self.token_expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+        self.invalid = False
+        self.delay = delay
+        self.error = error
+        self.refreshes = 0
+
+    def refresh(self, http):
+        threading.Event().wait(self.delay)
+        self.refreshes += 1
+        if self.error:
+            raise self.error
+        self.token_expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+def setup_function():
+    metrics.reset()
+
+
+def test_credentials_are_written_atomically(tmpdir):
+    path = str(tmpdir.join('credentials.json'))
+    credentials = OAuth2Credentials('token', 'client', 'secret', 'refresh', None,
+                                    'https://oauth2.googleapis.com/token', 'agent')
+    gcal_OAuth.AtomicStorage(path).put(credentials)
+
+    assert gcal_OAuth.AtomicStorage(path).get().access_token == 'token'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert os.listdir(str(tmpdir)) == ['credentials.json']
+
+
+def test_tokens_are_refreshed_ahead_of_expiry_once():
+    expiring = credential_manager.CredentialManager(StubCredentials(60, delay=0.05))
+    valid = credential_manager.CredentialManager(StubCredentials(3600))
+
+    threads = [threading.Thread(target=manager.refresh) for manager in [expiring, valid] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (expiring.credentials.refreshes, valid.credentials.refreshes) == (1, 0)
+    assert not expiring.expires_within(300)
+
+
+def test_failed_refreshes_are_left_to_the_next_check():
+    manager = credential_manager.CredentialManager(StubCredentials(60, error=OSError('offline')))
+
+    assert not manager.refresh()
+    assert manager.expires_within(300)
+    counter = metrics.snapshot()['counters'][0]
+    assert (counter['name'], counter['labels']) == ('gcal_token_refreshes_total', {'status': 'error'})
@@ -0,0 +1,80 @@
+import csv
+import gzip
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from todoist_gcal_sync import context
+from todoist_gcal_sync.utils import cli, export, sql_ops
+from todoist_gcal_sync.utils.setup import helper
+
+
+@pytest.fixture
+def db_path(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_PATH', str(tmpdir.join('data.db')))
+    context.activate(context.AppContext())
+    sql_ops.init_db()
+    for task_id in range(25):
+        sql_ops.insert_many("todoist", [1, None, task_id, 'Tue 01 Jan 2030 12:00:00 +0000',
+                                        100 + task_id, None, task_id % 3, 0, 'hash'])
+    sql_ops.insert_many("gcal_ids", ['Work', 'abc@group.calendar.google.com', 1, '42'])
+    yield helper.DB_PATH
+    context.activate(None)
+
+
+def read_csv(path):
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as csv_file:
+        return list(csv.reader(csv_file))
+
+
+def test_tables_are_exported_from_a_snapshot(db_path, tmpdir):
+    # the daemon writing meanwhile
+    writer = sqlite3.connect(db_path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    writer.execute("DELETE FROM todoist")
+
+    exported = export.export(db_path, str(tmpdir.join('out')), 'csv', chunk_rows=10)
+    writer.execute('COMMIT')
+
+    assert {table: count for table, (path, count) in exported.items()} == \
+        {'todoist': 25, 'todoist_completed': 0, 'gcal_ids': 1}
+    rows = read_csv(exported['todoist'][0])
+    assert rows[0][:3] == ['project_id', 'parent_project_id', 'task_id']
+    assert [row[2] for row in rows[1:]] == [str(task_id) for task_id in range(25)]
+
+
+def test_column_types_follow_the_values(db_path):
+    with export.snapshot(db_path) as conn:
+        assert export.column_types(conn, 'gcal_ids', ['calendar_name', 'calendar_id', 'todoist_project_id']) \
+            == ['text', 'text', 'integer']
+
+
+def test_parquet_export(db_path, tmpdir):
+    parquet = pytest.importorskip('pyarrow.parquet')
+
+    exported = export.export(db_path, str(tmpdir.join('out')), 'parquet', chunk_rows=10)
+
+    table = parquet.read_table(exported['todoist'][0])
+    assert table.num_rows == 25
+    assert table.column('times_overdue').to_pylist()[:4] == [0, 1, 2, 0]
+
+
+def test_cli_reports_a_missing_database(tmpdir):
+    result = CliRunner().invoke(cli.cli, ['export', str(tmpdir.join('out')), '--account', 'missing'])
+
+    assert result.exit_code != 0
+    assert 'unable to open database' in result.output
+
+
+def test_failed_export_leaves_no_partial_file(db_path, tmpdir, monkeypatch):
+    def write_csv(path, columns, rows):
+        with open(path, 'w') as partial:
+            partial.write('project_id')
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(export, 'write_csv', write_csv)
+    with pytest.raises(OSError):
+        export.export(db_path, str(tmpdir.join('out')), 'csv')
+
+    assert tmpdir.join('out').listdir() == []
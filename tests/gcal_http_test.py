@@ -0,0 +1,35 @@
+from googleapiclient.http import HttpMockSequence
+
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync.utils.gcal_http import InstrumentedHttpRequest
+
+
+def setup_function():
+    metrics.reset()
+
+
+def request(method_id, uri, responses):
+    return InstrumentedHttpRequest(HttpMockSequence(responses), lambda resp, content: content,
+                                   uri, methodId=method_id)
+
+
+def test_responses_are_projected_and_compressed():
+    insert = request('calendar.events.insert', 'http://calendar/calendars/c/events?alt=json',
+                     [({'status': '200', '-content-encoding': 'gzip', '-content-length': '32'},
+                       b'{"id": "e1"}')])
+
+    assert insert.uri == 'http://calendar/calendars/c/events?alt=json&fields=id'
+    assert insert.headers['accept-encoding'] == 'gzip, deflate'
+    assert insert.execute() == b'{"id": "e1"}'
+    counters = {counter['name']: counter for counter in metrics.snapshot()['counters']}
+    assert counters['gcal_response_bytes_total']['labels'] == {'method': 'events.insert', 'encoding': 'gzip'}
+    assert counters['gcal_response_bytes_total']['value'] == 12
+    assert counters['gcal_wire_bytes_total']['value'] == 32
+
+
+def test_masks_of_the_caller_are_kept():
+    listing = request('calendar.events.list', 'http://calendar/calendars/c/events?fields=items%28id%29', [])
+    delete = request('calendar.events.delete', 'http://calendar/calendars/c/events/e1', [])
+
+    assert listing.uri.endswith('?fields=items%28id%29')
+    assert delete.uri == 'http://calendar/calendars/c/events/e1'
@@ -0,0 +1,134 @@
+import pytest
+
+from todoist_gcal_sync import context, gcal_sync, outbox, planner, todo
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils.setup import helper
+
+ICONS = frozenset(['１', '🔄', '⚠'])
+
+
+def test_summary_is_split_into_name_and_priority():
+    assert gcal_sync.parse_summary('１ 🔄 Water the plants', ICONS) == \
+        ('Water the plants', 'Water the plants', None)
+    assert gcal_sync.parse_summary('⚠ １  Pay  rent p1', ICONS) == ('Pay  rent p1', 'Pay  rent', 1)
+    assert gcal_sync.parse_summary('Call p3 back', ICONS) == ('Call p3 back', 'Call p3 back', None)
+    assert gcal_sync.parse_summary('１ 🔄', ICONS) == ('', '', None)
+
+
+class StubApi(object):
+    def __init__(self, items):
+        self.state = {'items': items}
+
+
+@pytest.fixture
+def database(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_PATH', str(tmpdir.join('data.db')))
+    context.activate(context.AppContext())
+    sql_ops.init_db()
+    yield
+    context.activate(None)
+
+
+def test_events_of_a_page_are_resolved_in_one_query(database, monkeypatch):
+    rows = [[1, None, task_id, None, 'event' + str(task_id), None, 0, 0, None] for task_id in range(1000)]
+    assert sql_ops.insert_rows('todoist', rows)
+    monkeypatch.setattr(todo, 'api', StubApi([{'id': task_id, 'content': 'Task'} for task_id in range(1000)]))
+    monkeypatch.setattr(helper, 'ICONS', {'icons.eventSet': list(ICONS)})
+
+    events = [{'id': 'event' + str(n), 'summary': '１ Task ' + str(n), 'status': 'confirmed'}
+              for n in range(0, 1200, 2)]
+    resolved = gcal_sync.resolve_events(events)
+
+    assert [task_id for event, task_id, item, summary in resolved[:2]] == [0, 2]
+    assert resolved[1][2] == {'id': 2, 'content': 'Task'}
+    assert resolved[1][3] == ('Task 2', 'Task 2', None)
+    # the events without a task (ids above 999) are left alone
+    assert resolved[-1] == (events[-1], None, None, None)
+
+
+def test_pages_are_streamed_until_one_is_missing(database, monkeypatch):
+    pages = {None: {'items': [1], 'nextPageToken': 'a'}, 'a': {'items': [2], 'nextPageToken': 'b'},
+             'b': None}
+    requested = []
+
+    def fetch_events(calendar_id, sync_token, page_token=None, fields=None):
+        requested.append(page_token)
+        return pages[page_token]
+
+    monkeypatch.setattr(gcal_sync, 'fetch_events', fetch_events)
+    stream = gcal_sync.event_pages('cal', 'token')
+
+    assert next(stream)['items'] == [1]
+    assert next(stream)['items'] == [2]
+    assert list(stream) == []
+    assert requested == [None, 'a', 'b']
+
+
+def test_full_resync_replays_the_events_that_are_gone_or_changed(database, monkeypatch):
+    assert sql_ops.insert_rows('gcal_ids', [['Inbox', 'cal', 1, 'expired']])
+    rows = [[1, None, task_id, 'Mon 01 Jan 2030 21:59:59 +0000', 'event' + str(task_id), None, 0, 0, None]
+            for task_id in range(4)]
+    assert sql_ops.insert_rows('todoist', rows)
+    api = StubApi([{'id': task_id, 'content': 'Task ' + str(task_id)} for task_id in range(4)])
+    api.state['user'] = {'tz_info': {'timezone': 'UTC'}}
+    monkeypatch.setattr(todo, 'api', api)
+    monkeypatch.setattr(helper, 'ICONS', {'icons.eventSet': list(ICONS)})
+
+    def event(task_id, summary=None, date='2030-01-01', status='confirmed'):
+        return {'id': 'event' + str(task_id), 'summary': summary or '１ Task ' + str(task_id),
+                'status': status, 'start': {'date': date}, 'updated': '2030-01-01T00:00:00Z'}
+
+    # event0 unchanged, event1 renamed, event2 moved, event3 deleted, the rest have no task
+    pages = {None: {'items': [event(0), event(1, '１ Renamed'), {'id': 'foreign', 'summary': 'Meeting',
+                                                              'status': 'confirmed', 'start': {}}],
+                    'nextPageToken': 'a'},
+             'a': {'items': [event(2, date='2030-01-05'), event(3, status='cancelled')],
+                   'nextSyncToken': 'fresh'}}
+    monkeypatch.setattr(gcal_sync, 'fetch_events', lambda calendar_id, sync_token, page_token=None, fields=None:
+                        pages[page_token])
+    handled = []
+    monkeypatch.setattr(gcal_sync, 'handle_event', lambda calendar_id, event, task_id, item, summary:
+                        handled.append((event['id'], event['status'], task_id)))
+
+    assert gcal_sync.full_resync('cal') == 'fresh'
+    assert sorted(handled) == [('event1', 'confirmed', 1), ('event2', 'confirmed', 2),
+                               ('event3', 'cancelled', 3)]
+
+    # nor are the events whose row changed during the listing or whose task is in the outbox
+    synced_events = todo.synced_events
+    snapshots = iter([synced_events('cal'), dict(synced_events('cal'), event3=(3, '2030-01-09'))])
+    monkeypatch.setattr(todo, 'synced_events', lambda calendar_id: next(snapshots))
+    assert outbox.enqueue([{'op': planner.UPDATE, 'task_id': 1, 'item': None, 'fields': {planner.DESC}}])
+    handled.clear()
+    assert gcal_sync.full_resync('cal') == 'fresh'
+    assert sorted(handled) == [('event2', 'confirmed', 2)]
+    monkeypatch.setattr(todo, 'synced_events', synced_events)
+    sql_ops.delete_from_where('outbox', 'task_id', 1)
+
+    # an incomplete listing deletes nothing
+    del pages['a']['nextSyncToken']
+    handled.clear()
+    assert gcal_sync.full_resync('cal') is None
+    assert handled == []
+
+
+def test_events_of_tasks_left_in_the_outbox_are_left_alone(database, monkeypatch):
+    assert sql_ops.insert_rows('gcal_ids', [['Inbox', 'cal', 1, 'token']])
+    rows = [[1, None, task_id, None, 'event' + str(task_id), None, 0, 0, None] for task_id in range(2)]
+    assert sql_ops.insert_rows('todoist', rows)
+    # its changes failed to be pushed, to be retried
+    assert outbox.enqueue([{'op': planner.UPDATE, 'task_id': 0, 'item': {'id': 0, 'content': 'Task 0'},
+                            'fields': set()}])
+    monkeypatch.setattr(todo, 'api', StubApi([{'id': task_id, 'content': 'Task'} for task_id in range(2)]))
+    monkeypatch.setattr(helper, 'ICONS', {'icons.eventSet': list(ICONS)})
+    cancelled = [{'id': 'event' + str(task_id), 'summary': '１ Task', 'status': 'cancelled'}
+                 for task_id in range(2)]
+    pages = {None: {'items': cancelled, 'nextSyncToken': 'next'}}
+    monkeypatch.setattr(gcal_sync, 'fetch_events', lambda calendar_id, sync_token, page_token=None, fields=None:
+                        pages[page_token])
+    deleted = []
+    monkeypatch.setattr(todo, 'delete_task', lambda task_id: deleted.append(task_id))
+
+    gcal_sync.sync_gcal()
+
+    assert deleted == [1]
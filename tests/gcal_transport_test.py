@@ -0,0 +1,52 @@
+import gzip
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from todoist_gcal_sync.utils import gcal_transport
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            threading.Event().wait(1)
+        data = gzip.compress(b'{"id": "e1"}')
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setitem(USER_PREFS.data, 'gcal.readTimeoutSec', 0.2)
+    monkeypatch.setattr(gcal_transport, '_pool_pid', None)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:' + str(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_responses_look_like_the_ones_of_httplib2(server):
+    resp, content = gcal_transport.PooledHttp().request(server + '/event')
+
+    assert resp.status == 200
+    assert content == b'{"id": "e1"}'
+    assert resp['-content-encoding'] == 'gzip' and 'content-encoding' not in resp
+    assert resp['content-length'] == str(len(content))
+    assert resp['-content-length'] == str(len(gzip.compress(b'{"id": "e1"}')))
+
+
+def test_stalled_responses_time_out(server):
+    with pytest.raises(socket.timeout):
+        gcal_transport.PooledHttp().request(server + '/slow')
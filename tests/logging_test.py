@@ -0,0 +1,75 @@
+import queue
+import logging
+
+from todoist_gcal_sync.utils.setup.CustomQueueListener import CustomQueueListener
+from todoist_gcal_sync.utils.setup.log_cfg_extras import BoundedQueueHandler, BatchingFileHandler, LogSampler
+
+
+def make_logger(name, handler, level=logging.DEBUG):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def test_full_queue_drops_debug_records_and_reports_them():
+    log_queue = queue.Queue(2)
+    logger = make_logger('bounded', BoundedQueueHandler(log_queue, block_timeout=0))
+
+    for n in range(5):
+        logger.debug('event %s', n)
+    assert log_queue.qsize() == 2
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    logger.info('next')
+
+    records = [log_queue.get_nowait(), log_queue.get_nowait()]
+    assert [record.getMessage() for record in records] == \
+        ['next', '3 log records were dropped, the log queue was full.']
+    assert records[0].args is None
+
+
+def test_listener_writes_batches_to_file(tmpdir):
+    path = str(tmpdir.join('info.log'))
+    file_handler = BatchingFileHandler(path, when='d', utc=True, encoding='utf-8')
+    file_handler.setLevel(logging.INFO)
+    log_queue = queue.Queue(100)
+    logger = make_logger('batched', BoundedQueueHandler(log_queue))
+
+    listener = CustomQueueListener(log_queue, file_handler, batch_size=10)
+    for n in range(25):
+        logger.info('line %s', n)
+    logger.debug('below every handler')
+    listener.start()
+    listener.stop()
+    file_handler.close()
+
+    with open(path, encoding='utf-8') as log_file:
+        assert log_file.read().splitlines() == ['line ' + str(n) for n in range(25)]
+
+
+def test_sampler_lets_a_burst_through_per_period():
+    log_queue = queue.Queue()
+    logger = make_logger('sampled', BoundedQueueHandler(log_queue))
+    sampled_debug = LogSampler(logger, burst=3, period=3600)
+
+    for n in range(10):
+        sampled_debug('event %s', n)
+    assert log_queue.qsize() == 3
+    assert log_queue.get_nowait().funcName == 'test_sampler_lets_a_burst_through_per_period'
+
+    sampled_debug._window_start -= 3600
+    sampled_debug('event %s', 10)
+    messages = [log_queue.get_nowait().getMessage() for _ in range(log_queue.qsize())]
+    assert messages[-1] == 'event 10 (7 similar records suppressed)'
+
+
+def test_sampler_is_a_no_op_below_the_logger_level():
+    log_queue = queue.Queue()
+    sampled_debug = LogSampler(make_logger('quiet', BoundedQueueHandler(log_queue), logging.INFO))
+
+    sampled_debug('event %s', object())
+
+    assert log_queue.empty() and sampled_debug.suppressed == 0
@@ -0,0 +1,76 @@
+import json
+import urllib.request
+
+from todoist_gcal_sync.utils import metrics
+
+
+def setup_function():
+    metrics.reset()
+
+
+def test_counters_and_histograms_render_as_prometheus_text():
+    metrics.inc('retries_total', api='gcal')
+    metrics.inc('retries_total', api='gcal')
+    metrics.observe('handler_seconds', 0.02, handler='checked')
+    metrics.observe('handler_seconds', 3, handler='checked')
+
+    text = metrics.render_prometheus()
+
+    assert 'todoist_gcal_sync_retries_total{api="gcal"} 2' in text
+    assert 'todoist_gcal_sync_handler_seconds_bucket{handler="checked",le="0.025"} 1' in text
+    assert 'todoist_gcal_sync_handler_seconds_bucket{handler="checked",le="+Inf"} 2' in text
+    assert 'todoist_gcal_sync_handler_seconds_count{handler="checked"} 2' in text
+
+
+def test_timed_records_failed_calls_too():
+    @metrics.timed('db_query_seconds', op='select')
+    def query(fail):
+        if fail:
+            raise ValueError()
+        return 1
+
+    assert query(False) == 1
+    try:
+        query(True)
+    except ValueError:
+        pass
+
+    histogram = metrics.snapshot()['histograms'][0]
+    assert histogram['labels'] == {'op': 'select'}
+    assert histogram['count'] == 2
+
+
+def test_json_dump(tmpdir):
+    metrics.inc('retries_total', api='todoist')
+    path = str(tmpdir.join('metrics.json'))
+
+    metrics.dump_json(path)
+
+    with open(path) as metrics_file:
+        assert json.load(metrics_file)['counters'][0]['value'] == 1
+
+
+def test_http_endpoint():
+    metrics.inc('retries_total', api='todoist')
+    server = metrics.start_http_server(0)
+    try:
+        url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/metrics'
+        body = urllib.request.urlopen(url).read().decode('utf-8')
+    finally:
+        server.shutdown()
+
+    assert 'todoist_gcal_sync_retries_total{api="todoist"} 1' in body
+
+
+def test_increments_of_a_worker_add_up():
+    metrics.inc('retries_total', api='gcal')
+    metrics.observe('cycle_seconds', 0.02)
+    increments = metrics.snapshot(reset=True)
+    assert metrics.snapshot()['counters'] == []
+
+    metrics.inc('retries_total', api='gcal')
+    metrics.merge(increments)
+    metrics.merge(increments)
+
+    assert metrics.counters[('retries_total', (('api', 'gcal'),))] == 3
+    assert metrics.histograms[('cycle_seconds', ())][-1] == 2
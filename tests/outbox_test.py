@@ -0,0 +1,53 @@
+import pytest
+
+from todoist_gcal_sync import context, outbox, planner
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils.setup import helper
+
+
+@pytest.fixture(autouse=True)
+def database(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_PATH', str(tmpdir.join('data.db')))
+    sql_ops.init_db()
+    context.activate(context.AppContext())
+    yield
+    context.activate(None)
+
+
+def operation(op, task_id, content=None, fields=()):
+    item = {'id': task_id, 'content': content} if content else None
+    return {'op': op, 'task_id': task_id, 'item': item, 'fields': set(fields)}
+
+
+def test_changes_are_folded_per_task():
+    assert outbox.enqueue([operation(planner.INSERT, 1, 'first'),
+                           operation(planner.UPDATE, 2, None, [planner.DESC, planner.LOCATION]),
+                           {'op': planner.PROJECT, 'project': {'id': 9}}])
+    assert outbox.enqueue([operation(planner.UPDATE, 1, 'second', [planner.SUMMARY])])
+
+    tasks = outbox.pending_tasks()
+
+    assert outbox.pending_count() == 3
+    assert tasks[1]['item'] == {'id': 1, 'content': 'second'}
+    assert len(tasks[1]['op_ids']) == 2 and not tasks[1]['note']
+    assert tasks[2] == {'op_ids': [2], 'item': None, 'note': True, 'attempts': 0}
+
+
+def test_pushed_changes_leave_the_outbox(monkeypatch):
+    pushed = []
+    monkeypatch.setattr(outbox, 'push_task', lambda task_id, task: pushed.append(task_id) or True)
+    outbox.enqueue([operation(planner.INSERT, 1, 'a'), operation(planner.INSERT, 2, 'b')])
+
+    assert outbox.wait(timeout=10)
+    assert sorted(pushed) == [1, 2]
+    assert outbox.pending_count() == 0
+
+
+def test_failed_changes_are_retried_later(monkeypatch):
+    monkeypatch.setattr(outbox, 'push_task', lambda task_id, task: False)
+    outbox.enqueue([operation(planner.INSERT, 1, 'a')])
+
+    assert not outbox.wait(timeout=10)
+    assert outbox.pending_count() == 1
+    assert outbox.pending_tasks() == {}
+    assert sql_ops.select_from_where("attempts", "outbox")[0] == 1
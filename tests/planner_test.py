@@ -0,0 +1,103 @@
+from todoist_gcal_sync import planner
+
+INBOX = 1
+DUE = 'Mon 01 Jan 2018 21:59:59 +0000'
+NEW_DUE = 'Tue 02 Jan 2018 21:59:59 +0000'
+
+
+def item(task_id, project_id=10, due_date_utc=DUE, date_string='1 Jan', checked=0, is_deleted=0):
+    return {'id': task_id, 'project_id': project_id, 'due_date_utc': due_date_utc,
+            'date_string': date_string, 'checked': checked, 'is_deleted': is_deleted}
+
+
+def row(project_id=10, parent_project_id=10, due_date=DUE, event_id='evt'):
+    return {'project_id': project_id, 'parent_project_id': parent_project_id,
+            'due_date': due_date, 'event_id': event_id}
+
+
+def db_state(tasks=None, completed=(), calendars=(), parents=None, premium=False):
+    return {'tasks': tasks or {}, 'completed': set(completed), 'calendars': set(calendars),
+            'parents': parents or {10: 10, 20: 20}, 'inbox_project_id': INBOX, 'premium': premium}
+
+
+def test_no_changes():
+    assert planner.plan(db_state(), {'items': [], 'notes': [], 'projects': []}) == []
+
+
+def test_item_and_note_changes_fold_into_one_update():
+    state = db_state(tasks={5: row()})
+    delta = {'items': [item(5, due_date_utc=NEW_DUE), item(5, due_date_utc=NEW_DUE, checked=1)],
+             'notes': [{'item_id': 5}, {'item_id': 5}],
+             'projects': []}
+
+    operations = planner.plan(state, delta)
+
+    assert len(operations) == 1
+    assert operations[0]['op'] == planner.UPDATE
+    assert operations[0]['fields'] == {planner.SUMMARY, planner.DATE, planner.CHECKED,
+                                       planner.DESC, planner.LOCATION}
+    assert operations[0]['item']['checked'] == 1
+
+
+def test_unchanged_fields_are_left_out():
+    operations = planner.plan(db_state(tasks={5: row()}),
+                              {'items': [item(5)], 'notes': [], 'projects': []})
+
+    assert operations[0]['fields'] == {planner.SUMMARY}
+
+
+def test_project_move_changes_location():
+    operations = planner.plan(db_state(tasks={5: row()}),
+                              {'items': [item(5, project_id=20)], 'notes': [], 'projects': []})
+
+    assert planner.LOCATION in operations[0]['fields']
+
+
+def test_deletions():
+    state = db_state(tasks={5: row(), 6: row(), 7: row()})
+    delta = {'items': [item(5, is_deleted=1), item(6, due_date_utc=None), item(7, project_id=INBOX)],
+             'notes': [{'item_id': 5}], 'projects': []}
+
+    operations = planner.plan(state, delta)
+
+    assert [operation['op'] for operation in operations] == [planner.DELETE] * 3
+    assert all(not operation['fields'] for operation in operations)
+
+
+def test_new_and_undone_tasks():
+    state = db_state(completed=[6])
+    delta = {'items': [item(5), item(6), item(7, due_date_utc=None), item(8, checked=1)],
+             'notes': [], 'projects': []}
+
+    operations = planner.plan(state, delta)
+
+    assert [(operation['op'], operation['task_id']) for operation in operations] == \
+        [(planner.UNDO, 6), (planner.INSERT, 5)]
+
+
+def test_recurring_tasks_of_premium_users():
+    delta = {'items': [item(5, date_string='every day')], 'notes': [], 'projects': []}
+
+    assert planner.RECURRING in planner.plan(db_state(tasks={5: row()}, premium=True),
+                                             delta)[0]['fields']
+    assert planner.RECURRING not in planner.plan(db_state(tasks={5: row()}),
+                                                 delta)[0]['fields']
+
+
+def test_notes_of_unknown_tasks_are_ignored():
+    operations = planner.plan(db_state(), {'items': [], 'notes': [{'item_id': 5}], 'projects': []})
+
+    assert operations == []
+
+
+def test_deleted_project_takes_care_of_its_tasks():
+    project = {'id': 10, 'is_deleted': 1, 'is_archived': 0, 'indent': 1}
+    state = db_state(tasks={5: row(), 6: row(project_id=20, parent_project_id=20)},
+                     calendars=[10])
+    delta = {'items': [item(5, is_deleted=1), item(6)], 'notes': [{'item_id': 5}],
+             'projects': [project]}
+
+    operations = planner.plan(state, delta)
+
+    assert [operation['op'] for operation in operations] == [planner.PROJECT, planner.UPDATE]
+    assert operations[1]['task_id'] == 6
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+from click.testing import CliRunner
+
+from todoist_gcal_sync import context, todo
+from todoist_gcal_sync.utils import cli, sql_ops
+from todoist_gcal_sync.utils.setup import helper
+
+
+@pytest.fixture(autouse=True)
+def database(tmpdir, monkeypatch):
+    monkeypatch.setattr(helper, 'DB_PATH', str(tmpdir.join('data.db')))
+    monkeypatch.setattr(todo, 'timezone', lambda: 'UTC')
+    context.activate(context.AppContext())
+    sql_ops.init_db()
+    yield
+    context.activate(None)
+
+
+def add_row(task_id, project_id, times_overdue=0, times_rescheduled=0, table='todoist'):
+    sql_ops.insert_many(table, [project_id, None, task_id, 'Tue 01 Jan 2030 21:59:59 +0000',
+                                'event' + str(task_id), None, times_overdue, times_rescheduled, None])
+
+
+def todoist_date(days):
+    return (datetime.utcnow() + timedelta(days=days)).strftime('%a %d %b %Y 21:59:59 +0000')
+
+
+def counters(task_id):
+    return sql_ops.select_from_where(
+        "overdue, times_overdue, times_resheduled_on_due_date", "todoist", "task_id", task_id)
+
+
+def project_stats():
+    return sorted(sql_ops.select_from_where("*", "project_stats", None, None, True))
+
+
+def test_counters_and_rollup_are_updated_with_the_row():
+    add_row(1, 10)
+    add_row(2, 10, times_overdue=None, times_rescheduled=None)
+    add_row(3, 20)
+
+    assert todo.update_task_row(1, {'overdue': True}, became_overdue=True)
+    assert todo.update_task_row(2, {'overdue': None}, rescheduled=True)
+    assert todo.update_task_row(2, {}, became_overdue=True, rescheduled=True)
+    assert todo.update_task_row(3, {'overdue': None})
+
+    # counted during the cycle, written once at its end
+    assert counters(1) == (1, 0, 0) and project_stats() == []
+    assert todo.flush_task_stats()
+
+    assert counters(1) == (1, 1, 0)
+    assert counters(2) == (None, 1, 2)
+    assert project_stats() == [(10, 2, 2)]
+
+
+def test_only_moves_of_a_task_due_are_reschedules():
+    assert todo.rescheduled_on_due_date(todoist_date(0), todoist_date(1))
+    assert todo.rescheduled_on_due_date(todoist_date(-3), todoist_date(-1))
+    assert not todo.rescheduled_on_due_date(todoist_date(2), todoist_date(5))
+    assert not todo.rescheduled_on_due_date(todoist_date(0), todoist_date(0))
+    assert not todo.rescheduled_on_due_date(None, todoist_date(1))
+
+
+def test_rollup_is_seeded_from_the_rows_once():
+    add_row(1, 10, times_overdue=2)
+    add_row(2, 10, times_rescheduled=1)
+    add_row(3, 20, times_overdue=1, table='todoist_completed')
+
+    todo.init_project_stats()
+    todo.update_task_row(1, {}, became_overdue=True)
+    todo.flush_task_stats()
+    todo.init_project_stats()
+
+    assert project_stats() == [(10, 3, 1), (20, 1, 0)]
+
+
+def test_stats_command_prints_the_rollup():
+    sql_ops.insert_many("projects", ['Work', None, 10, 1])
+    add_row(1, 10)
+    add_row(2, 20)
+    todo.update_task_row(1, {}, became_overdue=True)
+    todo.update_task_row(2, {}, became_overdue=True, rescheduled=True)
+    todo.flush_task_stats()
+
+    result = CliRunner().invoke(cli.cli, ['stats'])
+
+    assert result.exit_code == 0
+    lines = [line.split() for line in result.output.splitlines()]
+    assert lines == [['project', 'overdue', 'rescheduled'], ['20', '1', '1'], ['Work', '1', '0']]
+
+
+def test_counts_of_a_task_completed_during_the_cycle_are_kept():
+    add_row(1, 10)
+    todo.update_task_row(1, {}, became_overdue=True)
+    todo.move_to_completed(1)
+
+    assert todo.flush_task_stats()
+
+    assert sql_ops.select_from_where("times_overdue", "todoist_completed", "task_id", 1) == (1,)
+    assert project_stats() == [(10, 1, 0)]
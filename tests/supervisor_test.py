@@ -0,0 +1,59 @@
+import time
+
+from todoist_gcal_sync import accounts, supervisor
+from todoist_gcal_sync.utils import metrics
+
+
+def test_ring_moves_only_the_keys_of_the_node_leaving():
+    keys = ['account' + str(n) for n in range(1000)]
+    ring = supervisor.HashRing(['worker-0', 'worker-1', 'worker-2', 'worker-3'])
+    before = {key: ring.node_for(key) for key in keys}
+
+    ring.remove('worker-2')
+    after = {key: ring.node_for(key) for key in keys}
+
+    moved = [key for key in keys if before[key] != after[key]]
+    assert moved and all(before[key] == 'worker-2' for key in moved)
+    assert 'worker-2' not in after.values()
+    # each node gets a fair share of the keys
+    assert all(150 < list(before.values()).count(node) < 350 for node in set(before.values()))
+
+
+def stub_worker_main(worker_id, conn, log_queue):
+    """ worker_main() of a worker whose cycles do nothing (the workers are spawned, not forked). """
+    accounts.run_cycle = lambda account: time.sleep(0.01)
+    supervisor.worker_main(worker_id, conn, log_queue)
+
+
+def test_accounts_move_away_from_a_dead_worker_and_back(monkeypatch):
+    monkeypatch.setattr(supervisor, 'RESTART_DELAY_SEC', 0.5)
+    metrics.reset()
+    names = sorted('account' + str(n) for n in range(12))
+    sup = supervisor.Supervisor(names, 3, target=stub_worker_main)
+
+    def wait_for(condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            sup.poll(0.1)
+
+    def synced():
+        return sorted(name for names in sup.assignment().values() for name in names)
+
+    sup.start()
+    try:
+        wait_for(lambda: synced() == names and len(sup.assignment()) == 3)
+        before = sup.assignment()
+
+        supervisor.kill(sup.workers['worker-1'].process)
+        wait_for(lambda: 'worker-1' not in sup.ring)
+        wait_for(lambda: synced() == names)
+        assert 'worker-1' not in sup.assignment()
+        for worker_id in ['worker-0', 'worker-2']:
+            assert set(before[worker_id]) <= set(sup.assignment()[worker_id])
+
+        # restarted, it gets its accounts back
+        wait_for(lambda: sup.assignment() == before)
+        assert metrics.counters[('worker_restarts_total', (('worker', 'worker-1'),))] == 1
+    finally:
+        sup.stop()
@@ -0,0 +1,101 @@
+import pytest
+import todoist
+
+from todoist_gcal_sync import context, todo, todoist_state
+
+
+@pytest.fixture
+def api(tmpdir):
+    return todoist_state.CompactTodoistAPI('token', cache=str(tmpdir) + '/')
+
+
+def item(item_id, content, **fields):
+    data = {'id': item_id, 'project_id': 1, 'content': content, 'due_date_utc': None,
+            'date_string': '', 'checked': 0, 'in_history': 0, 'is_deleted': 0, 'is_archived': 0,
+            'user_id': 7, 'sync_id': None, 'date_added': 'Mon 01 Jan 2018 10:00:00 +0000'}
+    data.update(fields)
+    return data
+
+
+def test_objects_are_kept_as_indexed_records(api):
+    api._update_state({'items': [item(1, 'Write'), item(2, 'Read')],
+                       'projects': [{'id': 1, 'name': 'Work', 'indent': 1, 'shared': False}],
+                       'filters': [{'id': 3, 'name': 'Today'}],
+                       'day_orders': {'1': 0}})
+    api._update_state({'items': [item(1, 'Write more', priority=4)]})
+
+    write = api.items.get_by_id(1)
+    assert isinstance(write.data, todoist_state.ItemRecord)
+    assert write['content'] == 'Write more' and write['priority'] == 4
+    assert 'date_added' not in write.data and write.data.get('user_id') is None
+    with pytest.raises(KeyError):
+        write['sync_id']
+    assert dict(api.projects.get_by_id(1).data) == {'id': 1, 'name': 'Work', 'indent': 1}
+    assert len(api.state['items']) == 2
+    assert api.state['filters'] == [] and api.state['day_orders'] == {}
+
+
+def test_completed_items_and_their_notes_are_evicted_once_handled(api):
+    api._update_state({'items': [item(1, 'Write'), item(2, 'Read'), item(3, 'Call')],
+                       'notes': [{'id': 10, 'item_id': 1, 'content': 'draft'},
+                                 {'id': 11, 'item_id': 2, 'content': 'book'}]})
+    api._update_state({'items': [item(1, 'Write', checked=1), item(3, 'Call', is_deleted=1)]})
+
+    # the handlers of the sync still find the completed item
+    assert api.items.get_by_id(1, only_local=True)['checked'] == 1
+    assert api.items.get_by_id(3, only_local=True) is None
+
+    assert api.evict() == 2
+    assert [obj['id'] for obj in api.state['items']] == [2]
+    assert [obj['id'] for obj in api.state['notes']] == [11]
+
+    # uncompleted later on
+    api._update_state({'items': [item(1, 'Write')]})
+    api.evict()
+    assert api.items.get_by_id(1, only_local=True)['content'] == 'Write'
+
+
+def test_only_the_sync_of_a_cycle_evicts(api, monkeypatch):
+    monkeypatch.setattr(todoist.TodoistAPI, 'sync', lambda self, commands=None: {})
+    api._update_state({'items': [item(1, 'Write', checked=1)]})
+
+    # a command commit of the workers, the completed item is still being handled
+    api.commit()
+    api.sync(commands=[])
+    assert api.items.get_by_id(1, only_local=True) is not None
+
+    app_context = context.AppContext()
+    app_context._todoist_api = api
+    context.activate(app_context)
+    try:
+        todo.todoist_sync()
+    finally:
+        context.activate(None)
+    assert api.items.get_by_id(1, only_local=True) is None
+
+
+def test_items_added_locally_are_found_by_their_new_id(api):
+    added = api.items.add('Write', 1)
+    assert api.items.get_by_id(added.temp_id, only_local=True) is added
+
+    api._replace_temp_id(added.temp_id, 42)
+    api._update_state({'items': [item(42, 'Write')]})
+
+    assert api.items.get_by_id(42, only_local=True) is added
+    assert len(api.state['items']) == 1
+
+
+def test_state_is_reloaded_from_the_cache(api, tmpdir):
+    api._update_state({'items': [item(1, 'Write', labels=[5])],
+                       'notes': [{'id': 10, 'item_id': 1, 'content': 'draft'}],
+                       'user': {'id': 7, 'inbox_project': 1}})
+    api.sync_token = 'token1'
+    api._write_cache()
+
+    reloaded = todoist_state.CompactTodoistAPI('token', cache=str(tmpdir) + '/')
+
+    assert reloaded.sync_token == 'token1'
+    assert reloaded.items.get_by_id(1, only_local=True).data.to_dict() == \
+        api.items.get_by_id(1).data.to_dict()
+    assert reloaded.notes.get_by_id(10, only_local=True)['content'] == 'draft'
+    assert reloaded.state['user'] == {'id': 7, 'inbox_project': 1}
@@ -0,0 +1,77 @@
+import json
+import types
+
+from todoist_gcal_sync.utils import tracing
+
+
+def make_module():
+    module = types.ModuleType('fake_gcal')
+
+    def patch_event(cal_id, event_id, event):
+        return module.move_event(cal_id, event_id, 'dest')
+
+    def move_event(cal_id, event_id, dest_cal_id):
+        return event_id
+
+    for func in (patch_event, move_event):
+        func.__module__ = module.__name__
+        setattr(module, func.__name__, func)
+    return module
+
+
+def teardown_function():
+    tracing.enabled = False
+    tracing.drain()
+
+
+def test_disabled_tracing_records_nothing():
+    module = make_module()
+    tracing.instrument(module)
+
+    with tracing.cycle():
+        assert module.patch_event('cal', 'evt', {}) == 'evt'
+
+    assert tracing.drain() == ([], {})
+
+
+def test_cycle_is_dumped_as_chrome_trace_and_collapsed_stacks(tmpdir):
+    module = make_module()
+    tracing.instrument(module)
+    tracing.enable(str(tmpdir))
+
+    with tracing.cycle():
+        module.patch_event('cal', 'evt', {})
+
+    json_files = tmpdir.listdir(lambda path: path.ext == '.json')
+    folded_files = tmpdir.listdir(lambda path: path.ext == '.folded')
+    assert len(json_files) == 1 and len(folded_files) == 1
+
+    events = json.loads(json_files[0].read())['traceEvents']
+    assert [event['name'] for event in events] == \
+        ['fake_gcal.move_event', 'fake_gcal.patch_event', 'cycle']
+    assert events[1]['args'] == {'cal_id': 'cal', 'event_id': 'evt'}
+
+    stacks = [line.rsplit(' ', 1)[0] for line in folded_files[0].read().splitlines()]
+    assert stacks == ['cycle', 'cycle;fake_gcal.patch_event',
+                      'cycle;fake_gcal.patch_event;fake_gcal.move_event']
+
+
+def test_fast_cycles_are_not_dumped(tmpdir):
+    tracing.enable(str(tmpdir), cycle_threshold_ms=60000)
+
+    with tracing.cycle():
+        pass
+
+    assert tmpdir.listdir() == []
+
+
+def test_only_the_last_dumps_are_kept(tmpdir):
+    tracing.enable(str(tmpdir), keep=2)
+
+    for _ in range(3):
+        with tracing.cycle():
+            pass
+    names = sorted(path.purebasename for path in tmpdir.listdir(lambda path: path.ext == '.json'))
+
+    assert len(names) == 2
+    assert sorted(path.purebasename for path in tmpdir.listdir(lambda path: path.ext == '.folded')) == names
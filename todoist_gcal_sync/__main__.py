@@ -1,6 +1,7 @@
 """
 Interface of the daemon.
 """
+import argparse
 import logging
 import os
 import signal
@@ -10,10 +11,15 @@ import time
 import requests
 import schedule
 import urllib3
+import todoist_gcal_sync.gcal as gcal
 import todoist_gcal_sync.gcal_sync as gcal_sync
 import todoist_gcal_sync.todo as todoist
+import todoist_gcal_sync.accounts as accounts
+import todoist_gcal_sync.supervisor as supervisor
 import todoist_gcal_sync.utils.setup.logger
-from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync.utils import tracing
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS, LOGS_DIR_PATH
 from todoist_gcal_sync.utils.setup.helper import build_folder_higherarchy
 
 
@@ -31,6 +37,42 @@ def set_env_tz(todoist_user_tz):
     time.tzset()
 
 
+def metrics_init():
+    """ Exposes the metrics of the daemon, as configured in settings.json. """
+
+    if USER_PREFS['metrics.httpPort']:
+        metrics.start_http_server(USER_PREFS['metrics.httpPort'])
+
+    if USER_PREFS['metrics.dumpIntervalSec']:
+        schedule.every(USER_PREFS['metrics.dumpIntervalSec']).seconds.do(
+            metrics.dump_json, LOGS_DIR_PATH + 'metrics.json')
+
+
+def profiling_init(cycle_threshold_ms, keep):
+    """ Wraps the sync handlers and every gcal.* call into trace spans. """
+
+    tracing.instrument(todoist, ['sync_todoist', 'overdue', 'reconcile', 'apply_operation',
+                                 'update_event', 'new_task_added', 'date_google', 'checked',
+                                 'deletion', 'undo', 'project_changed'])
+    tracing.instrument(gcal_sync, ['sync_gcal', 'cal_id'])
+    tracing.instrument(gcal)
+    tracing.enable(LOGS_DIR_PATH + 'profile/', cycle_threshold_ms, keep)
+
+
+def parse_args():
+    """ Returns the command line options of the daemon; the oauth2client flags are left alone. """
+
+    parser = argparse.ArgumentParser(prog='todoist_gcal_sync')
+    parser.add_argument('--profile', action='store_true',
+                        help='dump the trace spans of each sync cycle to logs/profile/')
+    parser.add_argument('--profile-threshold-ms', type=int, default=0,
+                        help='only dump the cycles slower than this (default: 0)')
+    parser.add_argument('--profile-keep', type=int, default=tracing.MAX_DUMPS,
+                        help='number of cycle dumps kept, the oldest are removed (default: '
+                             + str(tracing.MAX_DUMPS) + ')')
+    return parser.parse_known_args()[0]
+
+
 def main():
     """
         Daemon starting point.
@@ -38,13 +80,16 @@ def main():
     todoist.overdue()
 
     schedule.every().day.at("00:00").do(todoist.overdue)
+    schedule.every(USER_PREFS['daemon.reconcileIntervalMin']).minutes.do(
+        todoist.reconcile)
 
     LOG.info('Entering syncing mode...')
     while True:
         schedule.run_pending()
         try:
-            todoist.sync_todoist()
-            gcal_sync.sync_gcal()
+            with metrics.timer('cycle_seconds'), tracing.cycle():
+                todoist.sync_todoist()
+                gcal_sync.sync_gcal()
         except (TimeoutError, urllib3.exceptions.ReadTimeoutError,
                 requests.exceptions.ReadTimeout, OSError, urllib3.exceptions.ProtocolError,
                 requests.exceptions.ConnectionError, ConnectionResetError) as err:
@@ -54,10 +99,38 @@ def main():
         time.sleep(USER_PREFS['daemon.refreshRateSec'])
 
 
+def main_accounts():
+    """
+        Daemon starting point of the multi-account mode, see accounts.py.
+    """
+    LOG.info('Entering syncing mode for ' + str(len(USER_PREFS['daemon.accounts']))
+             + ' accounts...')
+    accounts.Scheduler(accounts.load_accounts()).run(tick=schedule.run_pending)
+
+
+def main_supervisor():
+    """
+        Daemon starting point of the supervisor mode, see supervisor.py.
+    """
+    LOG.info('Syncing ' + str(len(USER_PREFS['daemon.accounts'])) + ' accounts with '
+             + str(USER_PREFS['daemon.workerProcesses']) + ' worker processes...')
+    supervisor.Supervisor(USER_PREFS['daemon.accounts'],
+                          USER_PREFS['daemon.workerProcesses']).run(tick=schedule.run_pending)
+
+
 if __name__ == "__main__":
+    ARGS = parse_args()
     signal.signal(signal.SIGINT, signal_handler)
     LOG = logging.getLogger(__name__)
     build_folder_higherarchy()
-    set_env_tz(todoist.timezone())
-    todoist.module_init()
-    main()
+    metrics_init()
+    if ARGS.profile:
+        profiling_init(ARGS.profile_threshold_ms, ARGS.profile_keep)
+    if USER_PREFS['daemon.accounts'] and USER_PREFS['daemon.workerProcesses']:
+        main_supervisor()
+    elif USER_PREFS['daemon.accounts']:
+        main_accounts()
+    else:
+        set_env_tz(todoist.timezone())
+        todoist.module_init()
+        main()
@@ -0,0 +1,227 @@
+"""
+Multi-account mode: one daemon process syncing many Todoist/Google account pairs.
+
+Each account of "daemon.accounts" (settings.json) has an application context of its
+own (see context.AppContext), hence its own API clients, Todoist state and database:
+
+    ~/.todoist-gcal-sync/.credentials/<account>.todoist_token
+    ~/.credentials/todoist_gcal_sync.<account>.json
+    ~/.todoist-gcal-sync/db/<account>.db
+
+The sync cycles of the accounts are run by a shared pool of "daemon.accountWorkers"
+threads, and their Gcal writes by a shared outbox pool. Accounts are served in round
+robin: an account due for a cycle waits behind every account that was due before it,
+and never has more than one cycle running, so that a slow or failing account delays
+its own cycles only.
+
+Dependencies: pytz, requests, urllib3
+"""
+
+import time
+import logging
+import threading
+import collections
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import pytz
+import requests
+import urllib3
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync import context
+
+log = logging.getLogger(__name__)
+
+# errors of the network, after which an account is retried once 'daemon.connErrDelaySec' passed
+CONNECTION_ERRORS = (TimeoutError, urllib3.exceptions.ReadTimeoutError,
+                     requests.exceptions.ReadTimeout, OSError, urllib3.exceptions.ProtocolError,
+                     requests.exceptions.ConnectionError, ConnectionResetError)
+
+
+class Account(object):
+    """ Scheduling state of an account. """
+
+    def __init__(self, app_context):
+        self.context = app_context
+        self.name = app_context.account
+        self.initialized = False
+        self.disabled = False
+        self.next_cycle = 0.0
+        self.next_reconcile = None
+        self.overdue_date = None
+        self.cycles = 0
+        self.failures = 0
+
+
+def load_accounts(names=None):
+    """ Returns an Account per name of "daemon.accounts" (or of 'names'). """
+    if names is None:
+        names = USER_PREFS['daemon.accounts']
+    return [Account(context.AppContext(name)) for name in names]
+
+
+def run_cycle(account):
+    """
+        One sync cycle of an account, in its context: initializes the account on its first
+        cycle, runs overdue() once a day past its midnight (in the account's Todoist time
+        zone), and reconcile() every "daemon.reconcileIntervalMin" minutes.
+    """
+    from todoist_gcal_sync import todo as todoist
+    from todoist_gcal_sync import gcal_sync
+
+    context.activate_thread(account.context)
+    try:
+        if not account.initialized:
+            todoist.module_init()
+            account.initialized = True
+            account.overdue_date = today(todoist.timezone())
+            account.next_reconcile = time.monotonic() + \
+                USER_PREFS['daemon.reconcileIntervalMin'] * 60
+
+        with metrics.timer('cycle_seconds', account=account.name):
+            todoist.sync_todoist()
+            gcal_sync.sync_gcal()
+
+        if today(todoist.timezone()) != account.overdue_date:
+            todoist.overdue()
+            account.overdue_date = today(todoist.timezone())
+
+        if time.monotonic() >= account.next_reconcile:
+            todoist.reconcile()
+            account.next_reconcile = time.monotonic() + \
+                USER_PREFS['daemon.reconcileIntervalMin'] * 60
+        return True
+    finally:
+        context.activate_thread(None)
+
+
+def today(timezone):
+    """ Today's date in the time zone provided. """
+    return datetime.now(pytz.timezone(timezone)).date()
+
+
+class Scheduler(object):
+    """
+        Runs the sync cycles of the accounts in round robin, on a pool of 'workers' threads;
+        an account is due again "daemon.refreshRateSec" seconds after its last cycle ended
+        ("daemon.connErrDelaySec" after a failed one).
+    """
+
+    def __init__(self, accounts, workers=None, outbox_workers=None):
+        self.accounts = list(accounts)
+        self.workers = workers or USER_PREFS['daemon.accountWorkers']
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='account')
+
+        # one outbox pool for every account, instead of one per account
+        self.outbox_pool = ThreadPoolExecutor(
+            max_workers=outbox_workers or USER_PREFS['outbox.workers'],
+            thread_name_prefix='outbox')
+        for account in accounts:
+            account.context.outbox_pool = self.outbox_pool
+
+        self.cond = threading.Condition()
+        self.ready = collections.deque(accounts)
+        self.waiting = []
+        # accounts with a cycle running
+        self.running = set()
+
+    def run(self, stop=None, tick=None):
+        """
+            Schedules cycles until stop() returns true (forever if None), calling tick()
+            at least once a second, e.g. schedule.run_pending.
+        """
+        while stop is None or not stop():
+            if tick is not None:
+                tick()
+            self.schedule()
+            with self.cond:
+                self.cond.wait(self.next_wakeup())
+
+    def next_wakeup(self):
+        """ Seconds until the next account is due (caller holds self.cond). """
+        if self.ready and len(self.running) < self.workers:
+            return 0
+        if not self.waiting:
+            return 1.0
+        next_cycle = min(account.next_cycle for account in self.waiting)
+        return min(max(next_cycle - time.monotonic(), 0), 1.0)
+
+    def schedule(self):
+        """ Submits the cycles of the accounts that are due, in the order they became due. """
+        with self.cond:
+            now = time.monotonic()
+            self.waiting.sort(key=lambda account: account.next_cycle)
+            while self.waiting and self.waiting[0].next_cycle <= now:
+                self.ready.append(self.waiting.pop(0))
+
+            submitted = []
+            while self.ready and len(self.running) < self.workers:
+                account = self.ready.popleft()
+                self.running.add(account)
+                submitted.append(account)
+
+        for account in submitted:
+            future = self.pool.submit(run_cycle, account)
+            future.add_done_callback(lambda future, account=account: self.done(account, future))
+        return len(submitted)
+
+    def done(self, account, future):
+        """ Reschedules an account once its cycle ended (pool thread). """
+        delay = USER_PREFS['daemon.connErrDelaySec']
+        try:
+            future.result()
+            account.cycles += 1
+            account.failures = 0
+            delay = USER_PREFS['daemon.refreshRateSec']
+        except CONNECTION_ERRORS as err:
+            log.warning('Account ' + account.name + ': ' + str(err))
+            account.failures += 1
+        except Exception as err:
+            log.exception('Account ' + account.name + ': ' + str(err))
+            account.failures += 1
+        except BaseException as err:
+            # e.g. the sys.exit() of a handler: the other accounts keep being synced
+            log.critical('Account ' + account.name + ' is no longer synced: ' + repr(err))
+            account.disabled = True
+
+        metrics.inc('account_cycles_total', account=account.name,
+                    status='error' if account.failures or account.disabled else 'ok')
+        with self.cond:
+            self.running.discard(account)
+            if not account.disabled and account in self.accounts:
+                account.next_cycle = time.monotonic() + delay
+                self.waiting.append(account)
+            self.cond.notify_all()
+
+    def add(self, account):
+        """ Starts scheduling the cycles of an account. """
+        with self.cond:
+            account.context.outbox_pool = self.outbox_pool
+            self.accounts.append(account)
+            self.ready.append(account)
+            self.cond.notify_all()
+
+    def remove(self, name, timeout=None):
+        """
+            Stops scheduling the cycles of an account, waiting for its running cycle and its
+            Gcal writes in flight; returns the account, or None if it is not scheduled here.
+        """
+        with self.cond:
+            account = next((account for account in self.accounts if account.name == name), None)
+            if account is None:
+                return None
+            self.accounts.remove(account)
+            if account in self.ready:
+                self.ready.remove(account)
+            if account in self.waiting:
+                self.waiting.remove(account)
+            self.cond.wait_for(lambda: account not in self.running, timeout)
+
+        app_context = account.context
+        with app_context.outbox_cond:
+            app_context.outbox_cond.wait_for(lambda: not app_context.outbox_running, timeout)
+        return account
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+        self.outbox_pool.shutdown(wait=wait)
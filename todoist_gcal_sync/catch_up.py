@@ -0,0 +1,212 @@
+"""
+Catch-up mode of the daemon's start (Todoist --> Gcal), for the large deltas that pile up
+while the daemon is down (or the full state, when the Todoist cache is gone).
+
+Instead of queuing every changed task for the outbox workers, the delta is diffed in memory
+against snapshots taken with a handful of bulk requests: the rows of the "todoist",
+"todoist_completed" and "gcal_ids" tables, and the live events of the daemon's calendars,
+keyed by the content hash of their managed fields (todo.event_hash()). Only the tasks whose
+event actually has to change reach the outbox; the rows that merely lag behind Gcal are
+fixed, and the rows of events deleted along with their task are dropped, in batched writes.
+
+The Gcal changes of the downtime are left to the next gcal_sync.sync_gcal(), as usual.
+
+Dependencies: pytz
+"""
+
+import logging
+from datetime import datetime
+
+import pytz
+
+from todoist_gcal_sync import context
+from todoist_gcal_sync import gcal_sync
+from todoist_gcal_sync import outbox
+from todoist_gcal_sync import planner
+from todoist_gcal_sync import todo as todoist
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+
+log = logging.getLogger(__name__)
+
+# the fields of the events hashed by live_hash()
+SNAPSHOT_FIELDS = ('items(id,status,summary,location,description,start,end,colorId,reminders),'
+                   'nextPageToken,nextSyncToken')
+
+# the operations whose event is entirely described by todo.desired_event()
+HASHED_FIELDS = frozenset([planner.SUMMARY, planner.DATE, planner.DESC])
+
+ROW_COLUMNS = 'project_id, parent_project_id, task_id, due_date, event_id, overdue, event_hash'
+
+
+def needed(sync_response):
+    """ True if a valid Todoist sync response holds enough changes to be worth a catch-up. """
+    if not sync_response or not todoist.is_post_response_valid(sync_response)[0]:
+        return False
+    return bool(sync_response.get('full_sync')) \
+        or len(sync_response['items']) >= USER_PREFS['daemon.catchUpMinChanges']
+
+
+def db_snapshot():
+    """
+        Returns ({task id: row} of the "todoist" table, the task ids of the "todoist_completed"
+        table, {project id: calendar id} of the "gcal_ids" table), with one query each.
+    """
+    rows = {}
+    for project_id, parent_project_id, task_id, due_date, event_id, overdue, event_hash in \
+            sql_ops.select_from_where(ROW_COLUMNS, "todoist", None, None, True) or []:
+        rows[task_id] = {'project_id': project_id, 'parent_project_id': parent_project_id,
+                         'due_date': due_date, 'event_id': event_id, 'overdue': overdue,
+                         'event_hash': event_hash}
+
+    completed = set(row[0] for row in
+                    sql_ops.select_from_where("task_id", "todoist_completed", None, None, True) or [])
+    calendars = dict(sql_ops.select_from_where(
+        "todoist_project_id, calendar_id", "gcal_ids", None, None, True) or [])
+    return rows, completed, calendars
+
+
+def parent_projects(projects):
+    """ Returns {project id: id of its top level project} of the projects of the Todoist state. """
+    by_id = {project['id']: project for project in projects}
+    parents = {}
+    for project_id, project in by_id.items():
+        while project is not None and project['indent'] != 1:
+            project = by_id.get(project['parent_id'])
+        parents[project_id] = project['id'] if project is not None else None
+    return parents
+
+
+def live_hash(event):
+    """ Content hash of the managed fields of a live event, comparable with todo.event_hash(). """
+    start = event.get('start') or {}
+    end = event.get('end') or {}
+    color_id = event.get('colorId')
+    return todoist.event_hash(todoist.event_body(
+        event.get('summary', ''), start.get('date'), end.get('date'),
+        location=event.get('location', ''), desc=event.get('description', ''),
+        color_id=int(color_id) if color_id else None,
+        reminders=(event.get('reminders') or {}).get('overrides')))
+
+
+def gcal_snapshot(calendar_ids):
+    """
+        Returns {event id: live_hash()} of the live events of the calendars, along with the
+        calendars that could be listed in full.
+    """
+    events = {}
+    listed = set()
+    for calendar_id in calendar_ids:
+        complete = False
+        for page in gcal_sync.event_pages(calendar_id, None, fields=SNAPSHOT_FIELDS):
+            for event in page.get('items', []):
+                if event['status'] != 'cancelled':
+                    events[event['id']] = live_hash(event)
+            complete = 'nextSyncToken' in page
+        if complete:
+            listed.add(calendar_id)
+    return events, listed
+
+
+def diff(operations, events, listed, row_calendar):
+    """
+        Splits the task operations planned for the delta into (operations left to the
+        outbox, [(due date, overdue, event hash, task id)] of the rows to fix, task ids of the
+        rows to drop); 'row_calendar' returns the calendar id of a row.
+    """
+    todoist_tz = pytz.timezone(todoist.timezone())
+    today = datetime.now(todoist_tz).date()
+
+    kept, fixed, dropped = [], [], []
+    for operation in operations:
+        row = operation.get('row')
+        if row is None or row_calendar(row) not in listed:
+            kept.append(operation)
+            continue
+
+        live = events.get(row['event_id'])
+        if live is None:
+            if operation['op'] == planner.DELETE:
+                # the event is gone already, only its row is left
+                dropped.append(operation['task_id'])
+            # an event deleted on Gcal is left to the Gcal sync, which deletes its task
+            continue
+
+        item = operation['item']
+        if operation['op'] != planner.UPDATE or item is None \
+                or not operation['fields'] <= HASHED_FIELDS:
+            kept.append(operation)
+            continue
+
+        new_event_hash = todoist.event_hash(todoist.desired_event(item))
+        if new_event_hash not in (live, row['event_hash']):
+            kept.append(operation)
+        elif new_event_hash != row['event_hash'] or item['due_date_utc'] != row['due_date']:
+            # Gcal shows the task as it is (or an edit made on Gcal, up to the Gcal sync),
+            # the row only lags behind
+            due_date = todoist.__todoist_utc_to_date__(item['due_date_utc'])
+            fixed.append((item['due_date_utc'], True if due_date < today else None,
+                          new_event_hash, operation['task_id']))
+
+    return kept, fixed, dropped
+
+
+@metrics.timed('handler_seconds', handler='catch_up')
+def run(sync_response):
+    """
+        Brings Gcal in line with a large Todoist delta (see needed()), in place of
+        todo.sync_todoist(sync_response).
+    """
+    write_to_db = True
+    rows, completed, calendars = db_snapshot()
+    parents = parent_projects(todoist.api.state['projects'])
+
+    delta = {'items': sync_response['items'], 'notes': sync_response['notes'],
+             'projects': sync_response['projects']}
+    todoist.index_notes(delta['notes'])
+
+    db_state = {'tasks': rows, 'completed': completed, 'calendars': set(calendars),
+                'parents': parents, 'inbox_project_id': context.current().inbox_project_id,
+                'premium': context.current().premium_user}
+    operations = planner.plan(db_state, delta)
+
+    for operation in operations:
+        if operation['op'] == planner.PROJECT:
+            try:
+                todoist.apply_operation(operation)
+            except Exception as err:
+                write_to_db = False
+                log.exception(str(err) + ' Could not apply the changes of project id: '
+                              + str(operation['project']['id']))
+
+    # calendars may have been created or deleted by the project operations
+    calendars = dict(sql_ops.select_from_where(
+        "todoist_project_id, calendar_id", "gcal_ids", None, None, True) or [])
+    events, listed = gcal_snapshot(set(calendars.values()))
+
+    def row_calendar(row):
+        return calendars.get(row['project_id']) or calendars.get(row['parent_project_id'])
+
+    task_operations = [operation for operation in operations if operation['op'] != planner.PROJECT]
+    kept, fixed, dropped = diff(task_operations, events, listed, row_calendar)
+
+    if not sql_ops.update_rows("todoist", "due_date = ?, overdue = ?, event_hash = ?", "task_id = ?", fixed) \
+            or not sql_ops.delete_where_in("todoist", "task_id", dropped) \
+            or not outbox.enqueue(kept):
+        write_to_db = False
+
+    skipped = len(task_operations) - len(kept) - len(fixed) - len(dropped)
+    metrics.inc('catch_up_tasks_total', len(kept), outcome='queued')
+    metrics.inc('catch_up_tasks_total', len(fixed), outcome='fixed')
+    metrics.inc('catch_up_tasks_total', len(dropped), outcome='dropped')
+    metrics.inc('catch_up_tasks_total', skipped, outcome='skipped')
+    log.info('Catch-up of ' + str(len(task_operations)) + ' changed tasks against ' + str(len(events))
+             + ' events: ' + str(len(kept)) + ' queued, ' + str(len(fixed)) + ' rows fixed, '
+             + str(len(dropped)) + ' dropped and ' + str(skipped) + ' unchanged.')
+
+    if write_to_db:
+        todoist.write_sync_db(sync_response)
+
+    outbox.drain()
+    todoist.flush_task_stats()
@@ -0,0 +1,239 @@
+"""
+Application context of the daemon.
+
+Holds the API clients and the state of a run. The clients are only built, and
+their (heavy) modules only imported, when first used, so that importing the
+modules of the package neither touches the network nor the credentials.
+
+Dependencies: todoist-python, google-api-python-client, oauth2client
+"""
+
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class AppContext(object):
+    """
+        API clients and state of a run; the clients are built on first access.
+
+        'account' names one of the accounts of the multi-account mode (see accounts.py),
+        whose credentials and database are kept apart from the others; None for the
+        single account of the daemon.
+    """
+
+    # the discovery document is the same for every account, it is loaded once per process
+    _gcal_discovery_doc = None
+    _gcal_discovery_lock = threading.Lock()
+
+    def __init__(self, account=None):
+        self.account = account
+        self._lock = threading.RLock()
+        self._todoist_api = None
+        self._initial_sync = None
+        self._gcal_credentials = None
+        self._gcal_credential_manager = None
+        self._gcal_service = None
+
+        # task notes by item id, fed by the 'notes' of each api.sync() response
+        self.notes_index = {}
+
+        # summary --> id of the calendars in the user's calendar list, fetched once per run
+        self.calendar_list = {}
+        self.calendar_list_sync_token = None
+
+        # ids of the events moved to a different calendar, which Gcal reports as cancelled
+        # in their former calendar
+        self.moved_events = set()
+
+        # per thread state of the worker pools, e.g. the Todoist commands of a batch
+        self.thread_local = threading.local()
+
+        # serializes the api.sync() and api.commit() calls of the main loop and the workers
+        self.todoist_lock = threading.RLock()
+
+        # (command, attempts) of the Todoist commands to commit again, see todo.commit_commands()
+        self.retry_commands = []
+        # uuid --> function called once Todoist has confirmed the command, see todo.commit()
+        self.command_callbacks = {}
+        # 'items', 'notes' and 'projects' merged by the command commits, see todo.keep_commit_delta()
+        self.commit_deltas = []
+
+        # task id --> [times overdue, times rescheduled] of the cycle, see todo.flush_task_stats()
+        self.task_stats = {}
+        self.task_stats_lock = threading.Lock()
+
+        # requests the next page of Gcal changes while gcal_sync processes the current one
+        self._prefetch_pool = None
+
+        # worker pool of the outbox, and the tasks it is pushing
+        self.outbox_pool = None
+        self.outbox_running = set()
+        self.outbox_cond = threading.Condition()
+        # tasks with changes left in the outbox during the Gcal pass, their events are left alone
+        self.outbox_tasks = set()
+
+    @property
+    def db_path(self):
+        """ Path of the database of the account. """
+        from todoist_gcal_sync.utils.setup import helper
+
+        if self.account is None:
+            return helper.DB_PATH
+        return helper.DB_DIR_PATH + self.account + '.db'
+
+    @property
+    def todoist_api(self):
+        """ Todoist API client. """
+        with self._lock:
+            if self._todoist_api is None:
+                import todoist  # todoist-python module
+                from todoist_gcal_sync import todoist_state
+                from todoist_gcal_sync.utils.setup import todoist_auth
+                from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+
+                api_class = todoist_state.CompactTodoistAPI if USER_PREFS['todoist.compactState'] \
+                    else todoist.TodoistAPI
+                self._todoist_api = api_class(
+                    todoist_auth.retrieve_token(todoist_auth.token_file_name(self.account)))
+        return self._todoist_api
+
+    def ensure_synced(self):
+        """ Runs the first api.sync() of the run if not done yet, the state then holds the account's data. """
+        with self._lock:
+            if self._initial_sync is None:
+                self._initial_sync = self.todoist_api.sync()
+
+    @property
+    def initial_sync(self):
+        """ Response of the first api.sync() of the run, empty once released. """
+        self.ensure_synced()
+        return self._initial_sync
+
+    def release_initial_sync(self):
+        """ Drops the response of the first api.sync() once handled, the state holds its data. """
+        with self._lock:
+            if self._initial_sync is not None:
+                self._initial_sync = {}
+
+    @property
+    def premium_user(self):
+        self.ensure_synced()
+        return self.todoist_api.state['user']['is_premium']
+
+    @property
+    def inbox_project_id(self):
+        self.ensure_synced()
+        return self.todoist_api.state['user']['inbox_project']
+
+    @property
+    def gcal_credentials(self):
+        """ Google OAuth credentials, refreshed in the background (see credential_manager.py). """
+        with self._lock:
+            if self._gcal_credentials is None:
+                from todoist_gcal_sync.utils.auth import gcal_OAuth
+                from todoist_gcal_sync.utils.auth import credential_manager
+
+                credentials = gcal_OAuth.get_credentials(gcal_OAuth.credential_file_name(self.account))
+                if credentials is not None:
+                    self._gcal_credential_manager = credential_manager.manage(credentials)
+                self._gcal_credentials = credentials
+        return self._gcal_credentials
+
+    def gcal_build(self):
+        """ Builds the Calendar service, on top of the pooled transport of gcal_transport.py. """
+        from googleapiclient import discovery
+        from todoist_gcal_sync.utils import discovery_doc
+        from todoist_gcal_sync.utils.gcal_http import InstrumentedHttpRequest
+        from todoist_gcal_sync.utils.gcal_transport import PooledHttp
+
+        credentials = self.gcal_credentials
+        if credentials is None:
+            log.error('No Google credentials for the account ' + repr(self.account)
+                      + ', the OAuth flow did not complete.')
+            raise RuntimeError('Google Calendar credentials are missing, run the OAuth flow again '
+                               '(see gcal_OAuth.get_credentials()).')
+
+        # token refreshes go through the transport wrapped by authorize() too
+        http = credentials.authorize(PooledHttp())
+
+        with AppContext._gcal_discovery_lock:
+            if AppContext._gcal_discovery_doc is None:
+                AppContext._gcal_discovery_doc = discovery_doc.load(http)
+
+        if AppContext._gcal_discovery_doc:
+            return discovery.build_from_document(AppContext._gcal_discovery_doc, http=http,
+                                                 requestBuilder=InstrumentedHttpRequest)
+
+        # 'cache_discovery=False' is used to circumvent the file_cache issue for oauth2client >= 4.0.0
+        # More info on the issue here: https://github.com/google/google-api-python-client/issues/299
+        return discovery.build('calendar', 'v3', http=http, cache_discovery=False,
+                               requestBuilder=InstrumentedHttpRequest)
+
+    @property
+    def prefetch_pool(self):
+        """ Single thread pool prefetching the pages of gcal_sync.event_pages(). """
+        with self._lock:
+            if self._prefetch_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._prefetch_pool = ThreadPoolExecutor(max_workers=1,
+                                                         thread_name_prefix='gcal-prefetch')
+        return self._prefetch_pool
+
+    @property
+    def gcal_service(self):
+        """ Calendar service, shared by the threads of the context (see gcal_transport.py). """
+        with self._lock:
+            if self._gcal_service is None:
+                self._gcal_service = self.gcal_build()
+        return self._gcal_service
+
+
+class Lazy(object):
+    """
+        Stands in for a client of the current context, e.g. 'todo.api', so that it is
+        only built when one of its attributes is first accessed.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            # introspection (copy, inspect, hasattr(obj, '__...')) must not build the client
+            raise AttributeError(attr)
+        return getattr(getattr(current(), self._name), attr)
+
+
+_context = None
+_context_lock = threading.Lock()
+
+# context of the worker threads, see activate_thread()
+_thread_context = threading.local()
+
+
+def current():
+    """ Returns the application context of the calling thread, creating it on first use. """
+    global _context
+    app_context = getattr(_thread_context, 'app_context', None)
+    if app_context is not None:
+        return app_context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = AppContext()
+    return _context
+
+
+def activate_thread(app_context):
+    """ Makes 'app_context' the current one of the calling (worker) thread; None to reset. """
+    _thread_context.app_context = app_context
+
+
+def activate(app_context):
+    """ Makes 'app_context' the current one, e.g. one wired to other API endpoints. """
+    global _context
+    with _context_lock:
+        _context = app_context
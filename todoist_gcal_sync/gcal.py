@@ -8,22 +8,17 @@ import os.path
 import sys
 import logging
 import time
-import httplib2
-from apiclient import discovery
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from googleapiclient import errors
-from todoist_gcal_sync.utils.auth.gcal_OAuth import get_credentials
 from todoist_gcal_sync.utils.setup import helper as load_cfg
 from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync import context
 
 log = logging.getLogger(__name__)
 __author__ = "Alexandros Nicolaides"
 
-gcal_creds = get_credentials()
-http = gcal_creds.authorize(httplib2.Http())
-
-# 'cache_discovery=False' is used to circumvent the file_cache issue for oauth2client >= 4.0.0
-# More info on the issue here: https://github.com/google/google-api-python-client/issues/299
-service = discovery.build('calendar', 'v3', http=http, cache_discovery=False)
+# Calendar service of the application context, built on first use
+service = context.Lazy('gcal_service')
 
 
 def insert_event(calId, event_name, start_datetime=None, end_datetime=None, location=None, desc=None,
@@ -59,25 +54,60 @@ def insert_event(calId, event_name, start_datetime=None, end_datetime=None, loca
     return event_id
 
 
-def create_calendar(project_name, project_id, todoist_tz):
-    cal_created = False
-    cal_exists = False
-    cal_project_name = 'Project: ' + project_name
-    cal_id = None
-
-    ''' Turns flag to True if calendar exists on Google's servers;
-    Source :https://developers.google.com/google-apps/calendar/v3/reference/calendarList/list '''
+def sync_calendar_list():
+    """
+        Brings the calendar list of the context up to date; the first call fetches the whole
+        calendar list, later calls only fetch the changes since the previous one, using a
+        sync token.
+        Source: https://developers.google.com/google-apps/calendar/v3/reference/calendarList/list
+    """
+    ctx = context.current()
     page_token = None
     while True:
-        calendar_list = service.calendarList().list(pageToken=page_token).execute()
-        for calendar_list_entry in calendar_list['items']:
-            if calendar_list_entry['summary'] == cal_project_name:
-                cal_exists = True
-                cal_id = calendar_list_entry['id']
-        page_token = calendar_list.get('nextPageToken')
+        try:
+            result = service.calendarList().list(pageToken=page_token,
+                                                 syncToken=ctx.calendar_list_sync_token).execute()
+        except errors.HttpError as err:
+            if err.resp.status != 410 or not ctx.calendar_list_sync_token:
+                raise
+            # sync token expired, fetch the whole calendar list again
+            log.debug('Calendar list sync token has expired.')
+            ctx.calendar_list.clear()
+            ctx.calendar_list_sync_token = None
+            page_token = None
+            continue
+
+        for calendar_list_entry in result['items']:
+            if calendar_list_entry.get('deleted'):
+                forget_calendar(calendar_list_entry['id'])
+            else:
+                ctx.calendar_list[calendar_list_entry['summary']] = calendar_list_entry['id']
+
+        page_token = result.get('nextPageToken')
         if not page_token:
+            ctx.calendar_list_sync_token = result.get('nextSyncToken')
             break
 
+
+def forget_calendar(cal_id):
+    """ Removes a calendar from the calendar list of the context. """
+    calendar_list = context.current().calendar_list
+    for summary in [summary for summary in calendar_list if calendar_list[summary] == cal_id]:
+        del calendar_list[summary]
+
+
+def create_calendar(project_name, project_id, todoist_tz):
+    cal_created = False
+    cal_project_name = 'Project: ' + project_name
+
+    # the calendar list is fetched once, then kept up to date by the calls of this module
+    if context.current().calendar_list_sync_token is None:
+        sync_calendar_list()
+
+    ''' Turns flag to True if calendar exists on Google's servers. '''
+    cal_id = context.current().calendar_list.get(cal_project_name)
+    cal_exists = cal_id is not None
+
     ''' Creates Google Calendar with Todoist project name (if calendar does not exist). '''
     if not cal_exists:
         calendar = {
@@ -87,6 +117,7 @@ def create_calendar(project_name, project_id, todoist_tz):
 
         try:
             created_calendar = service.calendars().insert(body=calendar).execute()
+            context.current().calendar_list[cal_project_name] = created_calendar['id']
 
             cal_row = [cal_project_name,
                        created_calendar['id'], project_id, None, ]
@@ -99,17 +130,12 @@ def create_calendar(project_name, project_id, todoist_tz):
             time.sleep(1)
             sys.exit("The daemon is about to abort operation.")
     else:
-        if os.path.exists('/data.db'):
+        if os.path.exists(sql_ops.db_path()):
             ''' Case where calendar id is missing from database '''
-            already_in_db = False
 
             # Check if calendar found on Google's server is missing from 'gcal_ids' table
-            # cursor = conn.execute("SELECT calendar_id from gcal_ids")
-            cursor = sql_ops.select_from_where("calendar_id", "gcal_ids")
-            for row in cursor:
-                if row[0] == cal_id:
-                    already_in_db = True
-                    break
+            already_in_db = sql_ops.select_from_where(
+                "calendar_id", "gcal_ids", "calendar_id", cal_id)
 
             if not already_in_db:
                 cal_row = [cal_project_name, cal_id, project_id, None, ]
@@ -126,35 +152,20 @@ def update_event_date(cal_id, event_id, new_date=None, event_name=None, color_id
     # 2) Updates event name
     op_code = False
     if cal_id and event_id:
-        update_needed = False
-        # First retrieve the event from the API.
-        event = None
-        try:
-            event = service.events().get(calendarId=cal_id, eventId=event_id).execute()
-        except Exception as err:
-            log.exception(
-                str(err) + "\nEvent requested could not be retrieved.")
+        # only the fields that change are sent, the event is not retrieved beforehand
+        event = {}
+        if new_date:
+            event['start'] = {'date': new_date}
+            event['end'] = {'date': new_date}
+            event['colorId'] = color_id
+        elif extended_date:
+            event['end'] = {'date': extended_date}
+            event['colorId'] = color_id
+        if event_name:
+            event['summary'] = event_name
 
         if event:
-            if new_date:
-                event['start']['date'] = new_date
-                event['end']['date'] = new_date
-                event['colorId'] = color_id
-                update_needed = True
-            elif extended_date:
-                event['end']['date'] = extended_date
-                event['colorId'] = color_id
-                update_needed = True
-            if event_name:
-                update_needed = True
-                event['summary'] = event_name
-
-            if update_needed:
-                try:
-                    service.events().update(calendarId=cal_id, eventId=event_id, body=event).execute()
-                    op_code = True
-                except Exception as err:
-                    log.exception(str(err))
+            op_code = patch_event(cal_id, event_id, event)
 
     return op_code
 
@@ -164,33 +175,75 @@ def delete_calendar(cal_id=None):
     try:
         if cal_id:
             service.calendars().delete(calendarId=cal_id).execute()
+            forget_calendar(cal_id)
     except Exception as err:
         log.exception(err)
         deletion = False
     return deletion
 
 
-def delete_cals():
-    calendars_deleted = True
+def thread_service():
+    """ Returns the Calendar service of the context, for the worker threads. """
+    return context.current().gcal_service
+
+
+def cleanup_calendar(cal_id):
+    """ Deletes a calendar from a worker thread; a calendar that is already gone counts as deleted. """
     try:
-        data = sql_ops.select_from_where(
-            "calendar_name, calendar_id", "gcal_ids", fetch_all=True)
+        thread_service().calendars().delete(calendarId=cal_id).execute()
+    except errors.HttpError as err:
+        if err.resp.status not in (404, 410):
+            raise
+
+
+def delete_cals(workers=4, progress=None):
+    """
+        Deletes the calendars created by the daemon, 'workers' calendars at a time.
+
+        The row of each calendar is removed from the 'gcal_ids' table as soon as the calendar
+        is deleted, which checkpoints the cleanup; when interrupted or when some deletions
+        fail, calling it again resumes with the calendars left. 'progress' is called with
+        the number of calendars processed.
+
+        Returns true only if all the calendars have been deleted.
+    """
+    calendars_deleted = True
+    deleted = 0
+    start_time = time.time()
+
+    data = sql_ops.select_from_where(
+        "calendar_name, calendar_id", "gcal_ids", fetch_all=True) or []
 
-        # delete all calendars created by the daemon, from Google Calendar
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
         for row in data:
-            # row[0] is the id of the calendar to be deleted
+            # row[1] is the id of the calendar to be deleted
             if row[1]:
-                if (delete_calendar(row[1])):
-                    log.info(row[0] + '\' calendar has been deleted.')
-                    sql_ops.delete_from_where(
-                        "gcal_ids", "calendar_id", row[1])
-                else:
-                    log.error('\'' + row[0] + '\' could not be deleted.')
+                pending[executor.submit(cleanup_calendar, row[1])] = row
             else:
                 calendars_deleted = False
                 log.error('Calendar id provided for deletion is not correct.')
-    except Exception as err:
-        log.exception(err)
+                if progress:
+                    progress(1)
+
+        for future in as_completed(pending):
+            row = pending[future]
+            try:
+                future.result()
+                forget_calendar(row[1])
+                sql_ops.delete_from_where("gcal_ids", "calendar_id", row[1])
+                log.info(row[0] + '\' calendar has been deleted.')
+                deleted += 1
+            except Exception as err:
+                calendars_deleted = False
+                log.error('\'' + row[0] + '\' could not be deleted. ' + str(err))
+
+            if progress:
+                progress(1)
+
+    elapsed = time.time() - start_time
+    log.info(str(deleted) + ' out of ' + str(len(data)) + ' calendars deleted in ' + '{:.1f}'.format(elapsed)
+             + 's (' + '{:.2f}'.format(deleted / elapsed if elapsed else 0) + ' calendars/s).')
 
     return calendars_deleted
 
@@ -211,25 +264,7 @@ def update_event_color(cal_id, event_id, color_id=None):
 
     if cal_id and event_id:
         # None turns the event to it's default color id
-        event = None
-        try:
-            # retrieve event from Gcal
-            event = service.events().get(calendarId=cal_id, eventId=event_id).execute()
-        except Exception as err:
-            log.exception(str(
-                err) + 'Could not retrieve event from Google API, to perform color change on it.')
-            op_code = False
-
-        if event:
-            event['colorId'] = color_id
-
-            try:
-                service.events().update(calendarId=cal_id,
-                                        eventId=event_id, body=event).execute()
-            except Exception as err:
-                log.exception('Although the color of the event was retrieved,'
-                              + ' we could not update the color of the event.')
-                op_code = False
+        op_code = patch_event(cal_id, event_id, {'colorId': color_id})
 
     return op_code
 
@@ -237,78 +272,51 @@ def update_event_color(cal_id, event_id, color_id=None):
 def update_event_summary(cal_id=None, event_id=None, event_name=None):
     op_code = True
     if cal_id and event_id and event_name:
-        # retrieve event from Gcal
-        event = None
-        try:
-            event = service.events().get(calendarId=cal_id, eventId=event_id).execute()
-        except Exception as err:
-            log.exception(
-                str(err) + 'Could not retrieve event from Google API, to perform color change.')
-            op_code = False
-
-        if event:
-            event['summary'] = event_name
-
-            try:
-                service.events().update(calendarId=cal_id, eventId=event_id, body=event).execute()
-            except Exception as err:
-                log.exception('Could not update the name of the event.')
-                op_code = False
+        op_code = patch_event(cal_id, event_id, {'summary': event_name})
 
     return op_code
 
 
 def update_event_location(cal_id, event_id, location, dest_cal_id=None):
-    op_code = True
-    event = None
+    op_code = patch_event(cal_id, event_id, {'location': location})
+
+    if dest_cal_id != cal_id:
+        move_event(cal_id, event_id, dest_cal_id)
+
+    return op_code
 
-    try:
-        # retrieve event from Google Calendar API
-        event = service.events().get(calendarId=cal_id, eventId=event_id).execute()
-        if event:
-            event['location'] = location
-    except Exception as err:
-        log.exception(err)
-        op_code = False
 
+def move_event(cal_id, event_id, dest_cal_id):
+    op_code = False
     try:
-        if event:
-            service.events().update(calendarId=cal_id, eventId=event_id, body=event).execute()
+        service.events().move(calendarId=cal_id, eventId=event_id,
+                              destination=dest_cal_id).execute()
+        op_code = True
     except Exception as err:
         log.exception(err)
-        op_code = False
 
-    if dest_cal_id != cal_id:
+    return op_code
+
+
+def patch_event(cal_id, event_id, event):
+    """
+        Updates the fields provided by 'event' with a single request, without retrieving the
+        event; the other fields of the event are left as they are.
+    """
+    op_code = False
+    if cal_id and event_id and event:
         try:
-            service.events().move(calendarId=cal_id, eventId=event_id,
-                                  destination=dest_cal_id).execute()
+            service.events().patch(calendarId=cal_id,
+                                   eventId=event_id, body=event).execute()
+            op_code = True
         except Exception as err:
-            log.exception(err)
+            log.exception(str(err) + ' Event could not be patched.')
 
     return op_code
 
 
 def update_event_desc(cal_id, event_id, desc):
-    op_code = True
-
-    event = None
-    try:
-        # retrieve event from Google Calendar API
-        event = service.events().get(calendarId=cal_id, eventId=event_id).execute()
-        if event:
-            event['description'] = desc
-    except Exception as err:
-        log.exception(err)
-        op_code = False
-
-    try:
-        if event:
-            service.events().update(calendarId=cal_id, eventId=event_id, body=event).execute()
-    except Exception as err:
-        log.exception(err)
-        op_code = False
-
-    return op_code
+    return patch_event(cal_id, event_id, {'description': desc})
 
 
 def update_event_name(cal_id, event_id, event_name):
@@ -325,49 +333,27 @@ def update_event_name(cal_id, event_id, event_name):
 def update_event_reminders(cal_id, event_id, minutes_reminder=None):
     op_code = True
     if cal_id and event_id:
-        event = None
+        reminders = None
+        if minutes_reminder:
+            reminders = {'useDefault': False,
+                         'overrides': [{'method': 'popup', 'minutes': minutes_reminder}]}
 
-        try:
-            event = service.events().get(calendarId=cal_id, eventId=event_id).execute()
-        except Exception as err:
-            log.exception(err)
-            op_code = False
-
-        if not minutes_reminder:
-            event['reminders'] = None
-        else:
-            event['reminders']['useDefault'] = False
-            event['reminders']['overrides'] = [
-                {'method': 'popup', 'minutes': minutes_reminder}]
-
-        try:
-            service.events().update(calendarId=cal_id, eventId=event_id, body=event).execute()
-        except Exception as err:
-            log.exception(str(err))
-            op_code = False
+        op_code = patch_event(cal_id, event_id, {'reminders': reminders})
 
     return op_code
 
 
 def update_cal_name(cal_id, new_cal_name):
     cal_name_updated = True
-    calendar = None
     new_cal_name = 'Project: ' + new_cal_name
 
     if cal_id and new_cal_name:
         try:
-            calendar = service.calendars().get(calendarId=cal_id).execute()
+            service.calendars().patch(calendarId=cal_id, body={'summary': new_cal_name}).execute()
+            forget_calendar(cal_id)
+            context.current().calendar_list[new_cal_name] = cal_id
         except Exception as err:
-            log.exception(err)
+            log.exception(str(err))
             cal_name_updated = False
 
-        if calendar:
-            calendar['summary'] = new_cal_name
-
-            try:
-                service.calendars().update(calendarId=cal_id, body=calendar).execute()
-            except Exception as err:
-                log.exception(str(err))
-                cal_name_updated = False
-
     return cal_name_updated
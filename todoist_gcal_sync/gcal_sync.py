@@ -1,127 +1,247 @@
 """
 Sync handlers for Google Calendar (Gcal --> Todoist).
 
-Dependencies:
+Dependencies: google-api-python-client, simplejson
 """
 
+import re
 import time
 import logging
 import random
-import requests
 from googleapiclient import errors
 import simplejson
 from todoist_gcal_sync.utils.setup import helper as load_cfg
 from todoist_gcal_sync.gcal import service
 from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils import metrics
 from todoist_gcal_sync import todo as todoist
+from todoist_gcal_sync import context
+from todoist_gcal_sync import outbox
+from todoist_gcal_sync.utils.setup.log_cfg_extras import LogSampler
 
 log = logging.getLogger(__name__)
 
+# a full sync of a calendar goes through each of its events
+sampled_debug = LogSampler(log)
 
-def split_priority(event_name):
+# the fields of the events read by cal_id(), see resolve_events()
+EVENT_FIELDS = 'items(id,summary,status,start,updated),nextPageToken,nextSyncToken'
+
+WORD = re.compile(r'\S+')
+PRIORITIES = {'p1': 1, 'p2': 2, 'p3': 3, 'p4': 4}
+
+
+class SyncTokenExpired(Exception):
+    """ The sync token of a calendar is no longer valid (410 GONE), a full sync is required. """
+
+
+def parse_summary(summary, icons):
+    """
+        Parses an event summary in a single pass over its words; returns (event name,
+        task name, priority), where the event name is what follows the last icon, and the
+        task name is the event name without a trailing priority ('p1' to 'p4').
     """
-        Splits priority and event name.
+    name_start = 0
+    last_word = None
+    for word in WORD.finditer(summary):
+        if word.group() in icons:
+            name_start = word.end()
+        last_word = word
+
+    event_name = summary[name_start:].strip()
+    if last_word is not None and last_word.start() >= name_start \
+            and last_word.group() in PRIORITIES:
+        return (event_name, summary[name_start:last_word.start()].strip(),
+                PRIORITIES[last_word.group()])
+    return (event_name, event_name, None)
+
+
+def resolve_events(events):
     """
-    priorities = ['p1', 'p2', 'p3', 'p4']
-    sentence = ''
-    parsed_priority = None
-    if any(priority == event_name.split()[-1] for priority in priorities):
-        # splits 'p#' to letter p and converts '#' to an int
-        parsed_priority = int(event_name.split()[-1][1])
-        word_list = event_name.split()
-        del word_list[-1]
-        for word in word_list:
-            sentence += word + ' '
-    else:
-        sentence = event_name
-    return (sentence, parsed_priority)
+        Batch stage of the events of a page: resolves their tasks with one query and parses
+        the summaries of the events of a task; returns [(event, task id, item, summary)],
+        summary being parse_summary()'s result, or None for the events without a task.
+    """
+    task_ids = todoist.task_ids_by_event([event['id'] for event in events])
+    items = todoist.local_items(task_ids.values())
+    icons = frozenset(load_cfg.ICONS['icons.eventSet'])
+
+    resolved = []
+    for event in events:
+        task_id = task_ids.get(event['id'])
+        item = items.get(task_id) if task_id is not None else None
+        summary = parse_summary(event.get('summary', ''), icons) if item is not None else None
+        resolved.append((event, task_id, item, summary))
+    return resolved
 
 
-def parse_out_icons(event_name):
+def fetch_events(calendar_id, sync_token, page_token=None, fields=None):
     """
-        Finds last icon in the series of icons, to strip off the task name from the event.
+        Requests a page of the events of a calendar changed since the sync token (all of them
+        if None), applying exponential backoff; returns None if the page could not be
+        retrieved, and raises SyncTokenExpired if the sync token is no longer valid.
+        'fields' replaces the projection of EVENT_FIELDS.
     """
-    last_icon = None
-    event_name_substr = event_name
-    for char in event_name_substr.split():
-        if any(icon == char for icon in load_cfg.ICONS['icons.eventSet']):
-            last_icon = char
-    event_name = event_name.split(last_icon, 1)[1].strip()
-    return event_name
+    for n in range(0, 5):
+        try:
+            return service.events().list(calendarId=calendar_id, pageToken=page_token,
+                                         syncToken=sync_token, showDeleted=True,
+                                         maxResults=load_cfg.USER_PREFS['gcal.pageSize'],
+                                         fields=fields or EVENT_FIELDS).execute()
+        except errors.HttpError as err:
+            err = simplejson.loads(err.content)
+            if err['error']['code'] == 410 and sync_token is not None:
+                raise SyncTokenExpired(calendar_id)
+            elif any(error_code == err['error']['code'] for error_code in [403, 404, 500, 503]):
+                log.debug(
+                    'Exponential backoff is being applied due to...\n' + str(err))
+                # exponential backoff
+                metrics.inc('retries_total', api='gcal')
+                time.sleep((2 ** n) + random.randint(0, 1000) / 1000)
+            else:
+                log.error(err)
+    return None
+
+
+def fetch_events_in(app_context, *args):
+    """ fetch_events() in a thread of the prefetch pool, on behalf of app_context. """
+    context.activate_thread(app_context)
+    try:
+        return fetch_events(*args)
+    finally:
+        context.activate_thread(None)
+
+
+def event_pages(calendar_id, sync_token, fields=None):
+    """
+        Yields the pages of the events of a calendar changed since the sync token; the next
+        page is requested while the caller processes the current one. Stops early at a page
+        that could not be retrieved.
+    """
+    app_context = context.current()
+    page = fetch_events(calendar_id, sync_token, fields=fields)
+    while page is not None:
+        next_page = None
+        if page.get('nextPageToken'):
+            next_page = app_context.prefetch_pool.submit(
+                fetch_events_in, app_context, calendar_id, sync_token, page['nextPageToken'], fields)
+        yield page
+        page = next_page.result() if next_page is not None else None
+
+
+def handle_event(calendar_id, event, task_id, item, summary):
+    """
+        Reflects a changed event on its task; task_id, item and summary as resolved by
+        resolve_events().
+    """
+    sampled_debug('Changed event: %s', event.get('summary'))
+
+    # the changes of the task still to push overwrite the event, its row may lag behind it
+    if task_id is not None and task_id in context.current().outbox_tasks:
+        log.debug('Event ' + str(event['id']) + ' left alone, task id: ' + str(task_id)
+                  + ' has changes in the outbox.')
+        return
+
+    # we need to know the event_id of event that has just been moved to a diff project/calendar
+    # because the .move() func of Gcal simply performs a delete and insert operation for its .move()
+    # in order to prevent the task from being treated as deleted
+    if item is not None and (summary[0] != item['content']):
+        sentence, parsed_priority = summary[1], summary[2]
+        with context.current().todoist_lock:
+            item.update(content=sentence)
+
+            actual_priority = [4, 3, 2, 1]
+            # this must be executed before elif event['updated']
+            if parsed_priority:
+                item.update(
+                    priority=actual_priority[parsed_priority-1])
+
+            todoist.commit()
+
+    if event['status'] == 'cancelled' and event['id'] in context.current().moved_events:
+        # the event was moved to another calendar by the daemon itself
+        context.current().moved_events.discard(event['id'])
+    elif event['status'] == 'cancelled':
+        # delete task from Todoist
+        if task_id is not None and todoist.delete_task(task_id):
+            log.info('Task: ' + str(task_id) +
+                     ' has been deleted from Gcal and from todoist.')
+    elif event['updated']:
+        try:
+            new_event_date = event['start']['date']
+            if task_id is not None:
+                todoist.update_task_due_date(
+                    calendar_id, event['id'], task_id, new_event_date)
+        except Exception as err:
+            log.error(err)
 
 
 def cal_id(calendar_id, sync_token):
     """
-        Syncs each calendar using the "gcal_ids" table of the database.
+        Syncs each calendar using the "gcal_ids" table of the database; returns the next sync
+        token, or the one provided if some page of changes could not be retrieved.
+    """
+    next_sync_token = sync_token
+    for events in event_pages(calendar_id, sync_token):
+        for event, task_id, item, summary in resolve_events(events.get('items', [])):
+            handle_event(calendar_id, event, task_id, item, summary)
+
+        if 'nextSyncToken' in events:
+            next_sync_token = events['nextSyncToken']
+    return next_sync_token
+
+
+def full_resync(calendar_id):
+    """
+        Syncs a calendar whose sync token has expired: lists all of its events and diffs them
+        with the events of its tasks in the "todoist" table, replaying the handlers of the
+        events that are gone or differ from their task only; returns the new sync token, or
+        None if the listing could not be completed (no task is deleted then).
+
+        An event is only taken for gone if its row is the same before and after the listing,
+        and its task has no change left in the outbox (the rows written meanwhile, e.g. by the
+        outbox workers inserting or moving events, are not reflected by the listing); the
+        events of those tasks are not replayed either.
     """
+    # taken before the listing, the rows created while it runs are not in it
+    synced = todoist.synced_events(calendar_id)
+    events = {}
     next_sync_token = None
-    page_token = None
-    while True:
-        http_error = True
-        events = None
-
-        for n in range(0, 5):
-            try:
-                events = service.events().list(calendarId=calendar_id, pageToken=page_token,
-                                               syncToken=sync_token, showDeleted=True).execute()
-                http_error = False
-                break
-            except errors.HttpError as err:
-                err = simplejson.loads(err.content)
-                if any(error_code == err['error']['code'] for error_code in [403, 404, 500, 503]):
-                    log.debug(
-                        'Exponential backoff is being applied due to...\n' + str(err))
-                    # exponential backoff
-                    time.sleep((2 ** n) + random.randint(0, 1000) / 1000)
-                else:
-                    log.error(err)
-
-        if events is not None and not http_error:
-            for event in events['items']:
-                print(event['summary'])
-                log.debug(event['summary'])
-
-                task_id = todoist.get_task_id(event['id'])
-
-                item = todoist.get_task(task_id)
-
-                # we need to know the event_id of event that has just been moved to a diff project/calendar
-                # because the .move() func of Gcal simply performs a delete and insert operation for its .move()
-                # in order to prevent the task from being treated as deleted
-                event_name = parse_out_icons(event['summary'])
-                if item is not None and (event_name != item['content']):
-                    priority_split = split_priority(event_name)
-                    sentence = priority_split[0]
-                    item.update(content=sentence)
-
-                    actual_priority = [4, 3, 2, 1]
-                    parsed_priority = priority_split[1]
-                    # this must be executed before elif event['updated']
-                    if parsed_priority:
-                        item.update(
-                            priority=actual_priority[parsed_priority-1])
-
-                    todoist.api.commit()
-
-                if event['status'] == 'cancelled' and event['id'] != todoist.changed_location_of_event:
-                    # delete task from Todoist
-                    if task_id is not None and todoist.delete_task(task_id):
-                        log.info('Task: ' + str(task_id) +
-                                 ' has been deleted from Gcal and from todoist.')
-                elif event['updated']:
-                    try:
-                        new_event_date = event['start']['date']
-                        if task_id is not None:
-                            todoist.update_task_due_date(
-                                cal_id, event['id'], task_id, new_event_date)
-                    except Exception as err:
-                        log.error(err)
-
-            if 'nextSyncToken' in events:
-                next_sync_token = events['nextSyncToken']
-            page_token = events.get('nextPageToken')
-            if not page_token:
-                break
+    for page in event_pages(calendar_id, None):
+        for event in page.get('items', []):
+            if event['status'] != 'cancelled':
+                events[event['id']] = event
+        next_sync_token = page.get('nextSyncToken', next_sync_token)
+
+    if next_sync_token is None:
+        return None
+
+    synced_after = todoist.synced_events(calendar_id)
+    busy = outbox.settle()
+    gone = set(event_id for event_id in synced.keys() - events.keys()
+               if synced_after.get(event_id) == synced[event_id] and synced[event_id][0] not in busy)
+    kept = synced.keys() & events.keys()
+    items = todoist.local_items(synced[event_id][0] for event_id in kept)
+    icons = frozenset(load_cfg.ICONS['icons.eventSet'])
+
+    for event_id in gone:
+        handle_event(calendar_id, {'id': event_id, 'status': 'cancelled'}, synced[event_id][0], None, None)
+
+    changed = 0
+    for event_id in kept:
+        event = events[event_id]
+        task_id, event_date = synced[event_id]
+        if task_id in busy:
+            continue
+        item = items.get(task_id)
+        summary = parse_summary(event.get('summary', ''), icons) if item is not None else None
+        if (item is not None and summary[0] != item['content']) \
+                or event['start'].get('date') != event_date:
+            handle_event(calendar_id, event, task_id, item, summary)
+            changed += 1
+
+    log.info('Calendar ' + str(calendar_id) + ' resynced in full: ' + str(len(gone)) +
+             ' events gone, ' + str(changed) + ' changed out of ' + str(len(kept)) + '.')
     return next_sync_token
 
 
@@ -129,15 +249,35 @@ def sync_gcal():
     """
         Updates Todoist to reflect Google Calendar changes.
     """
+    # the workers insert and move events, and write their rows, while the main loop polls
+    context.current().outbox_tasks = outbox.settle()
+
     cal_ids = sql_ops.select_from_where(
         "calendar_id, calendar_sync_token", "gcal_ids", None, None, fetch_all=True)
 
+    # the Todoist commands of the pass are committed together once every calendar is synced
+    with todoist.batched_commands():
+        sync_calendars(cal_ids)
+
+    # the counters of the tasks rescheduled from Gcal, in one transaction
+    todoist.flush_task_stats()
+
+
+def sync_calendars(cal_ids):
+    """ Syncs the calendars of the "gcal_ids" rows provided (calendar_id, calendar_sync_token). """
+    import requests
+
     for i in range(0, len(cal_ids)):
         next_sync_token = None
         calendar_id = cal_ids[i][0]
         prev_sync_token = cal_ids[i][1]
         try:
             next_sync_token = cal_id(calendar_id, prev_sync_token)
+        except SyncTokenExpired:
+            log.warning('The sync token of calendar ' + str(calendar_id) +
+                        ' has expired, resyncing it in full.')
+            metrics.inc('gcal_full_resyncs_total')
+            next_sync_token = full_resync(calendar_id) or prev_sync_token
         except requests.exceptions.HTTPError as err:
             log.debug(err)
 
@@ -0,0 +1,182 @@
+"""
+Persistent queue of the Gcal writes of the Todoist changes (the "outbox" table).
+
+sync_todoist() records the changed tasks here, in one transaction, before storing the
+sync token, and a pool of workers pushes them to Gcal while the daemon keeps polling.
+The changes of a task are folded together and planned against the database when a
+worker picks them up, so that a task gets at most one Gcal write per drain however many
+times it changed. Changes still pending when the daemon stops are pushed on the next run.
+"""
+
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync import planner
+from todoist_gcal_sync import context
+
+log = logging.getLogger(__name__)
+
+# seconds before retrying the changes of a task, doubled at each failed attempt
+RETRY_DELAY_SEC = 5
+MAX_RETRY_DELAY_SEC = 600
+
+
+def enqueue(operations):
+    """
+        Records the task operations of planner.plan() (project operations are applied
+        inline); returns true once they are safely stored.
+    """
+    rows = []
+    for operation in operations:
+        if operation['op'] == planner.PROJECT:
+            continue
+        item = operation.get('item')
+        rows.append([None, operation['task_id'],
+                     json.dumps(dict(item)) if item is not None else None,
+                     int(planner.DESC in operation['fields']), 0, 0.0])
+
+    if not sql_ops.insert_rows("outbox", rows):
+        return False
+    metrics.inc('outbox_enqueued_total', len(rows))
+    return True
+
+
+def pending_count():
+    """ Returns the number of changes waiting in the outbox. """
+    data = sql_ops.select_from_where("COUNT(*)", "outbox")
+    return data[0] if data else 0
+
+
+def pending_tasks(limit=None):
+    """
+        Returns the changes ready to be pushed, folded per task:
+        {task_id: {'op_ids': [...], 'item': last item or None, 'note': bool, 'attempts': int}}
+    """
+    rows = sql_ops.select_from_where("op_id, task_id, item, note, attempts", "outbox",
+                                     "not_before <= ? ORDER BY op_id", None, True, time.time())
+    tasks = {}
+    for op_id, task_id, item, note, attempts in rows or []:
+        if task_id not in tasks:
+            if limit is not None and len(tasks) >= limit:
+                continue
+            tasks[task_id] = {'op_ids': [], 'item': None, 'note': False, 'attempts': 0}
+        task = tasks[task_id]
+        task['op_ids'].append(op_id)
+        if item is not None:
+            task['item'] = json.loads(item)
+        task['note'] = task['note'] or bool(note)
+        task['attempts'] = max(task['attempts'], attempts or 0)
+    return tasks
+
+
+def push_task(task_id, task):
+    """ Plans the folded changes of a task against the database and applies them to Gcal. """
+    from todoist_gcal_sync import todo
+
+    delta = {'items': [task['item']] if task['item'] is not None else [],
+             'notes': [{'item_id': task_id}] if task['note'] else [],
+             'projects': []}
+
+    op_code = True
+    for operation in planner.plan(todo.plan_state(delta), delta):
+        if not todo.apply_operation(operation):
+            op_code = False
+    return op_code
+
+
+def run_task(app_context, task_id, task):
+    """ Worker: pushes the changes of a task, then removes or reschedules them. """
+    context.activate_thread(app_context)
+    try:
+        try:
+            op_code = push_task(task_id, task)
+        except Exception as err:
+            op_code = False
+            log.exception(str(err) + ' Could not push the changes of task id: ' + str(task_id))
+
+        if op_code:
+            for op_id in task['op_ids']:
+                sql_ops.delete_from_where("outbox", "op_id", op_id)
+            metrics.inc('outbox_pushed_total')
+        elif task['attempts'] + 1 >= USER_PREFS['outbox.maxAttempts']:
+            log.error('Giving up on the changes of task id: ' + str(task_id) + ' after ' +
+                      str(task['attempts'] + 1) + ' attempts.')
+            for op_id in task['op_ids']:
+                sql_ops.delete_from_where("outbox", "op_id", op_id)
+            metrics.inc('outbox_dropped_total')
+        else:
+            not_before = time.time() + min(RETRY_DELAY_SEC * 2 ** task['attempts'],
+                                           MAX_RETRY_DELAY_SEC)
+            for op_id in task['op_ids']:
+                sql_ops.update_set_where("outbox", "attempts = ?, not_before = ?", "op_id = ?",
+                                         task['attempts'] + 1, not_before, op_id)
+            metrics.inc('outbox_retries_total')
+    finally:
+        with app_context.outbox_cond:
+            app_context.outbox_running.discard(task_id)
+            app_context.outbox_cond.notify_all()
+        context.activate_thread(None)
+
+
+def settle():
+    """
+        Waits for the changes the workers are pushing, without handing them any other one, so
+        that their rows and events are consistent for the Gcal pass or overdue(); returns the
+        ids of the tasks whose changes are still in the outbox (e.g. waiting for a retry).
+    """
+    app_context = context.current()
+    with app_context.outbox_cond:
+        while app_context.outbox_running:
+            app_context.outbox_cond.wait()
+    rows = sql_ops.select_from_where("DISTINCT task_id", "outbox", None, None, True)
+    return set(row[0] for row in rows or [])
+
+
+def drain():
+    """
+        Hands the pending changes over to the worker pool, without waiting for them; at most
+        two tasks per worker are in flight, the others stay in the outbox.
+    """
+    app_context = context.current()
+    workers = USER_PREFS['outbox.workers']
+
+    with app_context.outbox_cond:
+        if app_context.outbox_pool is None:
+            app_context.outbox_pool = ThreadPoolExecutor(max_workers=workers,
+                                                         thread_name_prefix='outbox')
+        free = 2 * workers - len(app_context.outbox_running)
+        if free <= 0:
+            return 0
+        running = set(app_context.outbox_running)
+
+    submitted = 0
+    for task_id, task in pending_tasks(free + len(running)).items():
+        if task_id in running or submitted >= free:
+            continue
+        with app_context.outbox_cond:
+            app_context.outbox_running.add(task_id)
+        app_context.outbox_pool.submit(run_task, app_context, task_id, task)
+        submitted += 1
+    return submitted
+
+
+def wait(timeout=None):
+    """
+        Drains the outbox until no change is left to push right away; returns true if the
+        outbox is empty (false on timeout, or with changes waiting for a retry).
+    """
+    app_context = context.current()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    while True:
+        drain()
+        with app_context.outbox_cond:
+            if not app_context.outbox_running and not pending_tasks(1):
+                return pending_count() == 0
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            app_context.outbox_cond.wait(0.1)
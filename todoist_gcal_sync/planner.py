@@ -0,0 +1,151 @@
+"""
+Plans the Gcal operations of a Todoist sync cycle (Todoist --> Gcal).
+
+Folds the item, note and project changes of one api.sync() response into
+at most one operation per event. Planning is a pure function of the
+database state and the sync delta; no network or database access happens
+here, which keeps it unit-testable.
+"""
+
+# operations, in the order they are emitted by plan()
+PROJECT = 'project'
+DELETE = 'delete'
+UNDO = 'undo'
+INSERT = 'insert'
+UPDATE = 'update'
+
+# fields of an UPDATE operation
+SUMMARY = 'summary'
+DATE = 'date'
+CHECKED = 'checked'
+LOCATION = 'location'
+DESC = 'desc'
+RECURRING = 'recurring'
+
+
+def is_recurring(item):
+    """ Returns true if the Todoist item is a recurring task. """
+    return bool(item.get('date_string')) and 'every' in item['date_string'].lower()
+
+
+def removed_projects(projects, calendars):
+    """
+        Returns the ids of the projects whose tasks are taken care of by the project
+        operation itself (deleted, archived or turned into a sub project).
+    """
+    removed = set()
+    for project in projects:
+        if project['id'] in calendars and (project['is_deleted'] or project['is_archived']
+                                           or project['indent'] != 1):
+            removed.add(project['id'])
+    return removed
+
+
+def item_operation(item, row, db_state):
+    """ Returns the operation of a changed item, or None if nothing has to be done. """
+    task_id = item['id']
+
+    if row is None:
+        if item['checked'] or item['is_deleted']:
+            return None
+        if task_id in db_state['completed']:
+            # undo operation detected
+            return {'op': UNDO, 'task_id': task_id, 'item': item, 'fields': set()}
+        if item['due_date_utc']:
+            return {'op': INSERT, 'task_id': task_id, 'item': item, 'fields': set()}
+        return None
+
+    operation = {'op': UPDATE, 'task_id': task_id, 'item': item, 'row': row,
+                 'fields': {SUMMARY}}
+
+    if not item['due_date_utc'] or item['is_deleted'] \
+            or item['project_id'] == db_state['inbox_project_id']:
+        # task lost its due date, got deleted or moved back to Inbox --> remove from Gcal
+        operation['op'] = DELETE
+        operation['fields'] = set()
+        return operation
+
+    if db_state['premium'] and is_recurring(item):
+        # the executor finds out whether the recurring task was completed or postponed
+        operation['fields'].add(RECURRING)
+
+    if item['due_date_utc'] != row['due_date']:
+        operation['fields'].add(DATE)
+
+    if item['checked']:
+        operation['fields'].add(CHECKED)
+
+    if item['project_id'] != row['project_id'] \
+            or db_state['parents'].get(item['project_id']) != row['parent_project_id']:
+        operation['fields'].add(LOCATION)
+
+    return operation
+
+
+def plan(db_state, delta):
+    """
+        Returns the list of operations needed to bring Gcal in line with a Todoist delta.
+
+        'db_state' is a dict with the keys:
+            tasks: {task_id: row} of the 'todoist' table, for the tasks found in the delta,
+                where row is a dict of 'project_id', 'parent_project_id', 'due_date', 'event_id'
+            completed: set of the task ids found in the 'todoist_completed' table
+            calendars: set of the project ids that own a calendar in the 'gcal_ids' table
+            parents: {project_id: parent_project_id} for the projects of the changed items
+            inbox_project_id: id of the Todoist Inbox
+            premium: true for Todoist premium users
+
+        'delta' holds the 'items', 'notes' and 'projects' of an api.sync() response.
+
+        Each task ends up with at most one operation, carrying every field that changed
+        during the cycle. Project operations come first, since they create, rename or
+        delete the calendars the events live in.
+    """
+    operations = []
+
+    projects = delta.get('projects') or []
+    for project in projects:
+        operations.append({'op': PROJECT, 'project': project})
+
+    removed = removed_projects(projects, db_state['calendars'])
+
+    def in_removed_project(row):
+        return row is not None and (row['project_id'] in removed
+                                    or row['parent_project_id'] in removed)
+
+    # last change of each item wins
+    items = {}
+    for item in delta.get('items') or []:
+        items.pop(item['id'], None)
+        items[item['id']] = item
+
+    by_task = {}
+    for task_id, item in items.items():
+        row = db_state['tasks'].get(task_id)
+        if in_removed_project(row):
+            continue
+
+        operation = item_operation(item, row, db_state)
+        if operation:
+            by_task[task_id] = operation
+
+    # Task note added --> Gcal description and location
+    for note in delta.get('notes') or []:
+        task_id = note['item_id']
+        row = db_state['tasks'].get(task_id)
+        if row is None or in_removed_project(row):
+            continue
+
+        operation = by_task.get(task_id)
+        if operation is None:
+            operation = {'op': UPDATE, 'task_id': task_id, 'item': None, 'row': row,
+                         'fields': set()}
+            by_task[task_id] = operation
+        if operation['op'] in (UPDATE, UNDO):
+            operation['fields'].update((DESC, LOCATION))
+
+    for op in (DELETE, UNDO, INSERT, UPDATE):
+        operations.extend(operation for operation in by_task.values()
+                          if operation['op'] == op)
+
+    return operations
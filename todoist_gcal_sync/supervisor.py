@@ -0,0 +1,369 @@
+"""
+Supervisor mode: the accounts of the multi-account mode (see accounts.py) spread over
+"daemon.workerProcesses" worker processes, so that every core of the host is used.
+
+Accounts are assigned to the workers by consistent hashing, so that a worker joining or
+leaving the ring only moves the accounts it gains or loses. When a worker dies, its
+accounts move to the others and it is restarted; once it is back, its accounts move
+back to it. An account is handed over in two steps: the former worker releases it
+(its running cycle and its Gcal writes complete) before the new one starts syncing it,
+so that no two processes ever sync an account at the same time.
+
+The workers report their health and the increments of their metrics over a pipe every
+"daemon.workerReportSec" seconds; a worker without report for "daemon.workerTimeoutSec"
+seconds is killed and restarted. Their log records are written by the supervisor.
+"""
+
+import os
+import time
+import signal
+import bisect
+import hashlib
+import logging
+import logging.handlers
+import threading
+import multiprocessing
+import multiprocessing.connection
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS
+from todoist_gcal_sync.utils import metrics
+
+log = logging.getLogger(__name__)
+
+# the workers start from a fresh interpreter: forked, they could inherit a lock held by one of
+# the threads of the supervisor (log forwarding, queue listener, metrics endpoint)
+MP_CONTEXT = multiprocessing.get_context('spawn')
+
+# seconds before restarting a worker, doubled each time it dies shortly after a start
+RESTART_DELAY_SEC = 1
+MAX_RESTART_DELAY_SEC = 60
+
+
+class HashRing(object):
+    """
+        Consistent hash ring; each node is placed 'replicas' times on the ring, and a key
+        belongs to the first node found clockwise from the hash of the key.
+    """
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(node + '#' + str(replica))
+            if point not in self._nodes:
+                bisect.insort(self._hashes, point)
+            self._nodes[point] = node
+
+    def remove(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(node + '#' + str(replica))
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._hashes.remove(point)
+
+    def __contains__(self, node):
+        return node in self._nodes.values()
+
+    def __len__(self):
+        return len(set(self._nodes.values()))
+
+    def node_for(self, key):
+        """ Returns the node of the key, or None if the ring is empty. """
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+
+########### Worker process ###########
+
+
+def redirect_logging(log_queue):
+    """
+        Sends the log records of the worker to the supervisor, which writes them, at the levels
+        of the logging configuration (see logger.py); the handlers a worker may have configured
+        on import (e.g. the daemon started as a script, whose module the worker imports) are
+        replaced.
+    """
+    handler = logging.handlers.QueueHandler(log_queue)
+    package_logger = logging.getLogger('todoist_gcal_sync')
+    for logger in (logging.getLogger(), package_logger):
+        for configured in list(logger.handlers):
+            logger.removeHandler(configured)
+        logger.addHandler(handler)
+    logging.getLogger().setLevel(logging.WARNING)
+    package_logger.setLevel(USER_PREFS['logging.level'])
+    package_logger.propagate = False
+
+
+def worker_main(worker_id, conn, log_queue):
+    """
+        Worker process: syncs the accounts the supervisor adds, until it is stopped or
+        the supervisor is gone.
+    """
+    from todoist_gcal_sync import accounts
+    from todoist_gcal_sync import context
+
+    redirect_logging(log_queue)
+
+    scheduler = accounts.Scheduler([])
+    send_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def release(names):
+        for name in names:
+            scheduler.remove(name)
+        send(('released', worker_id, names))
+
+    def report():
+        send(('report', worker_id, {
+            'pid': os.getpid(),
+            'accounts': {account.name: {'cycles': account.cycles, 'failures': account.failures,
+                                        'disabled': account.disabled}
+                         for account in list(scheduler.accounts)}},
+            metrics.snapshot(reset=True)))
+
+    next_report = [0.0]
+
+    def tick():
+        try:
+            while conn.poll():
+                command, names = conn.recv()
+                if command == 'add':
+                    for name in names:
+                        scheduler.add(accounts.Account(context.AppContext(name)))
+                elif command == 'release':
+                    threading.Thread(target=release, args=(names,), daemon=True).start()
+                elif command == 'stop':
+                    stopped.set()
+            if time.monotonic() >= next_report[0]:
+                report()
+                next_report[0] = time.monotonic() + USER_PREFS['daemon.workerReportSec']
+        except (EOFError, OSError):
+            # the supervisor is gone
+            stopped.set()
+
+    send(('ready', worker_id, os.getpid()))
+    try:
+        scheduler.run(stop=stopped.is_set, tick=tick)
+    finally:
+        scheduler.shutdown(wait=False)
+
+
+########### Supervisor ###########
+
+
+def kill(process):
+    """ Kills a worker process (Process.kill() needs Python 3.7). """
+    try:
+        os.kill(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class Worker(object):
+    """ A worker process, as seen by the supervisor. """
+
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.ready = False
+        self.started = 0.0
+        self.last_report = 0.0
+        self.restart_delay = RESTART_DELAY_SEC
+        self.restart_at = None
+        self.health = {}
+
+
+class Supervisor(object):
+    """
+        Spawns the workers, assigns them the accounts and restarts the ones that die.
+
+        supervisor = Supervisor(USER_PREFS['daemon.accounts'], 4)
+        supervisor.run()
+    """
+
+    def __init__(self, account_names, processes, target=worker_main):
+        self.target = target
+        self.workers = {'worker-' + str(n): Worker('worker-' + str(n)) for n in range(processes)}
+        self.ring = HashRing()
+        # account --> id of the worker syncing it, None while it is unassigned
+        self.owner = dict.fromkeys(account_names)
+        self.releasing = set()
+        self.log_queue = MP_CONTEXT.Queue()
+        self._log_thread = None
+
+    def start(self):
+        self._log_thread = threading.Thread(target=self.forward_logs, name='worker-logs',
+                                            daemon=True)
+        self._log_thread.start()
+        for worker in self.workers.values():
+            self.spawn(worker)
+
+    def run(self, stop=None, tick=None):
+        """ Supervises the workers until stop() returns true (forever if None). """
+        self.start()
+        try:
+            while stop is None or not stop():
+                if tick is not None:
+                    tick()
+                self.poll(1.0)
+        finally:
+            self.stop()
+
+    def spawn(self, worker):
+        worker.conn, child_conn = MP_CONTEXT.Pipe()
+        worker.process = MP_CONTEXT.Process(target=self.target, name=worker.id,
+                                            args=(worker.id, child_conn, self.log_queue),
+                                            daemon=True)
+        worker.process.start()
+        child_conn.close()
+        worker.ready = False
+        worker.started = worker.last_report = time.monotonic()
+        worker.restart_at = None
+        log.info('Worker ' + worker.id + ' started, pid: ' + str(worker.process.pid))
+
+    def poll(self, timeout):
+        """ Handles the messages and the deaths of the workers, for up to 'timeout' seconds. """
+        alive = [worker for worker in self.workers.values() if worker.process is not None]
+        waitables = [worker.conn for worker in alive] + [worker.process.sentinel for worker in alive]
+        ready = multiprocessing.connection.wait(waitables, self.next_timeout(timeout))
+
+        for worker in alive:
+            if worker.conn in ready:
+                try:
+                    while worker.conn.poll():
+                        self.handle(worker, worker.conn.recv())
+                except (EOFError, OSError):
+                    pass
+
+        now = time.monotonic()
+        for worker in alive:
+            if not worker.process.is_alive():
+                self.lost(worker, 'exited with code ' + str(worker.process.exitcode))
+            elif now - worker.last_report > USER_PREFS['daemon.workerTimeoutSec']:
+                kill(worker.process)
+                worker.process.join()
+                self.lost(worker, 'stopped reporting')
+
+        for worker in self.workers.values():
+            if worker.process is None and worker.restart_at is not None and now >= worker.restart_at:
+                self.spawn(worker)
+
+    def next_timeout(self, timeout):
+        restarts = [worker.restart_at for worker in self.workers.values()
+                    if worker.process is None and worker.restart_at is not None]
+        if restarts:
+            timeout = min(timeout, max(min(restarts) - time.monotonic(), 0))
+        return timeout
+
+    def handle(self, worker, message):
+        kind = message[0]
+        worker.last_report = time.monotonic()
+        if kind == 'ready':
+            worker.ready = True
+            worker.pid = message[2]
+            self.ring.add(worker.id)
+            self.rebalance()
+        elif kind == 'released':
+            for name in message[2]:
+                if self.owner.get(name) == worker.id:
+                    self.owner[name] = None
+                self.releasing.discard(name)
+            self.rebalance()
+        elif kind == 'report':
+            worker.health = message[2]
+            metrics.merge(message[3])
+
+    def lost(self, worker, reason):
+        """ A worker died: its accounts move to the others until it is restarted. """
+        log.error('Worker ' + worker.id + ' ' + reason + '; restarting it in '
+                  + str(worker.restart_delay) + 's.')
+        metrics.inc('worker_restarts_total', worker=worker.id)
+
+        worker.conn.close()
+        worker.process = None
+        worker.ready = False
+        if time.monotonic() - worker.started < MAX_RESTART_DELAY_SEC:
+            worker.restart_at = time.monotonic() + worker.restart_delay
+            worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY_SEC)
+        else:
+            worker.restart_at = time.monotonic() + RESTART_DELAY_SEC
+            worker.restart_delay = RESTART_DELAY_SEC
+
+        self.ring.remove(worker.id)
+        for name, owner in self.owner.items():
+            if owner == worker.id:
+                self.owner[name] = None
+                self.releasing.discard(name)
+        self.rebalance()
+
+    def rebalance(self):
+        """ Moves the accounts whose worker on the ring changed, in two steps (release, add). """
+        additions = {}
+        releases = {}
+        for name, owner in self.owner.items():
+            target = self.ring.node_for(name)
+            if target is None or owner == target:
+                continue
+            if owner is None:
+                additions.setdefault(target, []).append(name)
+                self.owner[name] = target
+            elif name not in self.releasing:
+                releases.setdefault(owner, []).append(name)
+                self.releasing.add(name)
+
+        for worker_id, names in releases.items():
+            self.send(self.workers[worker_id], ('release', names))
+        for worker_id, names in additions.items():
+            log.info('Worker ' + worker_id + ' syncs ' + str(len(names)) + ' more accounts.')
+            self.send(self.workers[worker_id], ('add', names))
+
+    def send(self, worker, message):
+        try:
+            worker.conn.send(message)
+        except (OSError, ValueError) as err:
+            # the worker died, poll() takes care of it
+            log.warning('Could not reach worker ' + worker.id + ': ' + str(err))
+
+    def assignment(self):
+        """ Returns {worker id: [accounts]} of the accounts being synced. """
+        result = {}
+        for name, owner in sorted(self.owner.items()):
+            if owner is not None and name not in self.releasing:
+                result.setdefault(owner, []).append(name)
+        return result
+
+    def forward_logs(self):
+        """ Writes the log records of the workers (thread of the supervisor). """
+        while True:
+            record = self.log_queue.get()
+            if record is None:
+                break
+            logging.getLogger(record.name).handle(record)
+
+    def stop(self, timeout=30):
+        for worker in self.workers.values():
+            if worker.process is not None:
+                self.send(worker, ('stop', []))
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    kill(worker.process)
+                worker.process = None
+        self.log_queue.put(None)
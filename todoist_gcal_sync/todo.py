@@ -4,32 +4,39 @@ Performs common opertations on Todoist (Todoist <-- Gcal).
 Dependencies: jsonschema, todoist-python, pytz, python-dateutil
 """
 
-import todoist  # todoist-python module
 import os
 import sys
+import hashlib
 from todoist_gcal_sync import gcal
 import sqlite3
 from datetime import datetime, timedelta
 import pytz
 from urllib.parse import urlparse
 import json
-from jsonschema import exceptions
-from jsonschema import validate
 import time
 import dateutil.parser
-from todoist_gcal_sync.utils.setup import todoist_auth
 import logging
-from todoist_gcal_sync.utils.setup.helper import USER_PREFS, TODOIST_SCHEMA, ICONS, DB_PATH
+from contextlib import contextmanager
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS, TODOIST_SCHEMA, ICONS
 from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync import planner
+from todoist_gcal_sync import outbox
+from todoist_gcal_sync import context
 
 log = logging.getLogger(__name__)
 
-api = todoist.TodoistAPI(todoist_auth.todoist_api_token)
-changed_location_of_event = None
+# Todoist API client of the application context, built on first use
+api = context.Lazy('todoist_api')
 
-initial_sync = api.sync()  # needed to initialize 3 vars below
-premium_user = api.user.state['user']['is_premium']
-inbox_project_id = api.user.state['user']['inbox_project']
+# https://developer.todoist.com/sync/v7/#limits
+COMMANDS_PER_REQUEST = 100
+# attempts at a command that Todoist rejected, one per batch
+COMMAND_MAX_ATTEMPTS = 3
+
+# every column of the "todoist" and "todoist_completed" tables, in order
+TASK_COLUMNS = '''project_id, parent_project_id, task_id, due_date, event_id, overdue,
+    times_overdue, times_resheduled_on_due_date, event_hash'''
 
 
 def data_init():
@@ -40,11 +47,11 @@ def data_init():
 
     projects_to_gcal()
 
-    if premium_user:
+    if context.current().premium_user:
         init_completed_tasks()
 
     for project in api.projects.all():
-        if not project['is_archived'] and not project['is_deleted'] and project['id'] != inbox_project_id:
+        if not project['is_archived'] and not project['is_deleted'] and project['id'] != context.current().inbox_project_id:
             project_data = [project['name'], project['parent_id'],
                             project['id'], project['indent']]
             sql_ops.insert_many("projects", project_data)
@@ -58,12 +65,148 @@ def data_init():
     time.sleep(10)
 
 
+def todoist_sync():
+    """
+        Performs the api.sync() of a cycle, recording its latency; the objects completed or
+        archived by the previous cycles have been handled since and are evicted from a compact
+        state first (see todoist_state.py).
+    """
+    with metrics.timer('todoist_sync_seconds'), context.current().todoist_lock:
+        if hasattr(api, 'evict'):
+            api.evict()
+        return api.sync()
+
+
+def commit(on_committed=None):
+    """
+        Commits the commands queued by item.update() and co. (caller holds the todoist_lock),
+        or adds them to the batch of the calling thread, see batched_commands().
+        'on_committed' is called once Todoist has confirmed the last of them, never if it
+        is dropped (see commit_commands()).
+    """
+    app_context = context.current()
+    batch = getattr(app_context.thread_local, 'commands', None)
+    if batch is None:
+        if not api.queue:
+            return None
+        # api.commit(), keeping the changes its sync merges into the state
+        response = api.sync(commands=api.queue)
+        del api.queue[:]
+        keep_commit_delta(response)
+        for uuid, status in response.get('sync_status', {}).items():
+            if status != 'ok':
+                from todoist.api import SyncError
+                raise SyncError(uuid, status)
+        if on_committed is not None:
+            on_committed()
+        return response
+
+    if api.queue and on_committed is not None:
+        app_context.command_callbacks[api.queue[-1]['uuid']] = on_committed
+    batch.extend(api.queue)
+    del api.queue[:]
+
+
+@contextmanager
+def batched_commands():
+    """
+        Defers the commits of the block, so that its commands are sent with as few
+        requests as possible once the block exits (see commit_commands()).
+    """
+    local = context.current().thread_local
+    if getattr(local, 'commands', None) is not None:
+        # nested, the outer block commits
+        yield
+        return
+
+    local.commands = []
+    try:
+        yield
+    finally:
+        commands, local.commands = local.commands, None
+        commit_commands(commands)
+
+
+def keep_commit_delta(response):
+    """
+        Keeps the changes of a command commit's response (caller holds the todoist_lock):
+        its api.sync() merges the changes made in Todoist since the last one into the state
+        and advances the sync token, they are planned by the next sync_todoist().
+    """
+    delta = {key: (response or {}).get(key) or [] for key in ('items', 'notes', 'projects')}
+    if any(delta.values()):
+        context.current().commit_deltas.append(delta)
+
+
+def take_commit_deltas():
+    """ Returns the changes kept by keep_commit_delta() since the last call, oldest first. """
+    app_context = context.current()
+    with app_context.todoist_lock:
+        deltas, app_context.commit_deltas = app_context.commit_deltas, []
+    return deltas
+
+
+def commit_commands(commands):
+    """
+        Commits the commands, along with those to retry from earlier batches, with a request
+        per COMMANDS_PER_REQUEST commands. The commands rejected by Todoist, or whose request
+        failed, are retried with the next batch, up to COMMAND_MAX_ATTEMPTS times; returns
+        true if every command has been committed.
+    """
+    app_context = context.current()
+    pending = app_context.retry_commands + [(command, 0) for command in commands]
+    app_context.retry_commands = []
+    if not pending:
+        return True
+
+    for start in range(0, len(pending), COMMANDS_PER_REQUEST):
+        chunk = pending[start:start + COMMANDS_PER_REQUEST]
+        sync_status = None
+        try:
+            with metrics.timer('todoist_commit_seconds'), app_context.todoist_lock:
+                response = api.sync(commands=[command for command, attempts in chunk])
+                keep_commit_delta(response)
+            sync_status = response.get('sync_status')
+            if sync_status is None:
+                log.warning('Todoist did not process the commands: ' + str(response.get('error', response)))
+        except Exception as err:
+            log.warning(str(err) + ' Could not commit ' + str(len(chunk)) + ' commands to Todoist.')
+        metrics.inc('todoist_commands_total', len(chunk))
+
+        for command, attempts in chunk:
+            status = (sync_status or {}).get(command['uuid'])
+            if status == 'ok':
+                on_committed = app_context.command_callbacks.pop(command['uuid'], None)
+                if on_committed is not None:
+                    try:
+                        on_committed()
+                    except Exception as err:
+                        log.exception(err)
+                continue
+            if attempts + 1 >= COMMAND_MAX_ATTEMPTS:
+                log.error('Giving up on the Todoist command ' + command['type'] + ' ' +
+                          json.dumps(command['args']) + ': ' + str(status))
+                app_context.command_callbacks.pop(command['uuid'], None)
+                metrics.inc('todoist_commands_dropped_total')
+            else:
+                log.debug('Todoist command ' + command['type'] + ' ' +
+                          json.dumps(command['args']) + ' failed: ' + str(status))
+                # same uuid: Todoist ignores a command it already processed
+                app_context.retry_commands.append((command, attempts + 1))
+                metrics.inc('retries_total', api='todoist')
+
+    return not app_context.retry_commands
+
+
 def projects_to_gcal():
     """
         Creates a calendar for each Todoist project, while taking into consideration
         'excluded_ids' and 'standalone_ids' table.
     """
 
+    # fetches the calendar list once, for every calendar to be created below
+    gcal.sync_calendar_list()
+
     # create a calendar for each parent project, excluding project 'Inbox'
     for project in api.projects.all():
         standalone_project = False
@@ -191,11 +334,15 @@ def standalone_projects():
 
 
 def sync_todoist(initial_sync=None):
-    # indicates the event was just moved
-    changed_location_of_event = None
-
     write_to_db = True
 
+    # backpressure: let the workers catch up before fetching more changes
+    if not initial_sync and outbox.pending_count() >= USER_PREFS['outbox.maxPending']:
+        log.warning('The outbox is full; Todoist is not polled until it drains.')
+        outbox.drain()
+        flush_task_stats()
+        return
+
     # retrieve last api.sync() from database
     prev_sync_resources = read_json_db()
     prev_sync_token = None
@@ -210,13 +357,13 @@ def sync_todoist(initial_sync=None):
         ~/.todoist-sync/your_api_key.sync
         """
         # force a sync to obtain last changes, since last api.sync()
-        new_api_sync = api.sync()
+        new_api_sync = todoist_sync()
     else:
         new_api_sync = initial_sync
 
     # case where Todoist sync is an empty string
     while new_api_sync == '':
-        new_api_sync = api.sync()
+        new_api_sync = todoist_sync()
 
     # Pauses until a valid Todoist API sync response is retrieved
     while not is_post_response_valid(new_api_sync)[0] or not is_post_response_valid(new_api_sync)[1]:
@@ -224,8 +371,9 @@ def sync_todoist(initial_sync=None):
             if new_api_sync['error_tag'] == 'LIMITS_REACHED':
                 log.critical(
                     'LIMITS_REACHED from Todoist; pausing operation for 8s...')
+                metrics.inc('retries_total', api='todoist')
                 time.sleep(8)
-        new_api_sync = api.sync()
+        new_api_sync = todoist_sync()
 
     changes = []
     note_changes = []
@@ -239,61 +387,155 @@ def sync_todoist(initial_sync=None):
             note_changes = new_api_sync['notes']
             project_changes = new_api_sync['projects']
 
-    # for project changed, perform the following operations
-    for k in range(0, len(project_changes)):
-        project = project_changes[k]
-        calendar_id = None
-        calendar_name = None
-        project_found = False
-
-        calendar_data = sql_ops.select_from_where(
-            "calendar_id, calendar_name", "gcal_ids", "todoist_project_id", project['id'])
-
-        if calendar_data is not None:
-            calendar_id = calendar_data[0]
-            calendar_name = calendar_data[1]
-            project_found = True
-
-        # new project
-        if not project_found:
-            if project['parent_id'] is None \
-                    and not project['is_archived'] and not project['is_deleted']:
-
-                project_data = sql_ops.select_from_where(
-                    "project_name, project_indent", "projects", "project_id", project['id'])
-                if not project_data:
-                    if gcal.create_calendar(project['name'], project['id'], timezone()):
-                        row_data = [project['name'], project['parent_id'],
-                                    project['id'], project['indent']]
-                        sql_ops.insert_many("projects", row_data)
-        else:
-            project_data = sql_ops.select_from_where(
-                "project_name, project_indent", "projects", "project_id", project['id'])
-            if project_data:
-                project_name = project_data[0]
-                prev_project_indent = project_data[1]
-                project_parent_id = __parent_project_id__(project['id'])
+    # the changes merged by the command commits since the last cycle come first
+    commit_deltas = take_commit_deltas()
+    if commit_deltas:
+        changes = [item for delta in commit_deltas for item in delta['items']] + changes
+        note_changes = [note for delta in commit_deltas for note in delta['notes']] + note_changes
+        project_changes = [project for delta in commit_deltas for project in delta['projects']] \
+            + project_changes
 
-                """
-                # sub project becomes parent project
-                if prev_project_indent != 1 and project['indent'] == 1 and not is_excluded(project['id']):
+    index_notes(note_changes)
 
-                    # remove tasks from calendar of prev parent project
-                    tasks = sql_ops.select_from_where("event_id, task_id", "todoist", "project_id", project['id'], fetch_all=True)
-                    for task in tasks:
-                        event_id = task[0]
-                        task_id = task[1]
-                        calendar_id = find_cal_id(project['id'], find_cal_id(project['id'], project_parent_id))
+    # fold the changes of this cycle into at most one operation per event
+    delta = {'items': changes, 'notes': note_changes,
+             'projects': project_changes}
+    operations = planner.plan(plan_state(delta), delta)
 
-                        # delete event from existing calendar
-                        gcal.delete_event(calendar_id, event_id)
+    # project operations create, rename or delete calendars, before any event lands there
+    for operation in operations:
+        if operation['op'] == planner.PROJECT:
+            try:
+                apply_operation(operation)
+            except Exception as err:
+                write_to_db = False
+                log.exception(str(err) + ' Could not apply the changes of project id: '
+                              + str(operation['project']['id']))
 
-                    # remove tasks from "todoist" table
+    # the Gcal writes of the tasks are left to the outbox workers
+    if not outbox.enqueue(operations):
+        write_to_db = False
+
+    if write_to_db:
+        write_sync_db(new_api_sync)
+
+    outbox.drain()
+    flush_task_stats()
+
+
+def project_changed(project):
+    """
+        Syncs a changed Todoist project with its calendar (Todoist --> Gcal).
+    """
+    calendar_id = None
+    calendar_name = None
+    project_found = False
+
+    calendar_data = sql_ops.select_from_where(
+        "calendar_id, calendar_name", "gcal_ids", "todoist_project_id", project['id'])
+
+    if calendar_data is not None:
+        calendar_id = calendar_data[0]
+        calendar_name = calendar_data[1]
+        project_found = True
+
+    # new project
+    if not project_found:
+        if project['parent_id'] is None \
+                and not project['is_archived'] and not project['is_deleted']:
+
+            project_data = sql_ops.select_from_where(
+                "project_name, project_indent", "projects", "project_id", project['id'])
+            if not project_data:
+                if gcal.create_calendar(project['name'], project['id'], timezone()):
+                    row_data = [project['name'], project['parent_id'],
+                                project['id'], project['indent']]
+                    sql_ops.insert_many("projects", row_data)
+    else:
+        project_data = sql_ops.select_from_where(
+            "project_name, project_indent", "projects", "project_id", project['id'])
+        if project_data:
+            project_name = project_data[0]
+            prev_project_indent = project_data[1]
+            project_parent_id = __parent_project_id__(project['id'])
+
+            """
+            # sub project becomes parent project
+            if prev_project_indent != 1 and project['indent'] == 1 and not is_excluded(project['id']):
+
+                # remove tasks from calendar of prev parent project
+                tasks = sql_ops.select_from_where("event_id, task_id", "todoist", "project_id", project['id'], fetch_all=True)
+                for task in tasks:
+                    event_id = task[0]
+                    task_id = task[1]
+                    calendar_id = find_cal_id(project['id'], find_cal_id(project['id'], project_parent_id))
+
+                    # delete event from existing calendar
+                    gcal.delete_event(calendar_id, event_id)
+
+                # remove tasks from "todoist" table
+                if sql_ops.delete_from_where("todoist", "project_id", project['id']):
+                    log.debug("All events have been deleted from previous parent project calendar, to be moved to the new calendar.")
+
+                # create calendar as parent project
+                gcal.create_calendar(project['name'], project['id'], timezone())
+
+                # init tasks of particular project
+                for item in api.items.all(has_due_date_utc):
+                    if item['project_id'] == project['id']:
+                        # Todoist task --> Gcal event
+                        new_task_added(item)
+
+                # update "projects" table to reflect new indentation level
+                sql_ops.update_set_where("projects", "project_indent = ?", "project_id = ?", project['indent'], project['id'])
+            """
+
+        if project['is_deleted'] or project['is_archived']:
+            if gcal.delete_calendar(calendar_id):
+                log.info(project['name'] +
+                         " has been deleted successfully.")
+                sql_ops.delete_from_where(
+                    "gcal_ids", "calendar_id", calendar_id)
+
+                # parent project
+                if project['parent_id'] is None:
+                    if sql_ops.delete_from_where("todoist", "parent_project_id", project['id']):
+                        log.info(
+                            "Parent project's task clean up has been performed.")
+                else:
+                    # sub project
                     if sql_ops.delete_from_where("todoist", "project_id", project['id']):
-                        log.debug("All events have been deleted from previous parent project calendar, to be moved to the new calendar.")
+                        log.info(
+                            "Project's task clean up has been performed.")
+                sql_ops.delete_from_where(
+                    "projects", "project_id", project['id'])
+        else:
+            # Todoist --> Gcal (Project name sync)
+            # Retrieve calendar name from db
+            prev_project_name = (
+                calendar_name.split('Project:')[1]).strip()
+            if prev_project_name != project['name']:
+                # update calendar name
+                new_cal_name = 'Project: ' + project['name']
+                if gcal.update_cal_name(calendar_id, new_cal_name):
+                    # update name in "gcal_ids" table
+                    if sql_ops.update_set_where("gcal_ids", "calendar_name = ?", "calendar_id = ?", new_cal_name, calendar_id):
+                        log.info(
+                            "Calendar name has been synched with Gcal.")
+
+            # parent project becomes sub project
+            if project['id'] is not None and project['indent'] != 1:
+                # remove calendar from gcal
+                if gcal.delete_calendar(calendar_id):
+                    log.info(str(
+                        project['name']) + " parent project has been deleted to become a sub project.")
+                    # remove calendar from "gcal_ids" table
+                    sql_ops.delete_from_where(
+                        "gcal_ids", "calendar_id", calendar_id)
 
-                    # create calendar as parent project
-                    gcal.create_calendar(project['name'], project['id'], timezone())
+                    # remove tasks from "todoist" table
+                    sql_ops.delete_from_where(
+                        "todoist", "project_id", project['id'])
 
                     # init tasks of particular project
                     for item in api.items.all(has_due_date_utc):
@@ -301,211 +543,340 @@ def sync_todoist(initial_sync=None):
                             # Todoist task --> Gcal event
                             new_task_added(item)
 
-                    # update "projects" table to reflect new indentation level
-                    sql_ops.update_set_where("projects", "project_indent = ?", "project_id = ?", project['indent'], project['id'])
-                """
+                    sql_ops.update_set_where("projects", "parent_project_id = ?, project_indent = ?",
+                                             "project_id = ?", project['parent_id'], project['indent'], project['id'])
 
-            if project['is_deleted'] or project['is_archived']:
-                if gcal.delete_calendar(calendar_id):
-                    log.info(project['name'] +
-                             " has been deleted successfully.")
-                    sql_ops.delete_from_where(
-                        "gcal_ids", "calendar_id", calendar_id)
 
-                    # parent project
-                    if project['parent_id'] is None:
-                        if sql_ops.delete_from_where("todoist", "parent_project_id", project['id']):
-                            log.info(
-                                "Parent project's task clean up has been performed.")
-                    else:
-                        # sub project
-                        if sql_ops.delete_from_where("todoist", "project_id", project['id']):
-                            log.info(
-                                "Project's task clean up has been performed.")
-                    sql_ops.delete_from_where(
-                        "projects", "project_id", project['id'])
-            else:
-                # Todoist --> Gcal (Project name sync)
-                # Retrieve calendar name from db
-                prev_project_name = (
-                    calendar_name.split('Project:')[1]).strip()
-                if prev_project_name != project['name']:
-                    # update calendar name
-                    new_cal_name = 'Project: ' + project['name']
-                    if gcal.update_cal_name(calendar_id, new_cal_name):
-                        # update name in "gcal_ids" table
-                        if sql_ops.update_set_where("gcal_ids", "calendar_name = ?", "calendar_id = ?", new_cal_name, calendar_id):
-                            log.info(
-                                "Calendar name has been synched with Gcal.")
-
-                # parent project becomes sub project
-                if project['id'] is not None and project['indent'] != 1:
-                    # remove calendar from gcal
-                    if gcal.delete_calendar(calendar_id):
-                        log.info(str(
-                            project['name']) + " parent project has been deleted to become a sub project.")
-                        # remove calendar from "gcal_ids" table
-                        sql_ops.delete_from_where(
-                            "gcal_ids", "calendar_id", calendar_id)
-
-                        # remove tasks from "todoist" table
-                        sql_ops.delete_from_where(
-                            "todoist", "project_id", project['id'])
-
-                        # init tasks of particular project
-                        for item in api.items.all(has_due_date_utc):
-                            if item['project_id'] == project['id']:
-                                # Todoist task --> Gcal event
-                                new_task_added(item)
-
-                        sql_ops.update_set_where("projects", "parent_project_id = ?, project_indent = ?",
-                                                 "project_id = ?", project['parent_id'], project['indent'], project['id'])
-
-    # if anything changed since last sync, then
-    # for each changed item, perform the following operations
-    for i in range(0, len(changes)):
-        task_id = changes[i]['id']
-
-        task_data = sql_ops.select_from_where(
-            "project_id, parent_project_id, due_date, event_id", "todoist", "task_id", task_id)
-
-        if task_data:
-            event_id = task_data[3]
-
-            calendar_id = find_task_calId(task_data[0], task_data[1])
-
-            if changes[i]['due_date_utc']:
-                if calendar_id and task_data:
-
-                    recurring_task_completed = False
-                    if 'every' in changes[i]['date_string'].lower() and premium_user:
-                        try:
-                            # give some time for Todoist's servers to update activity log
-                            time.sleep(2)
-
-                            last_activity = api.activity.get()
-
-                            # determine if recurring task was completed or got postponed
-                            if last_activity:
-                                for k in range(0, len(last_activity)):
-                                    if last_activity[k]['object_id'] == task_id:
-                                        if last_activity[k]['event_type'] == 'completed':
-                                            recurring_task_completed = True
-                                        # break on first instance where last_activity[k]['object_id'] == task_id
-                                        break
-                        except Exception as err:
-                            log.exception(err)
-
-                    if changes[i]['is_deleted']:
-                        try:
-                            if deletion(calendar_id, event_id, task_id):
-                                log.info('Task with id: ' + task_id +
-                                         ' has been successfully deleted.')
-                        except Exception as err:
-                            write_to_db = False
-                            log.exception(err)
-                    elif recurring_task_completed and premium_user:
-                        data_recurring = sql_ops.select_from_where(
-                            "project_id, parent_project_id, due_date, event_id", "todoist", "task_id", task_id)
-                        recurring_task_due_date = None
-                        if data_recurring:
-                            recurring_task_due_date = data_recurring[2]
-
-                        if recurring_task_due_date != changes[i]['due_date_utc']:
-                            if recurring_task_completed:
-                                try:
-                                    if checked(calendar_id, event_id, task_id, recurring_task_due_date):
-                                        log.debug(
-                                            str(task_id) + ': recurring task was checked.')
-                                except Exception as err:
-                                    write_to_db = False
-                                    log.exception(str(err) + 'Could not mark the task with id: '
-                                                  + str(task_id) + ' as completed rec.')
-
-                                if new_task_added(changes[i]):
-                                    log.debug('Task id ' + str(task_id)
-                                              + ' has been added to Gcal for the next date of the recurring task.')
-                                else:
-                                    write_to_db = False
-                                    log.error('Task id: ' + str(task_id)
-                                              + ' could not be added to Google Calendar, '
-                                              + 'for the next date of the recurring task being completed.')
-                    else:
-                        # Task due date --> Gcal date (sync)
-                        if changes[i]['due_date_utc'] and changes[i]['project_id'] \
-                                and task_data and changes[i]['due_date_utc'] != task_data[2]:
-
-                            try:
-                                date_google(calendar_id, changes[i]['due_date_utc'],
-                                            task_id, changes[i]['content'], event_id)
-                            except Exception as err:
-                                write_to_db = False
-                                log.error(
-                                    str(err) + 'Could not update date of event in Gcal...')
-
-                        # Task name --> Event name (sync)
-                        try:
-                            task_name(calendar_id, event_id, task_id)
-                        except Exception as err:
-                            write_to_db = False
-                            log.error(err)
-
-                        # Task checked --> Gcal (sync)
-                        # needs to be called after task name sync,
-                        # for task with due date in the future to have a tick and be moved to today
-                        if changes[i]['checked']:
-                            try:
-                                checked(calendar_id, event_id, task_id)
-                            except Exception as err:
-                                write_to_db = False
-                                log.error(str(err) + ' Could not mark the task with id: '
-                                          + str(task_id) + ' as completed from task checked.')
-
-                        # Task location --> Gcal (sync)
-                        if task_id and changes[i]['project_id'] == api.state['user']['inbox_project']:
-                            # task moved back to Inbox --> remove from Gcal
-                            try:
-                                if deletion(calendar_id, event_id, task_id):
-                                    log.info('Task with id: ' + str(task_id) +
-                                             ' has been deleted successfully.')
-                            except Exception as err:
-                                pass
-                        elif task_id and task_location(calendar_id, event_id, task_id, changes[i]['project_id']):
-                            log.info(str(task_id) +
-                                     ' has been moved to a different project.')
+def plan_state(delta):
+    """
+        Collects the database state that planner.plan() needs for a Todoist delta.
+    """
+    task_ids = set(item['id'] for item in delta['items'])
+    task_ids.update(note['item_id'] for note in delta['notes'])
 
-            else:
-                # remove event from Gcal
-                try:
-                    if deletion(calendar_id, event_id, task_id):
-                        log.info('Task with id: ' + str(task_id) +
-                                 ' has been deleted successfully.')
-                except Exception as err:
-                    write_to_db = False
-                    log.error(str(err))
-        elif not changes[i]['checked']:
-            """ Undo operation detected. """
-            if is_completed(task_id):
-                undo(task_id)
-
-            # task with due date has not been deleted
-            elif changes[i]['due_date_utc']:
-                try:
-                    new_task_added(changes[i])
-                except Exception as err:
-                    write_to_db = False
-                    log.exception('task id: ' + str(task_id)
-                                  + ' could not be added to Google Calendar.')
+    tasks = {}
+    completed = set()
+    for task_id in task_ids:
+        row = task_row(task_id)
 
-    # for each note changed, perform the following operations
-    for j in range(0, len(note_changes)):
+        if row:
+            tasks[task_id] = row
+        elif is_completed(task_id):
+            completed.add(task_id)
 
-        # Task note added --> gcal desc (sync)
-        if note_changes[j]['item_id']:
-            update_desc_location(note_changes[j]['item_id'])
+    calendars = set()
+    for project in delta['projects']:
+        if sql_ops.select_from_where("calendar_id", "gcal_ids", "todoist_project_id", project['id']):
+            calendars.add(project['id'])
 
-    if write_to_db:
-        write_sync_db(new_api_sync)
+    parents = {}
+    for item in delta['items']:
+        if item['project_id'] not in parents:
+            parents[item['project_id']] = __parent_project_id__(
+                item['project_id'])
+
+    return {'tasks': tasks, 'completed': completed, 'calendars': calendars,
+            'parents': parents, 'inbox_project_id': context.current().inbox_project_id,
+            'premium': context.current().premium_user}
+
+
+def apply_operation(operation):
+    """
+        Applies an operation planned by planner.plan() to Gcal and the database.
+    """
+    op_code = False
+
+    if operation['op'] == planner.PROJECT:
+        project_changed(operation['project'])
+        return True
+
+    task_id = operation['task_id']
+
+    if operation['op'] == planner.INSERT:
+        op_code = new_task_added(operation['item'])
+        if not op_code:
+            log.error('Task id: ' + str(task_id) +
+                      ' could not be added to Google Calendar.')
+    elif operation['op'] == planner.UNDO:
+        # undo() pushes the whole event back, its description and location included
+        if not undo(task_id) and planner.DESC in operation['fields']:
+            update_desc_location(task_id)
+        op_code = True
+    else:
+        row = operation['row']
+        calendar_id = find_task_calId(
+            row['project_id'], row['parent_project_id'])
+
+        if operation['op'] == planner.DELETE:
+            if deletion(calendar_id, row['event_id'], task_id):
+                log.info('Task with id: ' + str(task_id) +
+                         ' has been deleted successfully.')
+                op_code = True
+        else:
+            op_code = update_event(calendar_id, operation)
+
+    return op_code
+
+
+@metrics.timed('handler_seconds', handler='update_event')
+def update_event(calendar_id, operation):
+    """
+        Pushes the desired event of a changed task to Gcal with a single request, provided
+        its content hash changed, followed by a move, should the task have changed calendar.
+        Completed tasks get their event ticked instead.
+    """
+    op_code = False
+    task_id = operation['task_id']
+    fields = operation['fields']
+    event_id = operation['row']['event_id']
+
+    item = operation['item']
+    if item is None:
+        item = api.items.get_by_id(task_id)
+
+    if not calendar_id or not event_id or item is None:
+        return op_code
+
+    if planner.RECURRING in fields and recurring_task_completed(task_id):
+        return recurring_checked(calendar_id, event_id, item, operation['row'])
+
+    todoist_tz = pytz.timezone(timezone())
+    db_columns = {}
+
+    # Task due date --> Gcal date (sync)
+    became_overdue = rescheduled = False
+    if planner.DATE in fields:
+        difference = (__todoist_utc_to_date__(item['due_date_utc']) -
+                      datetime.now(todoist_tz).date()).days
+
+        db_columns['due_date'] = item['due_date_utc']
+        db_columns['overdue'] = True if difference < 0 else None
+
+        # statistics of the task and its project; completing a task is no reschedule
+        if planner.CHECKED not in fields:
+            became_overdue = difference < 0 and not operation['row']['overdue']
+            rescheduled = rescheduled_on_due_date(operation['row']['due_date'], item['due_date_utc'])
+
+    if planner.CHECKED in fields:
+        # Task checked --> Gcal (sync)
+        event = {}
+        if planner.DATE in fields:
+            new_event_date = __date_to_google_format__(
+                __todoist_utc_to_date__(item['due_date_utc']))
+            event['start'] = {'date': new_event_date}
+            event['end'] = {'date': new_event_date}
+            event['colorId'] = 11 if difference < 0 else None
+        if planner.LOCATION in fields:
+            event['location'] = task_path(task_id, item)
+        if planner.DESC in fields:
+            event['description'] = event_desc(item)
+        checked_event(event, db_columns, item)
+
+        op_code = gcal.patch_event(calendar_id, event_id, event)
+    else:
+        # name, date, notes and location of the task --> Gcal (sync)
+        event = desired_event(item)
+        new_event_hash = event_hash(event)
+
+        if new_event_hash == operation['row']['event_hash']:
+            op_code = True
+        elif gcal.patch_event(calendar_id, event_id, event):
+            db_columns['event_hash'] = new_event_hash
+            op_code = True
+
+    if op_code:
+        if not update_task_row(task_id, db_columns, became_overdue, rescheduled):
+            log.warning(
+                'Could update event on Gcal, but could not update Todoist table.')
+
+        if planner.LOCATION in fields and task_location(calendar_id, event_id, task_id, item['project_id']):
+            log.info(str(task_id) + ' has been moved to a different project.')
+
+        if planner.CHECKED in fields:
+            move_to_completed(task_id)
+            log.debug('Task ' + str(task_id) + ' has been completed.')
+
+    return op_code
+
+
+def event_body(event_name, start_date, end_date=None, location=None, desc=None, color_id=None,
+               reminders=None):
+    """
+        Returns the fields of an event that are managed by the daemon.
+    """
+    return {
+        'summary': event_name,
+        'location': location,
+        'description': desc,
+        'start': {'date': start_date},
+        'end': {'date': end_date or start_date},
+        'colorId': color_id,
+        'reminders': {
+            'useDefault': False,
+            'overrides': reminders or [],
+        },
+    }
+
+
+def desired_event(item):
+    """
+        Returns the event a synced (not completed) Todoist task should have on Gcal.
+    """
+    todoist_tz = pytz.timezone(timezone())
+    due_date = __todoist_utc_to_date__(item['due_date_utc'])
+    difference = (due_date - datetime.now(todoist_tz).date()).days
+
+    return event_body(compute_event_name(item), __date_to_google_format__(due_date),
+                      location=task_path(item['id'], item), desc=event_desc(item),
+                      color_id=11 if difference < 0 else None,
+                      reminders=USER_PREFS['events.reminder'])
+
+
+def event_hash(event):
+    """
+        Returns the content hash of an event body, as stored in the "todoist" table.
+    """
+    return hashlib.sha1(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def reconcile_task(calendar_id, item, row):
+    """
+        Pushes the desired event of a task to Gcal, unless its content hash is unchanged;
+        'row' (see task_row()) gets the new hash along with the "todoist" table. The calendar
+        is found from the row when 'calendar_id' is None.
+    """
+    op_code = True
+    event = desired_event(item)
+    new_event_hash = event_hash(event)
+
+    if new_event_hash != row['event_hash']:
+        op_code = False
+        if calendar_id is None:
+            calendar_id = find_task_calId(row['project_id'], row['parent_project_id'])
+        if calendar_id and gcal.patch_event(calendar_id, row['event_id'], event):
+            op_code = True
+            sql_ops.update_set_where(
+                "todoist", "event_hash = ?", "task_id = ?", new_event_hash, item['id'])
+            row['event_hash'] = new_event_hash
+
+    return op_code
+
+
+def reconcile():
+    """
+        Compares the desired event of every synced task with the content hash stored in the
+        "todoist" table, and pushes only the events that changed.
+    """
+    pushed = 0
+    task_ids = sql_ops.select_from_where(
+        "task_id", "todoist", None, None, True) or []
+
+    for task_id in task_ids:
+        task_id = task_id[0]
+        row = task_row(task_id)
+        item = api.items.get_by_id(task_id)
+
+        # tasks with changes that haven't been synced yet are left to sync_todoist()
+        if row is None or item is None or item['checked'] \
+                or not item['due_date_utc'] or item['due_date_utc'] != row['due_date']:
+            continue
+
+        synced_hash = row['event_hash']
+        if reconcile_task(None, item, row) and row['event_hash'] != synced_hash:
+            pushed += 1
+
+    log.info('Reconciliation complete, ' + str(pushed) + ' out of '
+             + str(len(task_ids)) + ' events have been updated.')
+
+
+def checked_event(event, db_columns, item):
+    """
+        Adds the changes that mark an event as completed to 'event' and 'db_columns'.
+    """
+    todoist_tz = pytz.timezone(timezone())
+    task_due_date_utc = str_to_date_obj(item['due_date_utc'])
+    todays_date_utc = datetime.now(todoist_tz).astimezone(pytz.utc).date()
+    difference = (task_due_date_utc - todays_date_utc).days
+
+    if difference > 0:
+        # move event of a task completed ahead of time to today
+        todays_date = __date_to_google_format__(
+            datetime.now(todoist_tz).date())
+        event['start'] = {'date': todays_date}
+        event['end'] = {'date': todays_date}
+        event['colorId'] = 11 if is_overdue(item['id']) else None
+
+        db_columns['due_date'] = datetime.now(
+            pytz.UTC).strftime("%a %d %b %Y %H:%M:%S +0000")
+        db_columns['overdue'] = None
+    elif difference < 0:
+        # if task was due in the past and got completed today, extend event length to today
+        extended_date_utc = datetime.now(todoist_tz).astimezone(
+            pytz.utc).replace(hour=21, minute=59, second=59)
+        event['end'] = {'date': __date_to_google_format__(
+            __todoist_utc_to_date__(str(extended_date_utc)))}
+
+        # restore event color from overdue color
+        event['colorId'] = None
+
+    event['summary'] = '✓ ' + compute_event_name(item, True)
+
+    # remove popup reminder from event, since the event is completed
+    event['reminders'] = {'useDefault': False, 'overrides': []}
+
+
+def recurring_task_completed(task_id):
+    """
+        Returns true if the last activity of a recurring task was its completion,
+        false if it got postponed.
+    """
+    recurring_task_completed = False
+    try:
+        # give some time for Todoist's servers to update activity log
+        time.sleep(2)
+
+        last_activity = api.activity.get()
+
+        if last_activity:
+            for k in range(0, len(last_activity)):
+                if last_activity[k]['object_id'] == task_id:
+                    if last_activity[k]['event_type'] == 'completed':
+                        recurring_task_completed = True
+                    # break on first instance where last_activity[k]['object_id'] == task_id
+                    break
+    except Exception as err:
+        log.exception(err)
+
+    return recurring_task_completed
+
+
+def recurring_checked(calendar_id, event_id, item, row):
+    """
+        Ticks the event of a completed recurring task and adds the event of its next date.
+    """
+    op_code = True
+    task_id = item['id']
+    recurring_task_due_date = row['due_date']
+
+    if recurring_task_due_date != item['due_date_utc']:
+        try:
+            if checked(calendar_id, event_id, task_id, recurring_task_due_date):
+                log.debug(str(task_id) + ': recurring task was checked.')
+        except Exception as err:
+            op_code = False
+            log.exception(str(err) + 'Could not mark the task with id: '
+                          + str(task_id) + ' as completed rec.')
+
+        if new_task_added(item):
+            log.debug('Task id ' + str(task_id)
+                      + ' has been added to Gcal for the next date of the recurring task.')
+        else:
+            op_code = False
+            log.error('Task id: ' + str(task_id)
+                      + ' could not be added to Google Calendar, '
+                      + 'for the next date of the recurring task being completed.')
+
+    return op_code
 
 
 def write_sync_db(json_str=None):
@@ -541,15 +912,18 @@ def read_json_db():
 def delete_task(task_id):
     op_code = True
 
+    def delete_row():
+        # if task is found in the 'todoist' table
+        if not sql_ops.delete_from_where("todoist", "task_id", task_id):
+            log.warning('Task ' + str(task_id) + ' was deleted from Todoist, but not from the todoist table.')
+
     if task_id:
         item = api.items.get_by_id(task_id)
         if item is not None:
-            item.delete()
-            api.commit()
-
-            # if task is found in the 'todoist' table
-            if not sql_ops.delete_from_where("todoist", "task_id", task_id):
-                op_code = False
+            # the row is kept until Todoist confirms the deletion (see commit_commands())
+            with context.current().todoist_lock:
+                item.delete()
+                commit(on_committed=delete_row)
 
     return op_code
 
@@ -568,8 +942,9 @@ def update_task_due_date(cal_id, event_id, task_id, new_event_date):
 
         try:
             item = api.items.get_by_id(task_id)
-            item.update(due_date_utc=str(new_due_date))
-            api.commit()
+            with context.current().todoist_lock:
+                item.update(due_date_utc=str(new_due_date))
+                commit()
         except Exception as err:
             log.error(err)
 
@@ -592,11 +967,13 @@ def update_task_due_date(cal_id, event_id, task_id, new_event_date):
         else:
             gcal.update_event_color(cal_id, event_id, 11)
 
-        sql_ops.update_set_where(
-            "todoist", "due_date = ?", "task_id = ?", item['due_date_utc'], task_id)
+        update_task_row(task_id, {'due_date': item['due_date_utc']},
+                        rescheduled=rescheduled_on_due_date(due_date, item['due_date_utc']))
 
 
 def init_completed_tasks():
+    from jsonschema import validate
+
     completed_task = api.completed.get_all(limit=200)['items']
 
     for k in range(0, len(completed_task)):
@@ -615,14 +992,18 @@ def init_completed_tasks():
             # Todoist task --> Gcal event adds them to the day they were completed
             task_id = completed_task[k]['task_id']
 
-            item = api.items.get(task_id)
-            if item is not None:
-                try:
-                    item = item['item']
-                    validate(item, TODOIST_SCHEMA['items'])
-                except:
-                    valid_item = False
+            # the state holds the tasks still active (e.g. recurring), the others are requested
+            item = api.items.get_by_id(task_id, only_local=True)
+            if item is None:
+                item = api.items.get(task_id)
+                if item is not None:
+                    try:
+                        item = item['item']
+                        validate(item, TODOIST_SCHEMA['items'])
+                    except:
+                        valid_item = False
 
+            if item is not None:
                 try:
                     if valid_item and item['due_date_utc'] and completed_task[k]['completed_date'] \
                             and new_task_added(item, completed_task[k]['completed_date']):
@@ -654,6 +1035,133 @@ def get_task(task_id):
 ########### gcal-sync-handlers  ###########
 
 
+def index_notes(notes):
+    """ Applies the notes of a (full or incremental) sync to the notes index of the context. """
+    notes_index = context.current().notes_index
+    for note in notes:
+        item_notes = notes_index.setdefault(note['item_id'], {})
+
+        if note['is_deleted']:
+            item_notes.pop(note['id'], None)
+        else:
+            item_notes[note['id']] = note['content']
+
+        if not item_notes:
+            del notes_index[note['item_id']]
+
+
+def task_notes(task_id):
+    """ Returns the contents of the notes of a task, in the order they were posted. """
+    item_notes = context.current().notes_index.get(task_id, {})
+    return [item_notes[note_id] for note_id in sorted(item_notes)]
+
+
+def task_row(task_id):
+    """ Returns the row of a task in the "todoist" table as a dict, or None. """
+    row = None
+    task_data = sql_ops.select_from_where(
+        "project_id, parent_project_id, due_date, event_id, overdue, event_hash", "todoist", "task_id", task_id)
+
+    if task_data:
+        row = {'project_id': task_data[0], 'parent_project_id': task_data[1],
+               'due_date': task_data[2], 'event_id': task_data[3],
+               'overdue': task_data[4], 'event_hash': task_data[5]}
+
+    return row
+
+
+def update_task_row(task_id, db_columns, became_overdue=False, rescheduled=False):
+    """
+        Updates the columns of a task's row in the "todoist" table. Its times_overdue /
+        times_resheduled_on_due_date counters are counted, and written along with the rollup
+        of its project by flush_task_stats(), once per cycle.
+    """
+    if became_overdue or rescheduled:
+        count_task_stats(task_id, became_overdue, rescheduled)
+    if not db_columns:
+        return True
+
+    return sql_ops.run_transaction([
+        ("UPDATE todoist SET " + ', '.join(column + ' = ?' for column in db_columns) + " WHERE task_id = ?",
+         list(db_columns.values()) + [task_id])])
+
+
+def count_task_stats(task_id, became_overdue=False, rescheduled=False):
+    """ Counts a task becoming overdue or being rescheduled, until the next flush_task_stats(). """
+    app_context = context.current()
+    with app_context.task_stats_lock:
+        counts = app_context.task_stats.setdefault(task_id, [0, 0])
+        counts[0] += int(became_overdue)
+        counts[1] += int(rescheduled)
+
+
+def flush_task_stats():
+    """
+        Increments the counters of the tasks counted during the cycle, and the "project_stats"
+        rollup of their projects, in a single transaction; returns false if it failed, the
+        counts are then kept for the next cycle.
+    """
+    app_context = context.current()
+    with app_context.task_stats_lock:
+        task_stats, app_context.task_stats = app_context.task_stats, {}
+    if not task_stats:
+        return True
+
+    statements = []
+    for task_id, (times_overdue, times_rescheduled) in task_stats.items():
+        # the row of a task completed meanwhile is in "todoist_completed"
+        for table_name in ("todoist", "todoist_completed"):
+            statements.append(("UPDATE " + table_name + " SET times_overdue = COALESCE(times_overdue, 0) + ?, "
+                               "times_resheduled_on_due_date = COALESCE(times_resheduled_on_due_date, 0) + ? "
+                               "WHERE task_id = ?", [times_overdue, times_rescheduled, task_id]))
+        statements.append(("INSERT OR IGNORE INTO project_stats (project_id, times_overdue, times_rescheduled) "
+                           "SELECT project_id, 0, 0 FROM todoist WHERE task_id = ? "
+                           "UNION SELECT project_id, 0, 0 FROM todoist_completed WHERE task_id = ?",
+                           [task_id, task_id]))
+        statements.append(("UPDATE project_stats SET times_overdue = times_overdue + ?, "
+                           "times_rescheduled = times_rescheduled + ? WHERE project_id IN "
+                           "(SELECT project_id FROM todoist WHERE task_id = ? "
+                           "UNION SELECT project_id FROM todoist_completed WHERE task_id = ?)",
+                           [times_overdue, times_rescheduled, task_id, task_id]))
+
+    if sql_ops.run_transaction(statements):
+        return True
+
+    with app_context.task_stats_lock:
+        for task_id, (times_overdue, times_rescheduled) in task_stats.items():
+            counts = app_context.task_stats.setdefault(task_id, [0, 0])
+            counts[0] += times_overdue
+            counts[1] += times_rescheduled
+    return False
+
+
+def rescheduled_on_due_date(prev_due_date_utc, new_due_date_utc):
+    """ True if a due date change moves a task on (or past) its previous due date. """
+    if not prev_due_date_utc or not new_due_date_utc:
+        return False
+    prev_due_date = __todoist_utc_to_date__(prev_due_date_utc)
+    new_due_date = __todoist_utc_to_date__(new_due_date_utc)
+    today = datetime.now(pytz.timezone(timezone())).date()
+    return prev_due_date is not None and new_due_date is not None \
+        and prev_due_date != new_due_date and prev_due_date <= today
+
+
+def init_project_stats():
+    """
+        Seeds the "project_stats" rollup from the counters of the task rows, the first time
+        the table is used (times_overdue was kept before the rollup existed).
+    """
+    data = sql_ops.select_from_where("COUNT(*)", "project_stats")
+    if data and data[0] == 0:
+        sql_ops.run_transaction([(
+            "INSERT INTO project_stats (project_id, times_overdue, times_rescheduled) "
+            "SELECT project_id, SUM(COALESCE(times_overdue, 0)), "
+            "SUM(COALESCE(times_resheduled_on_due_date, 0)) FROM "
+            "(SELECT project_id, times_overdue, times_resheduled_on_due_date FROM todoist UNION ALL "
+            "SELECT project_id, times_overdue, times_resheduled_on_due_date FROM todoist_completed) "
+            "WHERE project_id IS NOT NULL GROUP BY project_id", [])])
+
+
 def get_task_id(event_id):
     task_id = sql_ops.select_from_where(
         "task_id", "todoist", "event_id", event_id)
@@ -664,6 +1172,45 @@ def get_task_id(event_id):
     return task_id
 
 
+def task_ids_by_event(event_ids):
+    """ Returns {event id: task id} of the events provided, in a single query. """
+    return dict(sql_ops.select_where_in("event_id, task_id", "todoist", "event_id", event_ids))
+
+
+def local_items(task_ids):
+    """
+        Returns {task id: item} of the tasks of the synced Todoist state, looked up in the index
+        of a compact state (see todoist_state.py), in one pass over the state otherwise (the
+        get_by_id() of todoist-python is a linear scan).
+    """
+    task_ids = set(task_ids)
+    if not task_ids:
+        return {}
+    if hasattr(api, 'evict'):
+        items = {task_id: api.items.get_by_id(task_id, only_local=True) for task_id in task_ids}
+        return {task_id: item for task_id, item in items.items() if item is not None}
+    return {item['id']: item for item in api.state['items'] if item['id'] in task_ids}
+
+
+def synced_events(calendar_id):
+    """
+        Returns {event id: (task id, event date)} of the tasks synced to a calendar, the event
+        date being the Google date of the task's due date (see desired_event()).
+    """
+    rows = sql_ops.select_from_where(
+        "task_id, event_id, due_date, project_id, parent_project_id", "todoist", None, None, True) or []
+    calendar_ids = {}
+    events = {}
+    for task_id, event_id, due_date, project_id, parent_project_id in rows:
+        projects = (project_id, parent_project_id)
+        if projects not in calendar_ids:
+            calendar_ids[projects] = find_task_calId(project_id, parent_project_id)
+        if event_id is not None and calendar_ids[projects] == calendar_id:
+            event_date = __todoist_utc_to_date__(due_date) if due_date else None
+            events[event_id] = (task_id, __date_to_google_format__(event_date) if event_date else None)
+    return events
+
+
 def find_cal_id(project_id, parent_id):
     cal_id = None
     task_project_cal_id = None
@@ -736,6 +1283,9 @@ def is_completed(task_id):
 
 
 def is_post_response_valid(sync_response):
+    from jsonschema import exceptions
+    from jsonschema import validate
+
     sync_schema_valid = True
     sync_err_schema_valid = True
     try:
@@ -831,6 +1381,9 @@ def timezone():
     """
         Synchronizes Todoist timezone.
     """
+    # the user is only in the state once synced (e.g. not on a fresh install, without a cache)
+    if 'tz_info' not in api.state['user']:
+        context.current().ensure_synced()
     return api.state['user']['tz_info']['timezone']
 
 
@@ -954,22 +1507,19 @@ def event_desc(todoist_item):
 
     # Premium only
     # Set event description to task's comments, along with a delimeter
-    if premium_user:
-        try:
-            task_notes = api.items.get(todoist_item['id'])
-            if task_notes:
-                task_notes = task_notes['notes']
-
-                for note in range(0, len(task_notes)):
-                    desc += task_notes[note]['content'] + '\n\n'
-        except Exception as err:
-            log.error(err)
+    if context.current().premium_user:
+        for note_content in task_notes(todoist_item['id']):
+            desc += note_content + '\n\n'
     return desc
 
 
+@metrics.timed('handler_seconds', handler='overdue')
 def overdue():
     log.info('Overdue function was run.')
 
+    # the rows of the tasks being pushed by the outbox workers are about to change
+    outbox.settle()
+
     not_overdue_tasks = sql_ops.select_from_where(
         "due_date, event_id, task_id, project_id, parent_project_id", "todoist", "overdue is NULL", None, True)
     if not_overdue_tasks:
@@ -988,22 +1538,19 @@ def overdue():
 
                 # update priority of task from p2 to p1
                 if item['priority'] == 3:  # p2 in Todoist client
-                    item.update(priority=4)  # p1 in Todoist client
-                    api.commit()
-
-                event_name = compute_event_name(item)
+                    with context.current().todoist_lock:
+                        item.update(priority=4)  # p1 in Todoist client
+                        commit()
 
                 calendar_id = find_task_calId(not_overdue_tasks[task][3],
                                               not_overdue_tasks[task][4])
 
                 if calendar_id:
-                    if gcal.update_event_summary(calendar_id,
-                                                 not_overdue_tasks[task][1], event_name) and \
-                        gcal.update_event_color(calendar_id,
-                                                not_overdue_tasks[task][1], 11):
+                    # overdue icon and color --> Gcal
+                    if reconcile_task(calendar_id, item, task_row(task_id)):
 
-                        # update 'todoist' table to reflect overdue status
-                        if sql_ops.update_set_where("todoist", "overdue = ? ", "task_id = ?", overdue, task_id):
+                        # update 'todoist' table to reflect overdue status, along with times_overdue
+                        if update_task_row(task_id, {'overdue': overdue}, became_overdue=True):
                             log.info('Task with id: ' +
                                      str(item['id']) + ' has become overdue.')
                         else:
@@ -1012,21 +1559,10 @@ def overdue():
                     else:
                         log.error('ERROR:  + overdue()')
 
-                # keeps times_overdue up-to-date
-                data = sql_ops.select_from_where(
-                    "times_overdue", "todoist", "task_id", task_id)
-
-                if data:
-                    times_overdue = data[0]
-
-                    if times_overdue is not None:
-                        times_overdue += 1
-                    else:
-                        times_overdue = 1
-                    sql_ops.update_set_where(
-                        "todoist", "times_overdue = ?", "task_id = ?", times_overdue, task_id)
+    flush_task_stats()
 
 
+@metrics.timed('handler_seconds', handler='date_google')
 def date_google(calendar_id, new_due_date=None, item_id=None, item_content=None, event_id=None, extended_date=None):
     op_code = False
     overdue = None
@@ -1060,20 +1596,23 @@ def date_google(calendar_id, new_due_date=None, item_id=None, item_content=None,
 
         event_name = compute_event_name(item)
 
+        row = task_row(item_id)
+        was_overdue = bool(row and row['overdue'])
         if difference < 0:
             overdue = True
             event_name = ICONS['icons.basic']['overdue'] + \
                 ' ' + event_name
             colorId = 11
-        elif difference >= 0 and is_overdue(item_id):
+        elif difference >= 0 and was_overdue:
             # keep color to overdue
             colorId = 11
 
         if gcal.update_event_date(calendar_id, event_id, new_event_date, event_name,
                                   colorId, extended_utc) and new_due_date:
 
-            # update 'todoist' table with new due_date_utc
-            if sql_ops.update_set_where("todoist", "due_date = ?, event_id = ?, overdue = ?", "task_id = ?", new_due_date, event_id, overdue, item_id):
+            # update 'todoist' table with new due_date_utc, along with times_overdue
+            if update_task_row(item_id, {'due_date': new_due_date, 'event_id': event_id, 'overdue': overdue},
+                               became_overdue=bool(overdue and not was_overdue)):
                 op_code = True
             else:
                 op_code = False
@@ -1094,6 +1633,7 @@ def deletion(calendar_id, event_id, task_id=None):
     return op_code
 
 
+@metrics.timed('handler_seconds', handler='checked')
 def checked(cal_id, event_id, task_id, completed_task=None, old_due_date_utc=None):
     op_code = False
 
@@ -1156,15 +1696,7 @@ def checked(cal_id, event_id, task_id, completed_task=None, old_due_date_utc=Non
 
     # if could append tickmark to the front of Todoist
     if op_code:
-
-        row_data = sql_ops.select_from_where('''project_id integer, parent_project_id integer, task_id integer,
-            due_date text, event_id integer, overdue integer, times_overdue integer,
-            times_resheduled_on_due_date''', "todoist", "task_id", task_id)
-
-        if row_data:
-            # to allow for undo functionality
-            if sql_ops.insert_many("todoist_completed", row_data):
-                sql_ops.delete_from_where("todoist", "task_id", task_id)
+        move_to_completed(task_id)
 
         # remove popup reminder from event, since the event is completed
         gcal.update_event_reminders(cal_id, event_id)
@@ -1172,6 +1704,20 @@ def checked(cal_id, event_id, task_id, completed_task=None, old_due_date_utc=Non
     return op_code
 
 
+def move_to_completed(task_id):
+    """
+        Moves the row of a completed task from "todoist" to "todoist_completed".
+    """
+    row_data = sql_ops.select_from_where(
+        TASK_COLUMNS, "todoist", "task_id", task_id)
+
+    if row_data:
+        # to allow for undo functionality
+        if sql_ops.insert_many("todoist_completed", row_data):
+            sql_ops.delete_from_where("todoist", "task_id", task_id)
+
+
+@metrics.timed('handler_seconds', handler='new_task_added')
 def new_task_added(item, completed_due_utc=None):
     task_added = False
     include_task = True
@@ -1208,7 +1754,7 @@ def new_task_added(item, completed_due_utc=None):
                         break
 
         parent_id = __parent_project_id__(item['project_id'])
-        if include_task and parent_id and item['due_date_utc'] and item['project_id'] != inbox_project_id:
+        if include_task and parent_id and item['due_date_utc'] and item['project_id'] != context.current().inbox_project_id:
             due_date_utc = None
             colorId = None
             overdue = None
@@ -1226,8 +1772,9 @@ def new_task_added(item, completed_due_utc=None):
                 if difference < 0:
                     # if overdue and p2 --> slip to q1 in Todoist
                     todoist_item = api.items.get_by_id(item['id'])
-                    todoist_item.update(priority=4)
-                    api.commit()
+                    with context.current().todoist_lock:
+                        todoist_item.update(priority=4)
+                        commit()
                     colorId = 11
                     overdue = True
             else:
@@ -1257,10 +1804,13 @@ def new_task_added(item, completed_due_utc=None):
             else:
                 event_end_datetime = None
 
-            event_location = task_path(item['id'])
+            event_location = task_path(item['id'], item)
             cal_id = find_cal_id(item['project_id'], parent_id)
             event_name = compute_event_name(item, completed_due_utc)
             desc = event_desc(item)
+            inserted_event_hash = event_hash(event_body(event_name, event_start_datetime,
+                                                        event_end_datetime, event_location, desc,
+                                                        colorId, USER_PREFS['events.reminder']))
 
             # create all-day event for each task
             try:
@@ -1275,7 +1825,8 @@ def new_task_added(item, completed_due_utc=None):
 
                 if event_id:
                     todoist_item_info = [item['project_id'], parent_id, item['id'],
-                                         str(item_due_date), event_id, overdue, None, None]
+                                         str(item_due_date), event_id, overdue, 0, 0,
+                                         inserted_event_hash]
 
                     if sql_ops.insert_many("todoist", todoist_item_info):
                         task_added = True
@@ -1285,100 +1836,85 @@ def new_task_added(item, completed_due_utc=None):
 
 
 def task_location(calendar_id, event_id, task_id, project_id):
-    op_code = False
+    """
+        Moves the event of a task to the calendar of its project, should that calendar
+        differ, and records the project of the task in the "todoist" table.
+    """
+    op_code = True
 
     parent_project_id = __parent_project_id__(project_id)
+    cal_id = find_cal_id(project_id, parent_project_id)
 
-    # if project_id and parent_project_id did not change returns row of data, else
-    # if task has been moved to another project or parent project, returns None
-    data = sql_ops.select_from_where("project_id", "todoist", "task_id = ? AND project_id = ? AND parent_project_id = ?",
-                                     False, None, task_id, project_id, parent_project_id)
-
-    # if we have a new project_id, we may have a new parent_project_id as well
-    # either the project_id or the parent_project_id or both are different
-    if not data:
-        event_location = task_path(task_id)
-
-        cal_id = find_cal_id(project_id, parent_project_id)
-
-        try:
-            if gcal.update_event_location(calendar_id, event_id, event_location, cal_id):
-                # calendar_id != destination calendar id
-                if calendar_id != cal_id:
-                    # assume the .move() function was called
-                    changed_location_of_event = event_id
-                op_code = True
-
-                # update project_id and parent_project_id of db with the new data,
-                # so we can perform the move again
-                if sql_ops.update_set_where("todoist", "project_id = ?, parent_project_id = ?", "task_id = ?",
-                                            parent_project_id, project_id, task_id):
-                    op_code = True
-                else:
-                    log.error(
-                        '\nCould update event date on Gcal, but could not update Todoist table.')
-        except Exception as err:
-            log.exception(err)
+    # calendar_id != destination calendar id
+    if cal_id and calendar_id != cal_id:
+        if gcal.move_event(calendar_id, event_id, cal_id):
+            # Gcal reports the moved event as cancelled, which must not delete the task
+            context.current().moved_events.add(event_id)
+        else:
+            op_code = False
+
+    # update project_id and parent_project_id of db with the new data,
+    # so we can perform the move again
+    if op_code and not sql_ops.update_set_where("todoist", "project_id = ?, parent_project_id = ?", "task_id = ?",
+                                                project_id, parent_project_id, task_id):
+        op_code = False
+        log.error(
+            '\nCould update event location on Gcal, but could not update Todoist table.')
     return op_code
 
 
 def undo(task_id):
+    """
+        Moves a task whose completion was undone back to the "todoist" table and pushes its
+        event back to Gcal; returns true if the event was pushed.
+    """
+    op_code = False
     # move task data back to "todoist" table
     if is_completed(task_id):
-        data_row = sql_ops.select_from_where('''project_id integer, parent_project_id integer, task_id integer,
-            due_date text, event_id integer, overdue integer, times_overdue integer,
-            times_resheduled_on_due_date integer''', "todoist_completed", "task_id", None, None, task_id)
+        data_row = sql_ops.select_from_where(
+            TASK_COLUMNS, "todoist_completed", "task_id", task_id)
 
         if data_row and sql_ops.insert_many("todoist", data_row):
             sql_ops.delete_from_where("todoist_completed", "task_id", task_id)
 
             # retrieve calendar_id of the task
             calendar_id = sql_ops.select_from_where("calendar_id", "gcal_ids", "todoist_project_id = ? OR todoist_project_id = ?",
-                                                    None, False, False, data_row[0], data_row[1])
+                                                    None, False, data_row[0], data_row[1])
 
             if calendar_id:
                 calendar_id = calendar_id[0]
 
-            # sync date because if it was overdue and was stetched it won't go back to normal just like that
+            # the event got ticked, may have been stretched and lost its reminders,
+            # thus its whole content is pushed back, regardless of the stored hash
             try:
                 item = api.items.get_by_id(task_id)
-                if item is not None:
-                    date_google(
-                        calendar_id, item['due_date_utc'], task_id, item['content'], data_row[4])
-            except Exception as err:
-                log.exception(
-                    str(err) + 'Could not update date of event in Gcal...')
-
-            # call sync task name now that the data is back in the "todoist" table
-            # task name --> event name (sync)
-            # this has to be called after the code block above, so that icon priority is preserved
-            try:
-                task_name(calendar_id, data_row[4], task_id)
-            except Exception as err:
-                log.exception(err)
-
-            try:
-                # add the reminder popup back, since the event got unticked
-                gcal.update_event_reminders(calendar_id, data_row[4], 300)
+                if calendar_id and item is not None:
+                    todoist_tz = pytz.timezone(timezone())
+                    difference = (__todoist_utc_to_date__(item['due_date_utc']) -
+                                  datetime.now(todoist_tz).date()).days
+                    sql_ops.update_set_where("todoist", "due_date = ?, overdue = ?", "task_id = ?",
+                                             item['due_date_utc'], True if difference < 0 else None, task_id)
+
+                    row = task_row(task_id)
+                    row['event_hash'] = None
+                    op_code = reconcile_task(calendar_id, item, row)
             except Exception as err:
                 log.exception(
-                    str(err) + ' from updating event reminders in undo')
+                    str(err) + 'Could not update event in Gcal, after undoing the completion of the task...')
+    return op_code
 
 
-def task_path(task_id):
+def task_path(task_id, item=None):
     """
-        Compose event location for each event added to Gcal.
+        Compose event location for each event added to Gcal; 'item' spares the lookup of
+        the task (a scan of every item).
     """
     event_location = ''
-    if premium_user:
-        try:
-            task_notes = api.items.get(task_id)
-            if task_notes and task_notes['notes']:
-                event_location = '✉ '
-        except Exception as err:
-            log.debug(err)
+    if context.current().premium_user and task_notes(task_id):
+        event_location = '✉ '
 
-    item = api.items.get_by_id(task_id)
+    if item is None:
+        item = api.items.get_by_id(task_id)
 
     if item is not None and task_id:
         parent_id = __parent_project_id__(item['project_id'])
@@ -1394,7 +1930,7 @@ def task_path(task_id):
                 + ', ' + project_of_item['name']
         elif project_of_item != None and project_of_item['indent'] == 1:
             event_location += project_of_item['name']
-        parent_of_task = api.items.get_by_id(item['id'])
+        parent_of_task = item
 
         # append the name of the parent task to the location of the event of the sub-task
         if item['indent'] != 1 and item['parent_id'] != None:
@@ -1424,16 +1960,28 @@ def update_desc_location(task_id):
         event_id = task_data[3]
 
     if event_id:
-        gcal.update_event_location(
-            cal_id, event_id, new_event_location, cal_id)
-        gcal.update_event_desc(cal_id, event_id, new_desc)
+        # both fields with a single request
+        gcal.patch_event(cal_id, event_id, {'location': new_event_location, 'description': new_desc})
 
 
 def module_init():
+    # the state holds every note once synced (from the cache or the full sync of a fresh
+    # install), later syncs only deliver the changes
+    initial_sync = context.current().initial_sync
+    index_notes(api.state['notes'])
+
     # if db exists, skip first time initialization
-    if os.path.exists(DB_PATH):
+    if os.path.exists(sql_ops.db_path()):
+        # bring tables created by previous versions up to date
+        sql_ops.init_db()
+        init_project_stats()
+
         # to prevent losing sync data when the daemon shuts down
-        sync_todoist(initial_sync)
+        from todoist_gcal_sync import catch_up
+        if catch_up.needed(initial_sync):
+            catch_up.run(initial_sync)
+        else:
+            sync_todoist(initial_sync)
     else:
         sql_ops.init_db()
 
@@ -1442,3 +1990,6 @@ def module_init():
         if USER_PREFS['projects.excluded']:
             exclude_projects()
         data_init()
+
+    # a full sync response is as large as the state
+    context.current().release_initial_sync()
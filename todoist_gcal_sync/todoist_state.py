@@ -0,0 +1,248 @@
+"""
+Compact Todoist state of the daemon: a todoist.TodoistAPI whose local state only holds what
+the sync handlers read.
+
+    - items, projects, notes and labels are kept as records of the fields the daemon reads
+      (__slots__), indexed by id, instead of dicts of every field scanned linearly;
+    - the completed or archived items and projects, along with the notes of those items,
+      are evicted from the state at the start of the next sync cycle (their handlers run
+      meanwhile), see todo.todoist_sync();
+    - the state types the daemon never reads (filters, reminders, collaborators,
+      notifications, day orders...) are not kept at all.
+
+The records are read and written like the dicts they replace (item['content'],
+item.update(...)), and the cache file of todoist-python holds them as such.
+
+Dependencies: todoist-python
+"""
+
+import json
+import logging
+import functools
+
+import todoist
+
+log = logging.getLogger(__name__)
+
+# fields of the objects read by the daemon, the other ones are dropped
+ITEM_FIELDS = ('id', 'project_id', 'content', 'date_string', 'date_lang', 'due_date_utc', 'all_day',
+               'priority', 'indent', 'parent_id', 'item_order', 'labels', 'checked', 'in_history',
+               'is_deleted', 'is_archived')
+PROJECT_FIELDS = ('id', 'name', 'color', 'indent', 'parent_id', 'item_order', 'inbox_project',
+                  'is_deleted', 'is_archived')
+NOTE_FIELDS = ('id', 'item_id', 'project_id', 'content', 'posted', 'is_deleted')
+LABEL_FIELDS = ('id', 'name', 'color', 'item_order', 'is_deleted')
+
+# state types that are not kept
+DROPPED_TYPES = ('collaborators', 'collaborator_states', 'filters', 'live_notifications',
+                 'project_notes', 'reminders', 'locations', 'day_orders')
+
+
+class Record(object):
+    """ The fields of a Todoist object read by the daemon, accessed like a dict. """
+
+    __slots__ = ()
+    fields = frozenset()
+
+    def __init__(self, data):
+        self.update(data)
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.fields:
+            setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + repr(self.to_dict()) + ')'
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def update(self, data=(), **kwargs):
+        for key, value in dict(data, **kwargs).items():
+            if key in self.fields:
+                setattr(self, key, value)
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+class ItemRecord(Record):
+    __slots__ = ITEM_FIELDS
+    fields = frozenset(ITEM_FIELDS)
+
+
+class ProjectRecord(Record):
+    __slots__ = PROJECT_FIELDS
+    fields = frozenset(PROJECT_FIELDS)
+
+
+class NoteRecord(Record):
+    __slots__ = NOTE_FIELDS
+    fields = frozenset(NOTE_FIELDS)
+
+
+class LabelRecord(Record):
+    __slots__ = LABEL_FIELDS
+    fields = frozenset(LABEL_FIELDS)
+
+
+# state type --> (model of todoist-python, record of its data)
+COMPACT_TYPES = {
+    'items': (todoist.models.Item, ItemRecord),
+    'projects': (todoist.models.Project, ProjectRecord),
+    'notes': (todoist.models.Note, NoteRecord),
+    'labels': (todoist.models.Label, LabelRecord),
+}
+
+
+def is_evictable(datatype, obj):
+    """ True if the data of an object of the state is no longer needed past the current sync cycle. """
+    if datatype == 'items':
+        return bool(obj.get('checked') or obj.get('in_history') or obj.get('is_archived'))
+    if datatype == 'projects':
+        return bool(obj.get('is_archived'))
+    return False
+
+
+def state_default(obj):
+    """ JSON form of the objects of the state, for the cache file. """
+    data = obj.data if isinstance(obj, todoist.models.Model) else obj
+    return data.to_dict() if isinstance(data, Record) else data
+
+
+class CompactTodoistAPI(todoist.TodoistAPI):
+    """ todoist.TodoistAPI keeping a compact state (see the module's docstring). """
+
+    def __init__(self, *args, **kwargs):
+        # the cache is read by TodoistAPI.__init__(), through reset_state() and _update_state()
+        self._index = {datatype: {} for datatype in COMPACT_TYPES}
+        self._evictable = {datatype: set() for datatype in COMPACT_TYPES}
+        todoist.TodoistAPI.__init__(self, *args, **kwargs)
+
+        for datatype in COMPACT_TYPES:
+            manager = getattr(self, datatype)
+            manager.get_by_id = functools.partial(self._get_by_id, datatype, manager.get_by_id)
+
+    def reset_state(self):
+        todoist.TodoistAPI.reset_state(self)
+        for datatype in COMPACT_TYPES:
+            self._index[datatype].clear()
+            self._evictable[datatype].clear()
+
+    def _get_by_id(self, datatype, get_by_id, obj_id, only_local=False):
+        """ Manager's get_by_id() through the index; objects added locally are looked up as before. """
+        obj = self._index[datatype].get(obj_id)
+        if obj is not None and obj['id'] == obj_id:
+            return obj
+        return get_by_id(obj_id, only_local)
+
+    def _local_object(self, datatype, obj_id):
+        obj = self._index[datatype].get(obj_id)
+        if obj is None and len(self.state[datatype]) > len(self._index[datatype]):
+            # added by a manager (temporary id), not indexed yet
+            obj = next((local for local in self.state[datatype] if local['id'] == obj_id), None)
+            if obj is not None:
+                self._index[datatype][obj_id] = obj
+        return obj
+
+    def _update_objects(self, datatype, objects):
+        model, record = COMPACT_TYPES[datatype]
+        index = self._index[datatype]
+        removed = set()
+
+        for remote in objects:
+            obj_id = remote['id']
+            local = self._local_object(datatype, obj_id)
+            is_deleted = remote.get('is_deleted', 0)
+
+            if not (is_deleted == 0 or is_deleted is False):
+                if local is not None:
+                    removed.add(obj_id)
+                continue
+
+            if local is not None:
+                local.data.update(remote)
+            else:
+                local = model(record(remote), self)
+                self.state[datatype].append(local)
+                index[obj_id] = local
+
+            if is_evictable(datatype, local.data):
+                self._evictable[datatype].add(obj_id)
+            else:
+                self._evictable[datatype].discard(obj_id)
+
+        if removed:
+            self._remove(datatype, removed)
+
+    def _remove(self, datatype, obj_ids):
+        self.state[datatype] = [obj for obj in self.state[datatype] if obj['id'] not in obj_ids]
+        for obj_id in obj_ids:
+            self._index[datatype].pop(obj_id, None)
+            self._evictable[datatype].discard(obj_id)
+
+    def _update_state(self, syncdata):
+        syncdata = dict(syncdata)
+        for datatype in DROPPED_TYPES:
+            syncdata.pop(datatype, None)
+        for datatype in COMPACT_TYPES:
+            objects = syncdata.pop(datatype, None)
+            if objects:
+                self._update_objects(datatype, objects)
+        todoist.TodoistAPI._update_state(self, syncdata)
+
+    def evict(self):
+        """
+            Drops the completed or archived items and projects of the previous syncs from the
+            state, along with the notes of those items; returns the number of objects dropped.
+            Only called by the main loop, the commits of the workers (api.commit()) may sync
+            objects that are still being handled.
+        """
+        item_ids = self._evictable['items']
+        evicted = 0
+        if item_ids:
+            note_ids = set(note['id'] for note in self.state['notes'] if note['item_id'] in item_ids)
+            evicted += len(item_ids) + len(note_ids)
+            self._remove('notes', note_ids)
+            self._remove('items', set(item_ids))
+        if self._evictable['projects']:
+            evicted += len(self._evictable['projects'])
+            self._remove('projects', set(self._evictable['projects']))
+        if evicted:
+            log.debug('Evicted ' + str(evicted) + ' completed or archived objects from the Todoist state.')
+        return evicted
+
+    def _write_cache(self):
+        if not self.cache:
+            return
+        result = json.dumps(self.state, sort_keys=True, default=state_default)
+        with open(self.cache + self.token + '.json', 'w') as f:
+            f.write(result)
+        with open(self.cache + self.token + '.sync', 'w') as f:
+            f.write(self.sync_token)
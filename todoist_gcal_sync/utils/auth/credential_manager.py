@@ -0,0 +1,104 @@
+"""
+Keeps the Google credentials of the daemon's accounts valid: the access tokens are refreshed
+by a background thread ahead of their expiry, rather than by the first Calendar request
+answered with a 401 in the middle of a sync.
+
+The credentials of an account are a single object shared by its threads; a refresh holds the
+lock of their storage (gcal_OAuth.AtomicStorage), so that concurrent refreshes are not sent
+twice, and the refreshed token is written to the credentials file atomically.
+
+Dependencies: oauth2client
+"""
+
+import os
+import logging
+import weakref
+import threading
+from datetime import datetime, timedelta
+from todoist_gcal_sync.utils.setup import helper as load_cfg
+from todoist_gcal_sync.utils import metrics
+
+log = logging.getLogger(__name__)
+
+# managers whose credentials are refreshed by the thread of refresher()
+_managers = weakref.WeakSet()
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+# not time.sleep(), which the benchmarks stub out for the daemon's pauses
+_refresher_wakeup = threading.Event()
+
+
+class CredentialManager(object):
+    """ Credentials of an account, refreshed 'gcal.tokenRefreshMarginSec' before they expire. """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self._lock = threading.Lock()
+
+    def expires_within(self, seconds):
+        """ True if the access token is missing or expires within 'seconds'. """
+        expiry = self.credentials.token_expiry
+        if not self.credentials.access_token:
+            return True
+        return expiry is not None and expiry - datetime.utcnow() <= timedelta(seconds=seconds)
+
+    def refresh(self, force=False):
+        """
+            Refreshes the access token if it expires within the margin (or with 'force');
+            returns false if the refresh failed, leaving the token to the next try.
+        """
+        from todoist_gcal_sync.utils.gcal_transport import PooledHttp
+
+        with self._lock:
+            if self.credentials.invalid or not (
+                    force or self.expires_within(load_cfg.USER_PREFS['gcal.tokenRefreshMarginSec'])):
+                return True
+            try:
+                with metrics.timer('gcal_token_refresh_seconds'):
+                    self.credentials.refresh(PooledHttp())
+                metrics.inc('gcal_token_refreshes_total', status='ok')
+                log.debug('Google access token refreshed, valid until ' +
+                          str(self.credentials.token_expiry) + ' UTC.')
+                return True
+            except Exception as err:
+                metrics.inc('gcal_token_refreshes_total', status='error')
+                log.warning('Google access token could not be refreshed: ' + str(err))
+                return False
+
+
+def manage(credentials):
+    """ Returns the manager of the credentials, whose token is then refreshed in the background. """
+    manager = CredentialManager(credentials)
+    # a token that expired while the daemon was stopped is refreshed before the first request
+    manager.refresh()
+    _managers.add(manager)
+    refresher()
+    return manager
+
+
+def refresh_all():
+    """ Refreshes the tokens that expire within the margin, of every manager. """
+    for manager in list(_managers):
+        manager.refresh()
+
+
+def run_refresher():
+    """ Body of the refresh thread: checks the tokens every 'gcal.tokenCheckSec'. """
+    while True:
+        _refresher_wakeup.wait(load_cfg.USER_PREFS['gcal.tokenCheckSec'])
+        try:
+            refresh_all()
+        except Exception as err:
+            log.exception(err)
+
+
+def refresher():
+    """
+        Starts the refresh thread of the process, unless it runs already; a process forked
+        from one that started it (supervisor.py) starts its own.
+    """
+    global _refresher_pid
+    with _refresher_lock:
+        if _refresher_pid != os.getpid():
+            threading.Thread(target=run_refresher, name='gcal-token-refresher', daemon=True).start()
+            _refresher_pid = os.getpid()
@@ -13,6 +13,7 @@ https://developers.google.com/google-apps/calendar/quickstart/python#step_1_turn
 import sys
 import os
 import logging
+import tempfile
 
 log = logging.getLogger(__name__)
 __author__ = "Alexandros Nicolaides"
@@ -28,12 +29,6 @@ except ImportError:
     log.info('The program is about to abort due to an ImportError.')
     sys.exit()
 
-try:
-    import argparse
-    flags = argparse.ArgumentParser(parents=[tools.argparser]).parse_args()
-except ImportError:
-    flags = None
-
 """ Should you need to modify any of the three constants below, delete your previously
 saved credentials ~/.credentials/todoist_gcal_sync.json and re-authenticate.
 
@@ -44,10 +39,39 @@ https://developers.google.com/identity/protocols/googlescopes
 SCOPES = 'https://www.googleapis.com/auth/calendar'
 CLIENT_SECRET_FILE = '../credentials/client_secret.json'
 APPLICATION_NAME = 'todoist_gcal_sync'
+CREDENTIAL_FILE_NAME = 'todoist_gcal_sync.json'
+
+
+class AtomicStorage(Storage):
+    """
+        Storage writing the credentials to a temporary file renamed over the credentials
+        file, which is then never left half written, e.g. by a crash during a token refresh.
+    """
+
+    def locked_put(self, credentials):
+        directory, name = os.path.split(self._filename)
+        # mkstemp() creates the file readable by its owner only
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                temp_file.write(credentials.to_json())
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self._filename)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
 
+def credential_file_name(account=None):
+    """ Name of the credentials file of an account of the multi-account mode. """
+    if account is None:
+        return CREDENTIAL_FILE_NAME
+    return APPLICATION_NAME + '.' + account + '.json'
 
-def get_credentials():
-    """Gets valid user credentials from storage.
+
+def get_credentials(file_name=CREDENTIAL_FILE_NAME):
+    """Gets valid user credentials from storage (~/.credentials/<file_name>).
 
     If nothing has been stored, or if the stored credentials are invalid,
     the OAuth2 flow is completed to obtain the new credentials.
@@ -59,13 +83,22 @@ def get_credentials():
     credential_dir = os.path.join(home_dir, '.credentials')
     if not os.path.exists(credential_dir):
         os.makedirs(credential_dir)
-    credential_path = os.path.join(credential_dir, 'todoist_gcal_sync.json')
+    credential_path = os.path.join(credential_dir, file_name)
 
-    store = Storage(credential_path)
+    store = AtomicStorage(credential_path)
     credentials = store.get()
     if not credentials or credentials.invalid:
         flow = client.flow_from_clientsecrets(CLIENT_SECRET_FILE, SCOPES)
         flow.user_agent = APPLICATION_NAME
+
+        # parsed on demand, leaving the arguments of the daemon and of the CLI alone
+        try:
+            import argparse
+            flags = argparse.ArgumentParser(
+                parents=[tools.argparser]).parse_known_args()[0]
+        except ImportError:
+            flags = None
+
         if flags:
             credentials = tools.run_flow(flow, store, flags)
         log.info('Storing credentials to ' + credential_path)
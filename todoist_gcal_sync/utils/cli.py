@@ -1,5 +1,10 @@
+import os
+import sqlite3
 import click
 from todoist_gcal_sync.utils.setup.helper import self_cleanup
+from todoist_gcal_sync.utils import sql_ops
+from todoist_gcal_sync.utils import export
+from todoist_gcal_sync import context
 
 
 @click.group()
@@ -18,8 +23,48 @@ def stop():
 
 
 @click.command(help='Deletes the calendars and the database of the app')
-def cleanup():
-    self_cleanup()
+@click.option('--workers', default=4, show_default=True, help='Number of calendars deleted in parallel.')
+@click.option('--account', default=None, help='Account of "daemon.accounts" to clean up, instead of the single account.')
+def cleanup(workers, account):
+    context.activate(context.AppContext(account))
+    calendars = sql_ops.select_from_where(
+        "calendar_id", "gcal_ids", fetch_all=True) or []
+
+    with click.progressbar(length=len(calendars), label='Deleting calendars') as progress_bar:
+        self_cleanup(workers, progress_bar.update)
+
+
+@click.command(name='export', help='Exports the sync state for analytics, without blocking the daemon')
+@click.argument('out_dir', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='auto', show_default=True,
+              help='Parquet (needs pyarrow) or gzip-compressed CSV; auto picks Parquet if pyarrow is installed.')
+@click.option('--chunk-rows', default=export.CHUNK_ROWS, show_default=True, help='Rows held in memory at a time.')
+@click.option('--account', default=None, help='Account of "daemon.accounts" to export, instead of the single account.')
+def export_state(out_dir, fmt, chunk_rows, account):
+    try:
+        exported = export.export(context.AppContext(account).db_path, out_dir, fmt, chunk_rows)
+    except (RuntimeError, sqlite3.OperationalError) as err:
+        raise click.ClickException(str(err))
+
+    for table_name, (path, count) in exported.items():
+        click.echo(table_name + ': ' + str(count) + ' rows --> ' + path)
+
+
+@click.command(help='Prints how often the tasks of each project became overdue or were rescheduled')
+@click.option('--account', default=None, help='Account of "daemon.accounts", instead of the single account.')
+def stats(account):
+    context.activate(context.AppContext(account))
+    if not os.path.exists(sql_ops.db_path()):
+        raise click.ClickException('No database found at ' + sql_ops.db_path())
+
+    # the rollup kept by the daemon, one row per project
+    rows = sql_ops.select_from_where(
+        "COALESCE((SELECT project_name FROM projects WHERE projects.project_id = project_stats.project_id "
+        "LIMIT 1), project_id), times_overdue, times_rescheduled", "project_stats", None, None, True) or []
+
+    click.echo('{:<40} {:>10} {:>12}'.format('project', 'overdue', 'rescheduled'))
+    for name, times_overdue, times_rescheduled in sorted(rows, key=lambda row: (-row[1], -row[2])):
+        click.echo('{:<40} {:>10} {:>12}'.format(str(name)[:40], times_overdue, times_rescheduled))
 
 
 @click.command(help='Install the systemd script for Ubuntu')
@@ -35,6 +80,8 @@ def exclude_proj():
 cli.add_command(start)
 cli.add_command(stop)
 cli.add_command(cleanup)
+cli.add_command(export_state)
+cli.add_command(stats)
 cli.add_command(systemd)
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+"""
+Caches the discovery document of the Google Calendar API.
+
+discovery.build() downloads and parses the discovery document on every process
+start; the document is kept in ~/.todoist-gcal-sync/cache/ instead and only
+downloaded again once older than 'gcal.discoveryCacheTtlHours'. The static
+document bundled with google-api-python-client (>= 2.0) is used when neither
+the cache nor Google can provide one.
+
+Dependencies: google-api-python-client
+"""
+
+import io
+import os
+import json
+import time
+import logging
+from todoist_gcal_sync.utils.setup import helper
+
+log = logging.getLogger(__name__)
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest'
+DISCOVERY_FILE_NAME = 'calendar_v3_discovery.json'
+
+# the resources used by the daemon
+REQUIRED_RESOURCES = ['calendarList', 'calendars', 'events']
+
+
+def is_valid(document):
+    """ Returns true if the document describes the Calendar API v3 resources used by the daemon. """
+    return isinstance(document, dict) and document.get('name') == 'calendar' \
+        and document.get('version') == 'v3' and 'rootUrl' in document \
+        and all(resource in document.get('resources', {}) for resource in REQUIRED_RESOURCES)
+
+
+def parse_document(content, source):
+    """ Returns the parsed discovery document, or None if it is not valid. """
+    try:
+        document = json.loads(content)
+    except ValueError:
+        document = None
+
+    if not is_valid(document):
+        log.warning('Ignoring invalid discovery document from ' + source + '.')
+        return None
+    return document
+
+
+def read_document(path):
+    """ Returns the discovery document stored at path, or None if missing or invalid. """
+    try:
+        with io.open(path, mode='r', encoding='utf-8') as document_file:
+            content = document_file.read()
+    except OSError:
+        return None
+
+    return parse_document(content, '\'' + path + '\'')
+
+
+def bundled_document():
+    """ Returns the document bundled with google-api-python-client, or None for older versions. """
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        return None
+
+    content = get_static_doc('calendar', 'v3')
+    return parse_document(content, 'google-api-python-client') if content else None
+
+
+def write_document(path, content):
+    """ Replaces the document stored at path atomically, so that readers never see a partial file. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with io.open(temp_path, mode='w', encoding='utf-8') as document_file:
+        document_file.write(content)
+    os.replace(temp_path, path)
+
+
+def fetch_document(http):
+    """ Downloads the discovery document, returning it along with its JSON text. """
+    resp, content = http.request(DISCOVERY_URL)
+    if resp.status != 200:
+        raise OSError('Discovery document request failed with HTTP ' + str(resp.status))
+
+    content = content.decode('utf-8')
+    document = parse_document(content, DISCOVERY_URL)
+    if document is None:
+        raise ValueError('The discovery document downloaded is not valid.')
+    return document, content
+
+
+def load(http, ttl_hours=None):
+    """
+        Returns the discovery document of the Calendar API, from the cache while it is fresh,
+        otherwise from Google, falling back to a stale or bundled copy; None if there is none.
+    """
+    if ttl_hours is None:
+        ttl_hours = helper.USER_PREFS['gcal.discoveryCacheTtlHours']
+    cache_path = helper.CACHE_DIR_PATH + DISCOVERY_FILE_NAME
+
+    document = read_document(cache_path)
+    if document and time.time() - os.path.getmtime(cache_path) < ttl_hours * 3600:
+        return document
+
+    try:
+        fresh_document, content = fetch_document(http)
+        write_document(cache_path, content)
+        log.debug('Discovery document has been cached.')
+        return fresh_document
+    except Exception as err:
+        log.warning(str(err) + ' Could not refresh the discovery document.')
+
+    return document or bundled_document()
@@ -0,0 +1,148 @@
+"""
+Exports the sync state of the daemon ("todoist", "todoist_completed" and "gcal_ids" tables)
+for analytics: one Parquet file per table, or a gzip-compressed CSV file when pyarrow is not
+installed.
+
+The tables are read within a single read transaction of a read-only connection: in WAL mode
+(see sql_ops.init_db()) it sees a consistent snapshot of the database, without blocking the
+writes of the daemon nor being blocked by them. Rows are streamed 'chunk_rows' at a time,
+so memory stays bounded whatever the size of the tables.
+
+Dependencies: pyarrow (optional)
+"""
+
+import os
+import csv
+import gzip
+import importlib.util
+import sqlite3
+import logging
+from urllib.parse import quote
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+TABLES = ('todoist', 'todoist_completed', 'gcal_ids')
+
+# rows held in memory at a time
+CHUNK_ROWS = 10000
+
+FORMATS = ('auto', 'parquet', 'csv')
+
+
+def parquet_available():
+    """ True if pyarrow, needed by the Parquet format, is installed. """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+@contextmanager
+def snapshot(db_path):
+    """ Yields a read-only connection to the database, within a single read transaction. """
+    conn = sqlite3.connect('file:' + quote(os.path.abspath(db_path)) + '?mode=ro', uri=True,
+                           isolation_level=None)
+    try:
+        conn.execute('BEGIN')
+        yield conn
+    finally:
+        conn.close()
+
+
+def chunks(cursor, chunk_rows):
+    """ Yields the rows of a cursor, 'chunk_rows' at a time. """
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+
+def column_types(conn, table_name, columns):
+    """
+        Returns the storage class of each column ('integer', 'real' or 'text'), from the values
+        it holds rather than from its declaration (e.g. "gcal_ids".calendar_id holds text).
+    """
+    storage = conn.execute('SELECT ' + ', '.join('GROUP_CONCAT(DISTINCT typeof(' + column + '))'
+                                                 for column in columns)
+                           + ' FROM ' + table_name).fetchone()
+    types = []
+    for classes in storage:
+        classes = set((classes or 'null').split(',')) - {'null'}
+        if classes <= {'integer'}:
+            types.append('integer')
+        elif classes <= {'integer', 'real'}:
+            types.append('real')
+        else:
+            types.append('text')
+    return types
+
+
+def write_csv(path, columns, rows):
+    """ Writes the header and the chunks of rows to a gzip-compressed CSV file; returns the row count. """
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        for chunk in rows:
+            writer.writerows(chunk)
+            count += len(chunk)
+    return count
+
+
+def write_parquet(path, columns, types, rows):
+    """ Writes the chunks of rows to a Parquet file, one row group per chunk; returns the row count. """
+    import pyarrow
+    import pyarrow.parquet
+
+    arrow_types = {'integer': pyarrow.int64(), 'real': pyarrow.float64(), 'text': pyarrow.string()}
+    schema = pyarrow.schema([(column, arrow_types[column_type])
+                             for column, column_type in zip(columns, types)])
+
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for chunk in rows:
+            arrays = []
+            for index, column_type in enumerate(types):
+                values = [row[index] for row in chunk]
+                if column_type == 'text':
+                    values = [None if value is None else str(value) for value in values]
+                arrays.append(pyarrow.array(values, type=schema.field(index).type))
+            writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+            count += len(chunk)
+    return count
+
+
+def export(db_path, out_dir, fmt='auto', chunk_rows=CHUNK_ROWS, tables=TABLES):
+    """
+        Exports the tables of the database to 'out_dir'; returns {table: (path, rows)}.
+        'fmt' is 'parquet', 'csv' or 'auto' (Parquet if pyarrow is installed).
+    """
+    if fmt == 'auto':
+        fmt = 'parquet' if parquet_available() else 'csv'
+    elif fmt == 'parquet' and not parquet_available():
+        raise RuntimeError('The Parquet format needs pyarrow (pip install todoist_gcal_sync[parquet]).')
+
+    os.makedirs(out_dir, exist_ok=True)
+    exported = {}
+    with snapshot(db_path) as conn:
+        for table_name in tables:
+            cursor = conn.execute('SELECT * FROM ' + table_name)
+            columns = [description[0] for description in cursor.description]
+            path = os.path.join(out_dir, table_name + ('.parquet' if fmt == 'parquet' else '.csv.gz'))
+
+            # readers of 'out_dir' never see a partial file, nor is one left behind
+            temp_path = path + '.tmp'
+            try:
+                if fmt == 'parquet':
+                    count = write_parquet(temp_path, columns, column_types(conn, table_name, columns),
+                                          chunks(cursor, chunk_rows))
+                else:
+                    count = write_csv(temp_path, columns, chunks(cursor, chunk_rows))
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            exported[table_name] = (path, count)
+            log.info('Exported ' + str(count) + ' rows of "' + table_name + '" to ' + path)
+    return exported
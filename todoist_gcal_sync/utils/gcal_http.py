@@ -0,0 +1,73 @@
+"""
+HTTP layer of the Calendar service; requests partial, gzip-compressed responses and records
+the latency, the outcome and the response bytes of each Calendar API call.
+
+Dependencies: google-api-python-client
+"""
+
+import time
+from urllib.parse import urlencode
+from googleapiclient import errors
+from googleapiclient.http import HttpRequest
+from todoist_gcal_sync.utils import metrics
+
+# the fields of the responses read by the callers of each API method (gcal.py); methods
+# that are not listed get the full resource, 'events.list' is projected by gcal_sync itself
+FIELDS = {
+    'calendarList.list': 'items(id,summary,deleted),nextPageToken,nextSyncToken',
+    'calendars.insert': 'id',
+    'calendars.patch': 'id',
+    'events.insert': 'id',
+    'events.patch': 'id',
+    'events.move': 'id',
+    'events.get': 'id,summary,status,start,end,colorId',
+}
+
+
+class InstrumentedHttpRequest(HttpRequest):
+    """
+        HttpRequest applying the field mask of FIELDS to its call and recording one
+        'gcal_request_seconds' sample per call, labelled by API method (e.g. 'events.patch')
+        and by response status, along with the size of the response body once decompressed in
+        'gcal_response_bytes_total' and on the wire in 'gcal_wire_bytes_total'.
+    """
+
+    def __init__(self, http, postproc, uri, method='GET', body=None, headers=None,
+                 methodId=None, resumable=None):
+        fields = FIELDS.get((methodId or '').replace('calendar.', '', 1))
+        if fields and 'fields=' not in uri:
+            uri += ('&' if '?' in uri else '?') + urlencode({'fields': fields})
+        headers = dict(headers or {})
+        headers.setdefault('accept-encoding', 'gzip, deflate')
+        super(InstrumentedHttpRequest, self).__init__(http, self.measured(postproc), uri, method=method,
+                                                      body=body, headers=headers, methodId=methodId,
+                                                      resumable=resumable)
+
+    def measured(self, postproc):
+        """ Wraps postproc to count the bytes of the response body, decompressed and on the wire. """
+        def count_bytes(resp, content):
+            method = (self.methodId or 'unknown').replace('calendar.', '', 1)
+            encoding = resp.get('-content-encoding', 'identity')
+            size = len(content or b'')
+            metrics.inc('gcal_response_bytes_total', size, method=method, encoding=encoding)
+            # '-content-length' is set by gcal_transport.PooledHttp, httplib2 drops the size on the wire
+            metrics.inc('gcal_wire_bytes_total', int(resp.get('-content-length', size)),
+                        method=method, encoding=encoding)
+            return postproc(resp, content)
+        return count_bytes
+
+    def execute(self, http=None, num_retries=0):
+        method = (self.methodId or 'unknown').replace('calendar.', '', 1)
+        status = '200'
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedHttpRequest, self).execute(http=http, num_retries=num_retries)
+        except errors.HttpError as err:
+            status = str(err.resp.status)
+            raise
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            metrics.observe('gcal_request_seconds', time.perf_counter() - start,
+                            method=method, status=status)
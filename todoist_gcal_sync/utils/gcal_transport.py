@@ -0,0 +1,77 @@
+"""
+Transport of the Google clients (Calendar service and OAuth token refreshes): a drop-in
+for httplib2.Http() that sends the requests through a process wide, thread-safe pool of
+keep-alive connections, with connect and read timeouts.
+
+The requests are sent over HTTP/1.1: neither httplib2 nor urllib3 (pinned below 1.23 by
+setup.py) speak HTTP/2, and a client that does (hyper, httpx) would be a new dependency
+of the daemon. Keeping the connections alive gets most of what HTTP/2 would bring to its
+sequential Calendar calls (no TCP and TLS handshake per request).
+
+Dependencies: urllib3, httplib2 (for its Response)
+"""
+
+import os
+import socket
+import logging
+import threading
+import httplib2
+import urllib3
+from todoist_gcal_sync.utils.setup import helper as load_cfg
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """
+        Returns the connection pool of the process, built on first use; a process forked
+        from one that used it (supervisor.py) builds its own rather than sharing the sockets.
+    """
+    global _pool, _pool_pid
+    if _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = urllib3.PoolManager(
+                maxsize=load_cfg.USER_PREFS['gcal.poolSize'], block=False,
+                timeout=urllib3.Timeout(connect=load_cfg.USER_PREFS['gcal.connectTimeoutSec'],
+                                        read=load_cfg.USER_PREFS['gcal.readTimeoutSec']))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+class PooledHttp(object):
+    """
+        httplib2.Http() look-alike for googleapiclient and oauth2client (whose authorize()
+        wraps its request method); instances are cheap, the connections belong to pool().
+
+        Timeouts are raised as socket.timeout and the other connection failures as
+        ConnectionError, as httplib2 would. The size of a compressed body on the wire is
+        kept in '-content-length' (httplib2 drops it).
+    """
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        try:
+            response = pool().request(method, uri, body=body, headers=headers,
+                                      retries=False, redirect=False, preload_content=True)
+        except urllib3.exceptions.TimeoutError as err:
+            raise socket.timeout(str(err))
+        except urllib3.exceptions.HTTPError as err:
+            raise ConnectionError(str(err))
+
+        info = {key.lower(): value for key, value in response.headers.items()}
+        content = response.data
+        if 'content-encoding' in info:
+            # decoded by urllib3; marked the way httplib2 does, the size on the wire is kept
+            info['-content-encoding'] = info.pop('content-encoding')
+            info['-content-length'] = str(response.tell())
+            info['content-length'] = str(len(content))
+        info['status'] = str(response.status)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, content
@@ -0,0 +1,209 @@
+"""
+Runtime metrics of the daemon (counters and histograms).
+
+Exposed in the Prometheus text format by a local HTTP endpoint ('metrics.httpPort')
+and/or periodically dumped as JSON to the logs dir ('metrics.dumpIntervalSec').
+"""
+
+import io
+import os
+import json
+import time
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+log = logging.getLogger(__name__)
+
+PREFIX = 'todoist_gcal_sync_'
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+
+# (name, labels) --> value
+counters = {}
+
+# (name, labels) --> [count of each bucket..., sum, count]
+histograms = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """ Increments a counter. """
+    key = _key(name, labels)
+    with _lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """ Records a value (in seconds) to a histogram. """
+    key = _key(name, labels)
+    with _lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(BUCKETS) + 2)
+
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """ Records the duration of the block to a histogram. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """ Decorator recording the duration of each call to a histogram. """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    """ Drops every metric recorded so far. """
+    with _lock:
+        counters.clear()
+        histograms.clear()
+
+
+def _labels_str(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(key + '="' + str(value).replace('"', '\\"') + '"'
+                          for key, value in pairs) + '}'
+
+
+def render_prometheus():
+    """ Returns the metrics in the Prometheus text exposition format. """
+    lines = []
+    with _lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, list(value))
+                                 for key, value in histograms.items())
+
+    typed = set()
+    for (name, labels), value in counter_items:
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE ' + PREFIX + name + ' counter')
+        lines.append(PREFIX + name + _labels_str(labels) + ' ' + str(value))
+
+    for (name, labels), histogram in histogram_items:
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE ' + PREFIX + name + ' histogram')
+        for bound, count in zip(BUCKETS, histogram):
+            lines.append(PREFIX + name + '_bucket' +
+                         _labels_str(labels, [('le', bound)]) + ' ' + str(count))
+        lines.append(PREFIX + name + '_bucket' +
+                     _labels_str(labels, [('le', '+Inf')]) + ' ' + str(histogram[-1]))
+        lines.append(PREFIX + name + '_sum' +
+                     _labels_str(labels) + ' ' + repr(histogram[-2]))
+        lines.append(PREFIX + name + '_count' +
+                     _labels_str(labels) + ' ' + str(histogram[-1]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot(reset=False):
+    """
+        Returns the metrics as a JSON serializable dict; with 'reset', the metrics are
+        dropped in the same step, so that successive snapshots hold the increments.
+    """
+    with _lock:
+        result = {
+            'time': time.time(),
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(counters.items())],
+            'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(zip(BUCKETS, histogram)),
+                            'sum': histogram[-2], 'count': histogram[-1]}
+                           for (name, labels), histogram in sorted(histograms.items())],
+        }
+        if reset:
+            counters.clear()
+            histograms.clear()
+        return result
+
+
+def merge(increments):
+    """ Adds the metrics of a snapshot(reset=True), e.g. of a worker process, to these. """
+    with _lock:
+        for counter in increments['counters']:
+            key = _key(counter['name'], counter['labels'])
+            counters[key] = counters.get(key, 0) + counter['value']
+
+        for entry in increments['histograms']:
+            key = _key(entry['name'], entry['labels'])
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, (bound, count) in enumerate(entry['buckets']):
+                histogram[i] += count
+            histogram[-2] += entry['sum']
+            histogram[-1] += entry['count']
+
+
+def dump_json(path):
+    """ Writes the metrics to a JSON file, atomically. """
+    temp_path = path + '.tmp'
+    try:
+        with io.open(temp_path, mode='w', encoding='utf-8') as metrics_file:
+            json.dump(snapshot(), metrics_file)
+        os.replace(temp_path, path)
+    except OSError as err:
+        log.warning(str(err) + ' Could not dump the metrics.')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """ Serves the metrics in the Prometheus text format at /metrics. """
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """ Serves the metrics from a daemon thread; returns the server. """
+    server = MetricsServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='metrics-http', daemon=True)
+    thread.start()
+    log.info('Metrics are served at http://' + host + ':' +
+             str(server.server_address[1]) + '/metrics')
+    return server
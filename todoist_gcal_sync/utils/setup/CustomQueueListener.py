@@ -1,8 +1,10 @@
+import queue
 import logging
+import logging.handlers
 
 
 class CustomQueueListener(logging.handlers.QueueListener):
-    def __init__(self, queue, *handlers):
+    def __init__(self, queue, *handlers, batch_size=256):
         super(CustomQueueListener, self).__init__(queue, *handlers)
         """
         Initialise an instance with the specified queue and
@@ -10,6 +12,15 @@ class CustomQueueListener(logging.handlers.QueueListener):
         """
         # Changing this to a list from tuple in the parent class
         self.handlers = list(handlers)
+        # records drained from the queue per wake up
+        self.batch_size = batch_size
+
+    @property
+    def level(self):
+        """
+        Lowest level of the handlers; records below it are dropped before being handled.
+        """
+        return min((handler.level for handler in self.handlers), default=logging.CRITICAL)
 
     def handle(self, record):
         """
@@ -20,10 +31,65 @@ class CustomQueueListener(logging.handlers.QueueListener):
 
         :param record: The record to handle.
         """
-        record = self.prepare(record)
+        self.handle_batch([record])
+
+    def handle_batch(self, records):
+        """
+        Offers a batch of records to the handlers; handlers with a 'handle_batch'
+        method (see BatchingFileHandler) take the whole batch at once.
+
+        :param records: The records to handle.
+        """
+        level = self.level
+        records = [record for record in records if record.levelno >= level]
+        if not records:
+            return
+
         for handler in self.handlers:
-            if record.levelno >= handler.level:  # This check is not in the parent class
-                handler.handle(record)
+            # This check is not in the parent class
+            handled = [record for record in records if record.levelno >= handler.level]
+            if not handled:
+                continue
+            if hasattr(handler, 'handle_batch'):
+                handler.handle_batch(handled)
+            else:
+                for record in handled:
+                    handler.handle(record)
+
+    def _monitor(self):
+        """
+        Override monitor the queue for records.
+
+        Drains up to 'batch_size' records per wake up, and hands them over to the
+        handlers as one batch.
+        """
+        q = self.queue
+        has_task_done = hasattr(q, 'task_done')
+        while True:
+            try:
+                batch = [self.dequeue(True)]
+            except queue.Empty:
+                break
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+
+            stop = self._sentinel in batch
+            self.handle_batch([record for record in batch if record is not self._sentinel])
+            if has_task_done:
+                for _ in batch:
+                    q.task_done()
+            if stop:
+                break
+
+    def enqueue_sentinel(self):
+        """
+        Override enqueue the sentinel; waits for room in a bounded queue.
+        """
+        self.queue.put(self._sentinel)
 
     def addHandler(self, hdlr):
         """
@@ -10,8 +10,8 @@ import sys
 import io
 import json
 import logging
+from collections.abc import Mapping
 from jsmin import jsmin  # allows for json comments
-from todoist_gcal_sync import gcal
 
 __author__ = "Alexandros Nicolaides"
 __status__ = "production"
@@ -33,12 +33,13 @@ DEBUG_LOG_FILE_PATH = LOGS_DIR_PATH + 'debug.log'
 INFO_LOG_FILE_PATH = LOGS_DIR_PATH + 'info.log'
 ERROR_LOG_FILE_PATH = LOGS_DIR_PATH + 'error.log'
 DB_DIR_PATH = INSTALL_PATH + 'db/'
+CACHE_DIR_PATH = INSTALL_PATH + 'cache/'
 DB_PATH = DB_DIR_PATH + DB_FILE_NAME
 
 
 def build_folder_higherarchy():
     """ Builds folder higherarchy of the daemon. """
-    dirs = ['.credentials', 'logs', 'db']
+    dirs = ['.credentials', 'logs', 'db', 'cache']
 
     for dir_name in dirs:
         dir_path = INSTALL_PATH + dir_name
@@ -62,21 +63,57 @@ def load_json(file_name, dir_path=CFG_DIR_PATH):
         sys.exit()
 
 
-def self_cleanup():
-    """ Erases the data of the daemon. """
-    if gcal.delete_cals():
+class LazyJSON(Mapping):
+    """ JSON config file of the project, loaded on first access. """
+
+    def __init__(self, file_name, dir_path=CFG_DIR_PATH):
+        self.file_name = file_name
+        self.dir_path = dir_path
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = load_json(self.file_name, self.dir_path)
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def self_cleanup(workers=4, progress=None):
+    """
+        Erases the data of the daemon, for the account of the current context. The database
+        is kept until every calendar has been deleted, so that an interrupted cleanup can be
+        resumed.
+    """
+    from todoist_gcal_sync import gcal
+    from todoist_gcal_sync import context
+    from todoist_gcal_sync.utils import sql_ops
+
+    if gcal.delete_cals(workers, progress):
         try:
-            os.remove(DB_PATH)
-            shutil.rmtree(LOGS_DIR_PATH)
+            os.remove(sql_ops.db_path())
+            # the logs are shared by the accounts of the multi-account mode
+            if context.current().account is None:
+                shutil.rmtree(LOGS_DIR_PATH)
         except OSError as err:
             log.error(
                 str(err) + " Could not delete 'data.db', as part of the self cleanup process.")
             log.warning('The program is about to abort operation.')
             sys.exit()
         log.info('All data used by the daemon have been deleted.')
+    else:
+        log.warning('Some calendars could not be deleted; run the cleanup again to resume.')
 
 
-USER_PREFS = load_json('settings.json')
-TODOIST_SCHEMA = load_json('todoist_schema.json')
-ICONS = load_json('icons.json')
-DB_SCHEMA = load_json('db_schema.json')
+USER_PREFS = LazyJSON('settings.json')
+TODOIST_SCHEMA = LazyJSON('todoist_schema.json')
+ICONS = LazyJSON('icons.json')
+DB_SCHEMA = LazyJSON('db_schema.json')
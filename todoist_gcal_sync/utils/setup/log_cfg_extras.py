@@ -1,5 +1,10 @@
+import sys
 import time
+import queue
 import logging
+import logging.handlers
+import threading
+from todoist_gcal_sync.utils import metrics
 
 
 class UTCFormatter(logging.Formatter):
@@ -13,3 +18,132 @@ class MyFilter():
 
     def filter(self, logRecord):
         return self.__operator(logRecord.levelno, self.__level)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+        QueueHandler for a bounded queue, which never blocks the logging thread for long.
+
+        When the queue is full, records below WARNING are dropped right away, the others
+        after waiting up to 'block_timeout' seconds for room. The number of dropped records
+        is logged as a warning once the queue has room again.
+    """
+
+    def __init__(self, queue, block_timeout=0.05):
+        super(BoundedQueueHandler, self).__init__(queue)
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        """
+            Renders the message and the traceback once, in the logging thread, without
+            formatting the whole record (the handlers of the listener do that).
+        """
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                try:
+                    self.queue.put(record, timeout=self.block_timeout)
+                    return
+                except queue.Full:
+                    pass
+            with self._dropped_lock:
+                self.dropped += 1
+            metrics.inc('log_records_dropped_total')
+            return
+
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': str(dropped) + ' log records were dropped, the log queue was full.'}))
+            except queue.Full:
+                with self._dropped_lock:
+                    self.dropped += dropped
+
+
+class BatchingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+        TimedRotatingFileHandler flushing its stream once per batch of records (see
+        CustomQueueListener), instead of once per record.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._in_batch = False
+        super(BatchingFileHandler, self).__init__(*args, **kwargs)
+
+    def handle_batch(self, records):
+        self.acquire()
+        try:
+            self._in_batch = True
+            for record in records:
+                if self.filter(record):
+                    self.emit(record)
+        finally:
+            self._in_batch = False
+            self.flush()
+            self.release()
+
+    def flush(self):
+        if not self._in_batch:
+            super(BatchingFileHandler, self).flush()
+
+
+class LogSampler(object):
+    """
+        Rate-limited logging for hot loops; lets 'burst' records through per 'period'
+        seconds, and counts the others, which are reported along with the next record
+        let through.
+
+        sampled_debug = LogSampler(log, logging.DEBUG)
+        sampled_debug('Event changed: %s', event['summary'])
+
+        Arguments are only formatted for the records let through.
+    """
+
+    def __init__(self, logger, level=logging.DEBUG, burst=20, period=60.0):
+        self.logger = logger
+        self.level = level
+        self.burst = burst
+        self.period = period
+        self.suppressed = 0
+        self._window_start = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, msg, *args):
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= self.period:
+                self._window_start = now
+                self._window_count = 0
+            if self._window_count >= self.burst:
+                self.suppressed += 1
+                return
+            self._window_count += 1
+            suppressed, self.suppressed = self.suppressed, 0
+
+        if suppressed:
+            msg = msg + ' (' + str(suppressed) + ' similar records suppressed)'
+        # the record points at the caller, not at this method (no 'stacklevel' before Python 3.8)
+        caller = sys._getframe(1)
+        record = self.logger.makeRecord(self.logger.name, self.level, caller.f_code.co_filename,
+                                        caller.f_lineno, msg, args, None, caller.f_code.co_name)
+        self.logger.handle(record)
@@ -11,14 +11,16 @@ import logging.handlers
 import queue
 import atexit
 from todoist_gcal_sync.utils.setup.helper import load_json, CREDS_DIR_PATH, LOGS_DIR_PATH, MAIL_SMTP_FILE_NAME
+from todoist_gcal_sync.utils.setup.helper import USER_PREFS
 from todoist_gcal_sync.utils.setup.helper import DEBUG_LOG_FILE_PATH, INFO_LOG_FILE_PATH, ERROR_LOG_FILE_PATH
 from todoist_gcal_sync.utils.setup.CustomQueueListener import CustomQueueListener
-from todoist_gcal_sync.utils.setup.log_cfg_extras import UTCFormatter, MyFilter
+from todoist_gcal_sync.utils.setup.log_cfg_extras import UTCFormatter, MyFilter, BoundedQueueHandler
 
 __author__ = "Alexandros Nicolaides"
 __status__ = "production"
 
-my_queue = queue.Queue(-1)
+# bounded, so that memory stays flat under event storms (see BoundedQueueHandler)
+my_queue = queue.Queue(USER_PREFS['logging.queueSize'])
 
 if not os.path.exists(LOGS_DIR_PATH):
     try:
@@ -60,7 +62,7 @@ logging_cfg = dict({
             "stream": "ext://sys.stdout"
         },
         "debug_file_handler": {
-            "class": "logging.handlers.TimedRotatingFileHandler",
+            "class": "todoist_gcal_sync.utils.setup.log_cfg_extras.BatchingFileHandler",
             "level": "DEBUG",
             "formatter": "standard",
             "filename": DEBUG_LOG_FILE_PATH,
@@ -74,7 +76,7 @@ logging_cfg = dict({
             ]
         },
         "info_file_handler": {
-            "class": "logging.handlers.TimedRotatingFileHandler",
+            "class": "todoist_gcal_sync.utils.setup.log_cfg_extras.BatchingFileHandler",
             "level": "INFO",
             "formatter": "standard",
             "filename": INFO_LOG_FILE_PATH,
@@ -88,7 +90,7 @@ logging_cfg = dict({
             ]
         },
         "err_file_handler": {
-            "class": "logging.handlers.TimedRotatingFileHandler",
+            "class": "todoist_gcal_sync.utils.setup.log_cfg_extras.BatchingFileHandler",
             "level": "WARNING",
             "formatter": "standard",
             "filename": ERROR_LOG_FILE_PATH,
@@ -102,7 +104,7 @@ logging_cfg = dict({
             ]
         },
         "q_handler": {
-            "class": "logging.handlers.QueueHandler",
+            "()": BoundedQueueHandler,
             "queue": my_queue
         }
     },
@@ -113,6 +115,13 @@ logging_cfg = dict({
                 "q_handler"
             ]
         },
+        "todoist_gcal_sync": {
+            "level": USER_PREFS['logging.level'],
+            "handlers": [
+                "q_handler"
+            ],
+            "propagate": False
+        },
         "__main__": {
             "level": "DEBUG",
             "handlers": [
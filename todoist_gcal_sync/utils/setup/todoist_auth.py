@@ -22,6 +22,13 @@ class APItokenError(Exception):
     pass
 
 
+def token_file_name(account=None):
+    """ Name of the token file of an account of the multi-account mode, e.g. 'alice.todoist_token'. """
+    if account is None:
+        return TODOIST_TOKEN_FILE_NAME
+    return account + '.' + TODOIST_TOKEN_FILE_NAME
+
+
 def retrieve_token(token_file_name):
     """
         Retrieves Todoist API token from file.
@@ -43,6 +50,3 @@ def retrieve_token(token_file_name):
             sys.exit()
 
     return api_token
-
-
-todoist_api_token = retrieve_token(TODOIST_TOKEN_FILE_NAME)
@@ -10,25 +10,50 @@ WARNING:
 import sqlite3
 import logging
 from todoist_gcal_sync.utils.setup import helper
+from todoist_gcal_sync.utils import metrics
+from todoist_gcal_sync import context
 import inspect
 
 log = logging.getLogger(__name__)
 __author__ = "Alexandros Nicolaides"
 __status__ = "testing"
 
+# (index name, table, column) of the lookups of the sync handlers, created by init_db()
+INDEXES = [('todoist_event_id_idx', 'todoist', 'event_id'),
+           ('todoist_task_id_idx', 'todoist', 'task_id')]
+
+# bound parameters per statement, below the SQLITE_MAX_VARIABLE_NUMBER of older SQLite (999)
+MAX_VARIABLES = 900
+
+
+def db_path():
+    """ Path of the database of the current account (see context.AppContext.db_path). """
+    return context.current().db_path
+
 
 def init_db():
     """
-    Creates tables by fetching info from 'db_schema.json'.
+    Creates tables by fetching info from 'db_schema.json', adding any column
+    missing from the tables created by previous versions.
     """
     for table_name in helper.DB_SCHEMA:
         for table_schema in helper.DB_SCHEMA[table_name]:
             create_table(table_name, table_schema)
+            add_missing_columns(table_name, table_schema)
+
+    for index_name, table_name, column_name in INDEXES:
+        create_index(index_name, table_name, column_name)
 
+    # readers are not blocked by the writes of the outbox workers
+    conn = sqlite3.connect(db_path())
+    with conn:
+        conn.execute("PRAGMA journal_mode=WAL")
 
+
+@metrics.timed('db_query_seconds', op='ddl')
 def create_table(table_name, table_schema):
     """ Create a table in the db using the args provided. """
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
 
     with conn:
         c = conn.cursor()
@@ -39,10 +64,44 @@ def create_table(table_name, table_schema):
         conn.commit()
 
 
+@metrics.timed('db_query_seconds', op='ddl')
+def create_index(index_name, table_name, column_name):
+    """ Creates an index on a column of a table, unless it exists. """
+    conn = sqlite3.connect(db_path())
+
+    with conn:
+        c = conn.cursor()
+
+        c.execute("CREATE INDEX IF NOT EXISTS " + index_name + " ON " +
+                  table_name + " (" + column_name + ")")
+
+
+@metrics.timed('db_query_seconds', op='ddl')
+def add_missing_columns(table_name, table_schema):
+    """ Adds the columns of the schema provided that the table lacks. """
+    conn = sqlite3.connect(db_path())
+
+    with conn:
+        c = conn.cursor()
+
+        c.execute("PRAGMA table_info(" + table_name + ")")
+        table_columns = [column[1] for column in c.fetchall()]
+
+        for column in table_schema.split(','):
+            if column.split()[0] not in table_columns:
+                c.execute("ALTER TABLE " + table_name +
+                          " ADD COLUMN " + column.strip())
+                log.info("Column '" + column.split()[0] + "' has been added to the '"
+                         + table_name + "' table.")
+
+        conn.commit()
+
+
+@metrics.timed('db_query_seconds', op='delete')
 def truncate_table(table_name):
     """ Truncates table provided. """
     truncated = True
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
 
     with conn:
         c = conn.cursor()
@@ -56,10 +115,11 @@ def truncate_table(table_name):
     return truncated
 
 
+@metrics.timed('db_query_seconds', op='delete')
 def delete_from_where(table_name, column_name, condition):
     """ Returns true upon successful deletion, otherwise false. """
     deleted = True
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
 
     with conn:
         c = conn.cursor()
@@ -74,9 +134,32 @@ def delete_from_where(table_name, column_name, condition):
     return deleted
 
 
+@metrics.timed('db_query_seconds', op='delete')
+def delete_where_in(table_name, column_name, values):
+    """ Deletes the rows whose column holds one of the values provided, in a single transaction. """
+    deleted = True
+    values = list(values)
+    conn = sqlite3.connect(db_path())
+
+    with conn:
+        c = conn.cursor()
+
+        try:
+            for start in range(0, len(values), MAX_VARIABLES):
+                chunk = values[start:start + MAX_VARIABLES]
+                c.execute("DELETE FROM " + table_name + " WHERE " + column_name +
+                          " IN (" + generate_args(len(chunk)) + ")", chunk)
+            conn.commit()
+        except sqlite3.OperationalError as err:
+            deleted = False
+            log.exception(err)
+    return deleted
+
+
+@metrics.timed('db_query_seconds', op='select')
 def select_from_where(select_operand, table_name, where_operand=None, condition=None, fetch_all=False, *args):
     """ Returns data upon successful retrieval from db. """
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
     data = None
     with conn:
         c = conn.cursor()
@@ -103,10 +186,34 @@ def select_from_where(select_operand, table_name, where_operand=None, condition=
     return data
 
 
+@metrics.timed('db_query_seconds', op='select')
+def select_where_in(select_operand, table_name, column_name, values):
+    """
+        Returns the rows whose column holds one of the values provided, with a query per
+        MAX_VARIABLES values.
+    """
+    values = list(values)
+    rows = []
+    conn = sqlite3.connect(db_path())
+    with conn:
+        c = conn.cursor()
+
+        for start in range(0, len(values), MAX_VARIABLES):
+            chunk = values[start:start + MAX_VARIABLES]
+            try:
+                c.execute("SELECT " + select_operand + " FROM " + table_name + " WHERE " +
+                          column_name + " IN (" + generate_args(len(chunk)) + ")", chunk)
+                rows.extend(c.fetchall())
+            except sqlite3.OperationalError as err:
+                log.exception(err)
+    return rows
+
+
+@metrics.timed('db_query_seconds', op='insert')
 def insert(table_name, *args):
     """ Inserts data to table. """
     insertion = True
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
 
     with conn:
         c = conn.cursor()
@@ -123,10 +230,11 @@ def insert(table_name, *args):
     return insertion
 
 
+@metrics.timed('db_query_seconds', op='insert')
 def insert_many(table_name, row_data):
     """ Inserts row of data to table. """
     insertion = True
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
 
     with conn:
         c = conn.cursor()
@@ -142,10 +250,35 @@ def insert_many(table_name, row_data):
     return insertion
 
 
+@metrics.timed('db_query_seconds', op='insert')
+def insert_rows(table_name, rows):
+    """ Inserts rows of data to table, in a single transaction. """
+    insertion = True
+    rows = list(rows)
+    if not rows:
+        return insertion
+
+    conn = sqlite3.connect(db_path())
+
+    with conn:
+        c = conn.cursor()
+
+        questionmarks = generate_args(len(rows[0]))
+        try:
+            c.executemany("INSERT INTO " + table_name +
+                          " VALUES (" + questionmarks + ")", rows)
+            conn.commit()
+        except sqlite3.OperationalError as err:
+            insertion = False
+            log.exception(err)
+    return insertion
+
+
+@metrics.timed('db_query_seconds', op='update')
 def update_set_where(table_name, columns, where_operand, *args):
     """ Updates table based on some conditions. """
     updated = True
-    conn = sqlite3.connect(helper.DB_PATH)
+    conn = sqlite3.connect(db_path())
 
     with conn:
         c = conn.cursor()
@@ -160,6 +293,49 @@ def update_set_where(table_name, columns, where_operand, *args):
     return updated
 
 
+@metrics.timed('db_query_seconds', op='update')
+def update_rows(table_name, columns, where_operand, rows):
+    """ Runs an update once per row of arguments, in a single transaction. """
+    updated = True
+    rows = list(rows)
+    if not rows:
+        return updated
+
+    conn = sqlite3.connect(db_path())
+
+    with conn:
+        c = conn.cursor()
+
+        try:
+            c.executemany("UPDATE " + table_name + " SET " +
+                          columns + " WHERE " + where_operand, rows)
+            conn.commit()
+        except sqlite3.OperationalError as err:
+            updated = False
+            log.exception(err)
+    return updated
+
+
+@metrics.timed('db_query_seconds', op='transaction')
+def run_transaction(statements):
+    """ Runs the (statement, args) pairs in a single transaction; returns true once committed. """
+    committed = True
+    conn = sqlite3.connect(db_path())
+
+    with conn:
+        c = conn.cursor()
+
+        try:
+            for statement, args in statements:
+                c.execute(statement, args)
+            conn.commit()
+        except sqlite3.OperationalError as err:
+            committed = False
+            conn.rollback()
+            log.exception(err)
+    return committed
+
+
 def generate_args(num):
     """ Returns questionmarks separated by commas as a string to be used by the insert command. """
     args_str = ''
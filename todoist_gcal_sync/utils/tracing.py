@@ -0,0 +1,200 @@
+"""
+Trace spans of the daemon, for the '--profile' mode.
+
+Functions are only wrapped into spans once enable() has been called, so that the
+daemon runs the plain functions (no overhead at all) when profiling is off.
+The spans of each sync cycle are dumped to the logs dir both as Chrome trace JSON
+(chrome://tracing, https://ui.perfetto.dev, speedscope) and as collapsed stacks
+(flamegraph.pl, speedscope). Only the last dumps are kept, so that a long-running
+profiled daemon does not fill the disk.
+"""
+
+import io
+import os
+import json
+import time
+import inspect
+import logging
+import threading
+import functools
+from datetime import datetime
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+enabled = False
+
+# cycles faster than this are not dumped
+min_cycle_ms = 0
+
+# number of cycle dumps kept in trace_dir, the oldest ones are removed
+MAX_DUMPS = 100
+max_dumps = MAX_DUMPS
+
+# directory the traces are dumped into
+trace_dir = None
+
+_lock = threading.Lock()
+_local = threading.local()
+
+# finished spans since the last dump, as Chrome trace 'complete' events
+_events = []
+
+# ';'-joined stack --> self time (us) since the last dump
+_stacks = {}
+
+
+def _now_us():
+    return time.perf_counter() * 1e6
+
+
+def _scalar_args(signature, args, kwargs):
+    """ Returns the str/int arguments of a call, e.g. the calendar, event and task ids. """
+    try:
+        bound = signature.bind_partial(*args, **kwargs).arguments
+    except TypeError:
+        return {}
+    return {name: value for name, value in bound.items()
+            if isinstance(value, (str, int)) and not isinstance(value, bool)}
+
+
+@contextmanager
+def span(name, **args):
+    """ Records the block as a span named 'name'; a no-op while profiling is off. """
+    if not enabled:
+        yield
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    # [name, children time]
+    frame = [name, 0.0]
+    stack.append(frame)
+    start = _now_us()
+    try:
+        yield
+    finally:
+        duration = _now_us() - start
+        path = ';'.join(f[0] for f in stack)
+        stack.pop()
+        if stack:
+            stack[-1][1] += duration
+
+        event = {'name': name, 'ph': 'X', 'ts': start, 'dur': duration,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        with _lock:
+            _events.append(event)
+            _stacks[path] = _stacks.get(path, 0) + duration - frame[1]
+
+
+def traced(func, name=None):
+    """ Returns 'func' wrapped into a span named after it. """
+    name = name or func.__module__.rsplit('.', 1)[-1] + '.' + func.__name__
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        with span(name, **_scalar_args(signature, args, kwargs)):
+            return func(*args, **kwargs)
+
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def instrument(module, names=None):
+    """
+        Replaces the functions of a module (all of its public ones by default) with traced
+        ones. Callers going through the module, e.g. 'gcal.patch_event()', get the spans.
+    """
+    if names is None:
+        names = [name for name, value in vars(module).items()
+                 if inspect.isfunction(value) and value.__module__ == module.__name__
+                 and not name.startswith('_')]
+
+    for name in names:
+        func = getattr(module, name)
+        if not getattr(func, '__traced__', False):
+            setattr(module, name, traced(func))
+
+
+def enable(directory, cycle_threshold_ms=0, keep=MAX_DUMPS):
+    """
+        Turns profiling on; the traces of the cycles slower than the threshold go to 'directory',
+        which keeps the last 'keep' of them.
+    """
+    global enabled, min_cycle_ms, trace_dir, max_dumps
+
+    os.makedirs(directory, exist_ok=True)
+    trace_dir = directory
+    min_cycle_ms = cycle_threshold_ms
+    max_dumps = keep
+    enabled = True
+    log.info('Profiling is on; traces of the cycles slower than ' + str(cycle_threshold_ms) +
+             'ms are dumped to ' + directory + ' (the last ' + str(keep) + ' are kept)')
+
+
+def drain():
+    """ Returns and forgets the spans recorded so far, as (events, stacks). """
+    global _events, _stacks
+    with _lock:
+        events, stacks = _events, _stacks
+        _events, _stacks = [], {}
+    return events, stacks
+
+
+def dump(events, stacks, name):
+    """ Writes the spans to '<name>.json' (Chrome trace) and '<name>.folded' (collapsed stacks). """
+    path = os.path.join(trace_dir, name)
+    try:
+        with io.open(path + '.json', mode='w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+        with io.open(path + '.folded', mode='w', encoding='utf-8') as folded_file:
+            for stack, self_us in sorted(stacks.items()):
+                folded_file.write(stack + ' ' + str(int(self_us)) + '\n')
+    except OSError as err:
+        log.warning(str(err) + ' Could not dump the trace.')
+
+
+def prune():
+    """ Removes the oldest cycle dumps of trace_dir, beyond the last max_dumps. """
+    try:
+        names = sorted(name[:-len('.json')] for name in os.listdir(trace_dir)
+                       if name.startswith('cycle-') and name.endswith('.json'))
+        for name in names[:max(len(names) - max_dumps, 0)]:
+            for ext in ('.json', '.folded'):
+                path = os.path.join(trace_dir, name + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+    except OSError as err:
+        log.warning(str(err) + ' Could not remove the oldest traces.')
+
+
+@contextmanager
+def cycle():
+    """
+        Dumps the spans recorded until the end of the block (including those of the
+        scheduled jobs run since the previous cycle), if the cycle was slow enough.
+    """
+    if not enabled:
+        yield
+        return
+
+    try:
+        with span('cycle'):
+            yield
+    finally:
+        events, stacks = drain()
+        if events:
+            elapsed_ms = (max(e['ts'] + e['dur'] for e in events) -
+                          min(e['ts'] for e in events)) / 1000
+            if elapsed_ms >= min_cycle_ms:
+                dump(events, stacks, 'cycle-' + datetime.now().strftime('%Y%m%d-%H%M%S-%f') +
+                     '-' + str(int(elapsed_ms)) + 'ms')
+                prune()